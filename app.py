@@ -1,27 +1,46 @@
 from flask import Flask, request, jsonify
 from flask_restful import Api, Resource
-from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
-from sqlalchemy.orm import Session
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import JWTManager, create_access_token
 from models import *
-import bcrypt
-
-session = Session()
-
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///school.db'
-app.config['JWT_SECRET_KEY'] = 'your_secret_key'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-db.init_app(app)
-
-api = Api(app)
-jwt = JWTManager(app)
-migrate = Migrate(app, db)
-
-CORS(app)
+from pagination import paginate
+from bulk import bulk_create, bulk_update, bulk_delete, validator_for
+from auth import role_required
+from grades import grade_filters, grade_summary
+from reports import class_rankings, refresh_classes, refresh_grade_rows, refresh_students, report_card
+from passwords import HasherSaturated, hash_password, check_password
+from config import Config, init_engine
+from cache import cached_response
+from exports import create_export, delete_export, download_export, export_status, export_stream
+from jobs import cancel_job, job_status, list_jobs, submit_job
+from library import availability, check_bulk_checkout, check_loan_update, checkout, overdue, return_book
+from messages import inbox, mark_read, poll, send_message, stream, unread_count
+from roster import import_roster
+from search import search
+from timetable import TimetableError, check_conflicts, check_update_conflicts, generate_timetable
+from uploads import (
+    append_chunk, cancel_session, create_session, delete_file, download, server_owned, session_status, upload,
+)
+from watermarks import conditional, ensure_watermarks
+import auth
+import cache
+import compression
+import exports
+import jobs
+import library
+import messages
+import metrics
+import passwords
+import ratelimit
+import reports
+import representations
+import roster
+import seed
+import uploads
+
+jwt = JWTManager()
+migrate = Migrate()
 
 
 # Authentication and role-based access control
@@ -29,28 +48,6 @@ CORS(app)
 def user_identity_lookup(user_id):
     return user_id
 
-def user_lookup_callback(_jwt_header, jwt_data):
-    user_id = jwt_data["sub"]
-    role = jwt_data["role"]
-
-    if role == 'student':
-        return Student.query.get(user_id)
-    elif role == 'teacher':
-        return Teacher.query.get(user_id)
-    else:
-        return None  
-
-def role_required(allowed_roles):
-    def decorator(fn):
-        @jwt_required()
-        def wrapper(*args, **kwargs):
-            user_role = get_jwt_identity()['role']
-            if user_role not in allowed_roles:
-                return {'error': 'Unauthorized access'}, 403
-            return fn(*args, **kwargs)
-        return wrapper
-    return decorator
-
 def find_user(email, username):
     if email:
         return User.query.filter_by(email=email).first()
@@ -75,15 +72,18 @@ class UserRegister(Resource):
         if not email or not username or not password:
             return {'error': 'Email, username, and password are required'}, 400
 
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-
-        # Check if the user is a teacher
+        # Check if the user is a teacher before paying for the hash
         if Teacher.query.filter_by(email=email).first():
             role = 'teacher'  # Assign the role of "teacher" to the user
         else:
             return {'error': 'Only teachers can be registered'}, 400
 
-        user = User(email=email, username=username, password=hashed_password.decode('utf-8'), role=role)
+        try:
+            hashed_password = hash_password(password)
+        except HasherSaturated as e:
+            return {'error': str(e)}, 503, {'Retry-After': '1'}
+
+        user = User(email=email, username=username, password=hashed_password, role=role)
         db.session.add(user)
         db.session.commit()
         return {'message': 'User created'}, 201
@@ -101,7 +101,12 @@ class UserLogin(Resource):
 
         user = find_user(email, username)
 
-        if user and bcrypt.checkpw(password.encode('utf-8'), user.password.encode('utf-8')):
+        try:
+            valid = bool(user and password) and check_password(password, user.password)
+        except HasherSaturated as e:
+            return {'error': str(e)}, 503, {'Retry-After': '1'}
+
+        if valid:
             access_token = create_access_token(identity=user.id, additional_claims={'role': user.role})
             return {'access_token': access_token}
 
@@ -109,10 +114,10 @@ class UserLogin(Resource):
     
 # Class Resource
 class ClassResource(Resource):
-    @jwt_required()
+    @role_required()
+    @conditional('classes')
     def get(self):
-        classes = Class.query.all()
-        return [c.to_dict() for c in classes]
+        return paginate(Class, includes={'students': Class.students, 'schedule': Class.schedule})
 
     @role_required(['admin', 'teacher'])
     def post(self):
@@ -137,6 +142,10 @@ class ClassResource(Resource):
     def delete(self, class_id):
         class_obj = Class.query.get(class_id)
         if class_obj:
+            # Unenrol first, so the class's rankings go before the class does
+            class_obj.students = []
+            db.session.flush()
+            refresh_classes([class_id])
             db.session.delete(class_obj)
             db.session.commit()
             return {'message': 'Class deleted'}, 200
@@ -144,10 +153,13 @@ class ClassResource(Resource):
     
 # Subject Resource
 class SubjectResource(Resource):
-    @jwt_required()
+    @role_required()
+    @cached_response('subjects', max_age=300)
     def get(self):
-        subjects = Subject.query.all()
-        return [subject.to_dict() for subject in subjects]
+        return paginate(Subject, includes={
+            'teachers': Subject.teachers, 'grades': Subject.grades, 'files': Subject.files,
+            'links': Subject.links, 'forums': Subject.forums,
+        })
 
     @role_required(['admin'])
     def post(self):
@@ -179,10 +191,10 @@ class SubjectResource(Resource):
 
 # News Resource
 class NewsResource(Resource):
-    @jwt_required()
+    @role_required()
+    @cached_response('news', max_age=60)
     def get(self):
-        news_items = News.query.all()
-        return [news.to_dict() for news in news_items]
+        return paginate(News)
 
     @role_required(['admin', 'teacher'])
     def post(self):
@@ -214,10 +226,10 @@ class NewsResource(Resource):
 
 # Event Resource
 class EventResource(Resource):
-    @jwt_required()
+    @role_required()
+    @cached_response('events', max_age=60)
     def get(self):
-        events = Event.query.all()
-        return [event.to_dict() for event in events]
+        return paginate(Event)
 
     @role_required(['admin', 'teacher'])
     def post(self):
@@ -249,14 +261,17 @@ class EventResource(Resource):
 
 # File Resource
 class FileResource(Resource):
-    @jwt_required()
+    @role_required()
+    @conditional('files')
     def get(self):
-        files = File.query.all()
-        return [file.to_dict() for file in files]
+        return paginate(File, includes={'subject': File.subject})
 
     @role_required(['admin', 'teacher'])
     def post(self):
         data = request.get_json()
+        owned = server_owned(data)
+        if owned:
+            return owned
         new_file = File(**data)
         db.session.add(new_file)
         db.session.commit()
@@ -265,6 +280,9 @@ class FileResource(Resource):
     @role_required(['admin', 'teacher'])
     def patch(self, file_id):
         data = request.get_json()
+        owned = server_owned(data)
+        if owned:
+            return owned
         file_obj = File.query.get(file_id)
         if file_obj:
             for key, value in data.items():
@@ -277,17 +295,83 @@ class FileResource(Resource):
     def delete(self, file_id):
         file_obj = File.query.get(file_id)
         if file_obj:
-            db.session.delete(file_obj)
-            db.session.commit()
+            delete_file(file_obj)
             return {'message': 'File deleted'}, 200
         return {'error': 'File not found'}, 404
+
+class FileUploadResource(Resource):
+    @role_required(['admin', 'teacher'])
+    def post(self):
+        return upload()
+
+class FileDownloadResource(Resource):
+    @role_required()
+    def get(self, file_id):
+        return download(file_id)
+
+# Exports: GET /exports/<resource> streams a download, POST /exports runs one
+# in the background
+class ExportResource(Resource):
+    @role_required(['admin'])
+    def get(self, resource=None, export_id=None):
+        if export_id is not None:
+            return export_status(export_id)
+        return export_stream(resource)
+
+    @role_required(['admin'])
+    def post(self):
+        return create_export()
+
+    @role_required(['admin'])
+    def delete(self, export_id):
+        return delete_export(export_id)
+
+class ExportDownloadResource(Resource):
+    @role_required(['admin'])
+    def get(self, export_id):
+        return download_export(export_id)
+
+# Background jobs, run by `flask worker`: GET /jobs/<id> for status and
+# progress, POST /jobs to queue a report rebuild or overdue run
+class JobResource(Resource):
+    @role_required(['admin'])
+    def get(self, job_id=None):
+        if job_id is not None:
+            return job_status(job_id)
+        return list_jobs()
+
+    @role_required(['admin'])
+    def post(self):
+        return submit_job()
+
+    @role_required(['admin'])
+    def delete(self, job_id):
+        return cancel_job(job_id)
+
+# Resumable uploads: POST to start, PATCH chunks, GET to find the offset
+class UploadResource(Resource):
+    @role_required(['admin', 'teacher'])
+    def post(self):
+        return create_session()
+
+    @role_required(['admin', 'teacher'])
+    def get(self, upload_id):
+        return session_status(upload_id)
+
+    @role_required(['admin', 'teacher'])
+    def patch(self, upload_id):
+        return append_chunk(upload_id)
+
+    @role_required(['admin', 'teacher'])
+    def delete(self, upload_id):
+        return cancel_session(upload_id)
     
 # Link Resource
 class LinkResource(Resource):
-    @jwt_required()
+    @role_required()
+    @conditional('links')
     def get(self):
-        links = Link.query.all()
-        return [link.to_dict() for link in links]
+        return paginate(Link, includes={'subject': Link.subject})
 
     @role_required(['admin', 'teacher'])
     def post(self):
@@ -319,18 +403,17 @@ class LinkResource(Resource):
     
 # MessageResource
 class MessageResource(Resource):
-    @jwt_required()
+    @role_required()
     def get(self):
-        messages = Message.query.all()
-        return [message.to_dict() for message in messages]
+        return inbox()
 
     @role_required(['admin', 'teacher', 'student'])
     def post(self):
-        data = request.get_json()
-        new_message = Message(**data)
-        db.session.add(new_message)
-        db.session.commit()
-        return new_message.to_dict(), 201
+        return send_message()
+
+    @role_required()
+    def patch(self, message_id=None):
+        return mark_read(message_id)
 
     @role_required(['admin'])
     def delete(self, message_id):
@@ -341,12 +424,28 @@ class MessageResource(Resource):
             return {'message': 'Message deleted'}, 200
         return {'error': 'Message not found'}, 404
 
+class UnreadCountResource(Resource):
+    @role_required()
+    def get(self):
+        return unread_count()
+
+# New messages pushed as Server-Sent Events, or long-polled
+class MessageStreamResource(Resource):
+    @role_required()
+    def get(self):
+        return stream()
+
+class MessagePollResource(Resource):
+    @role_required()
+    def get(self):
+        return poll()
+
 # ForumResource 
 class ForumResource(Resource):
-    @jwt_required()
+    @role_required()
+    @conditional('forums')
     def get(self):
-        forums = Forum.query.all()
-        return [forum.to_dict() for forum in forums]
+        return paginate(Forum, includes={'subject': Forum.subject})
 
     @role_required(['admin', 'teacher', 'student'])
     def post(self):
@@ -367,10 +466,10 @@ class ForumResource(Resource):
     
 # ClubResource 
 class ClubResource(Resource):
-    @jwt_required()
+    @role_required()
+    @cached_response('clubs', max_age=300)
     def get(self):
-        clubs = Club.query.all()
-        return [club.to_dict() for club in clubs]
+        return paginate(Club, includes={'members': Club.members})
 
     @role_required(['admin', 'teacher', 'student'])
     def post(self):
@@ -391,10 +490,10 @@ class ClubResource(Resource):
     
 # Sports Resource
 class SportsResource(Resource):
-    @jwt_required()
+    @role_required()
+    @cached_response('sports', max_age=300)
     def get(self):
-        sports = Sports.query.all()
-        return [s.to_dict() for s in sports]
+        return paginate(Sports)
 
     @role_required(['admin'])
     def post(self):
@@ -426,10 +525,10 @@ class SportsResource(Resource):
     
 # Library Resource
 class LibraryResource(Resource):
-    @jwt_required()
+    @role_required()
+    @cached_response('libraries', max_age=300)
     def get(self):
-        libraries = Library.query.all()
-        return [l.to_dict() for l in libraries]
+        return paginate(Library)
 
     @role_required(['admin'])
     def post(self):
@@ -461,10 +560,10 @@ class LibraryResource(Resource):
     
 # Book Resource
 class BookResource(Resource):
-    @jwt_required()
+    @role_required()
+    @conditional('books')
     def get(self):
-        books = Book.query.all()
-        return [b.to_dict() for b in books]
+        return paginate(Book, includes={'checkout_records': Book.checkout_records})
 
     @role_required(['admin'])
     def post(self):
@@ -496,20 +595,16 @@ class BookResource(Resource):
 
 # Checkout Record Resource
 class CheckoutRecordResource(Resource):
-    @jwt_required()
+    @role_required()
+    @conditional('checkout_records')
     def get(self):
-        checkout_records = CheckoutRecord.query.all()
-        return [cr.to_dict() for cr in checkout_records]
+        return paginate(CheckoutRecord, includes={'book': CheckoutRecord.book})
 
-    @jwt_required()
+    @role_required()
     def post(self):
-        data = request.get_json()
-        new_checkout_record = CheckoutRecord(**data)
-        db.session.add(new_checkout_record)
-        db.session.commit()
-        return new_checkout_record.to_dict(), 201
+        return checkout()
 
-    @jwt_required()
+    @role_required()
     def patch(self, checkout_record_id):
         data = request.get_json()
         checkout_record_obj = CheckoutRecord.query.get(checkout_record_id)
@@ -520,7 +615,7 @@ class CheckoutRecordResource(Resource):
             return checkout_record_obj.to_dict(), 200
         return {'error': 'Checkout record not found'}, 404
 
-    @jwt_required()
+    @role_required()
     def delete(self, checkout_record_id):
         checkout_record_obj = CheckoutRecord.query.get(checkout_record_id)
         if checkout_record_obj:
@@ -529,12 +624,33 @@ class CheckoutRecordResource(Resource):
             return {'message': 'Checkout record deleted'}, 200
         return {'error': 'Checkout record not found'}, 404
 
+class CheckoutReturnResource(Resource):
+    @role_required()
+    def post(self, checkout_record_id):
+        return return_book(checkout_record_id)
+
+class BookAvailabilityResource(Resource):
+    @role_required()
+    @conditional('books', 'checkout_records')
+    def get(self, book_id):
+        return availability(book_id)
+
+# Open loans past their due date, oldest first
+class OverdueResource(Resource):
+    @role_required(['admin', 'teacher'])
+    def get(self):
+        return overdue()
+
 # GradeResource 
 class GradeResource(Resource):
-    @jwt_required()
+    @role_required()
+    @conditional('grades', 'student_class')
     def get(self):
-        grades = Grade.query.all()
-        return [grade.to_dict() for grade in grades]
+        try:
+            filters = grade_filters()
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        return paginate(Grade, includes={'student': Grade.student, 'subject': Grade.subject}, filters=filters)
 
     @role_required(['admin', 'teacher', 'student'])
     def post(self):
@@ -542,27 +658,57 @@ class GradeResource(Resource):
         new_grade = Grade(**data)
         db.session.add(new_grade)
         db.session.commit()
+        refresh_students([new_grade.student_id])
         return new_grade.to_dict(), 201
 
     @role_required(['admin'])
     def delete(self, grade_id):
         grade_obj = Grade.query.get(grade_id)
         if grade_obj:
+            student_id = grade_obj.student_id
             db.session.delete(grade_obj)
             db.session.commit()
+            refresh_students([student_id])
             return {'message': 'Grade deleted'}, 200
         return {'error': 'Grade not found'}, 404
+
+# Grade summary: ?group_by=student|subject|class plus the GradeResource filters
+class GradeSummaryResource(Resource):
+    @role_required(['admin', 'teacher'])
+    @conditional('grades', 'student_class')
+    def get(self):
+        return grade_summary()
+
+# Class rankings, read from the materialized class_rankings table
+class ClassRankingResource(Resource):
+    @role_required(['admin', 'teacher'])
+    @conditional('class_rankings')
+    def get(self, class_id):
+        return class_rankings(class_id)
+
+# Report card, read from the materialized report_cards table
+class ReportCardResource(Resource):
+    @role_required(['admin', 'teacher'])
+    @conditional('report_cards', 'class_rankings')
+    def get(self, student_id):
+        return report_card(student_id)
     
 # ScheduleResource 
 class ScheduleResource(Resource):
-    @jwt_required()
+    @role_required()
+    @conditional('schedules')
     def get(self):
-        schedules = Schedule.query.all()
-        return [schedule.to_dict() for schedule in schedules]
+        return paginate(Schedule, includes={'class': getattr(Schedule, 'class'), 'teacher': Schedule.teacher})
 
     @role_required(['admin', 'teacher', 'student'])
     def post(self):
-        data = request.get_json()
+        try:
+            data = validator_for(Schedule).clean(request.get_json())
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        conflicts = check_conflicts([(0, data)])
+        if conflicts:
+            return {'error': conflicts[0]}, 409
         new_schedule = Schedule(**data)
         db.session.add(new_schedule)
         db.session.commit()
@@ -576,29 +722,151 @@ class ScheduleResource(Resource):
             db.session.commit()
             return {'message': 'Schedule deleted'}, 200
         return {'error': 'Schedule not found'}, 404
-    
+
+# Full-text search over news, forums, files, links and books
+class SearchResource(Resource):
+    @role_required()
+    @conditional('news', 'forums', 'files', 'links', 'books')
+    def get(self):
+        return search()
+
+# Timetable generation: places lessons into free (slot, teacher, room)
+# combinations for a week; ?commit=true inserts the result
+class TimetableResource(Resource):
+    @role_required(['admin'])
+    def post(self):
+        commit = request.args.get('commit', 'false').lower() in ('1', 'true', 'yes')
+        try:
+            return generate_timetable(request.get_json(silent=True), commit=commit)
+        except TimetableError as e:
+            return {'error': str(e)}, 400
+
+# Bulk Resources
+# Accept a JSON array (or an NDJSON upload) and write it in chunked
+# transactions, reporting per-row errors instead of failing the whole batch.
+class GradeBulkResource(Resource):
+    @role_required(['admin', 'teacher', 'student'])
+    def post(self):
+        return bulk_create(Grade, on_commit=refresh_grade_rows)
+
+    @role_required(['admin', 'teacher'])
+    def patch(self):
+        return bulk_update(Grade, on_commit=refresh_grade_rows)
+
+    @role_required(['admin'])
+    def delete(self):
+        return bulk_delete(Grade, on_commit=refresh_grade_rows)
+
+class ScheduleBulkResource(Resource):
+    @role_required(['admin', 'teacher', 'student'])
+    def post(self):
+        return bulk_create(Schedule, check=check_conflicts)
+
+    @role_required(['admin', 'teacher'])
+    def patch(self):
+        return bulk_update(Schedule, check=check_update_conflicts)
+
+    @role_required(['admin'])
+    def delete(self):
+        return bulk_delete(Schedule)
+
+class RosterImportResource(Resource):
+    @role_required(['admin'])
+    def post(self, kind):
+        return import_roster(kind)
+
+class CheckoutRecordBulkResource(Resource):
+    @role_required()
+    def post(self):
+        return bulk_create(CheckoutRecord, check=check_bulk_checkout)
+
+    @role_required(['admin', 'teacher'])
+    def patch(self):
+        return bulk_update(CheckoutRecord, check=check_loan_update)
+
+    @role_required(['admin'])
+    def delete(self):
+        return bulk_delete(CheckoutRecord)
+
 # Endpoints
-api.add_resource(Home, '/')
-api.add_resource(UserRegister, '/register')
-api.add_resource(UserLogin, '/login')
-api.add_resource(ClassResource, '/classes', '/classes/<int:class_id>')
-api.add_resource(SubjectResource, '/subjects', '/subjects/<int:subject_id>')
-api.add_resource(NewsResource, '/news', '/news/<int:news_id>')
-api.add_resource(EventResource, '/events', '/events/<int:event_id>')
-api.add_resource(FileResource, '/files', '/files/<int:file_id>')
-api.add_resource(LinkResource, '/links', '/links/<int:link_id>')
-api.add_resource(MessageResource, '/messages', '/messages/<int:message_id>')
-api.add_resource(ForumResource, '/forums', '/forums/<int:forum_id>')
-api.add_resource(ClubResource, '/clubs', '/clubs/<int:club_id>')
-api.add_resource(SportsResource, '/sports', '/sports/<int:sport_id>')
-api.add_resource(LibraryResource, '/libraries', '/libraries/<int:library_id>')
-api.add_resource(BookResource, '/books', '/books/<int:book_id>')
-api.add_resource(CheckoutRecordResource, '/checkout-records', '/checkout-records/<int:checkout_record_id>')
-api.add_resource(GradeResource, '/grades', '/grades/<int:grade_id>')
-api.add_resource(ScheduleResource, '/schedules', '/schedules/<int:schedule_id>')
-
-with app.app_context():
-    db.create_all()
+def register_resources(api):
+    api.add_resource(Home, '/')
+    api.add_resource(UserRegister, '/register')
+    api.add_resource(UserLogin, '/login')
+    api.add_resource(ClassResource, '/classes', '/classes/<int:class_id>')
+    api.add_resource(SubjectResource, '/subjects', '/subjects/<int:subject_id>')
+    api.add_resource(NewsResource, '/news', '/news/<int:news_id>')
+    api.add_resource(EventResource, '/events', '/events/<int:event_id>')
+    api.add_resource(FileResource, '/files', '/files/<int:file_id>')
+    api.add_resource(FileUploadResource, '/files/upload')
+    api.add_resource(FileDownloadResource, '/files/<int:file_id>/download')
+    api.add_resource(UploadResource, '/uploads', '/uploads/<string:upload_id>')
+    api.add_resource(ExportResource, '/exports', '/exports/<int:export_id>', '/exports/<string:resource>')
+    api.add_resource(ExportDownloadResource, '/exports/<int:export_id>/download')
+    api.add_resource(JobResource, '/jobs', '/jobs/<int:job_id>')
+    api.add_resource(LinkResource, '/links', '/links/<int:link_id>')
+    api.add_resource(MessageResource, '/messages', '/messages/<int:message_id>')
+    api.add_resource(UnreadCountResource, '/messages/unread-count')
+    api.add_resource(MessageStreamResource, '/messages/stream')
+    api.add_resource(MessagePollResource, '/messages/poll')
+    api.add_resource(ForumResource, '/forums', '/forums/<int:forum_id>')
+    api.add_resource(ClubResource, '/clubs', '/clubs/<int:club_id>')
+    api.add_resource(SportsResource, '/sports', '/sports/<int:sport_id>')
+    api.add_resource(LibraryResource, '/libraries', '/libraries/<int:library_id>')
+    api.add_resource(BookResource, '/books', '/books/<int:book_id>')
+    api.add_resource(CheckoutRecordResource, '/checkout-records', '/checkout-records/<int:checkout_record_id>')
+    api.add_resource(CheckoutReturnResource, '/checkout-records/<int:checkout_record_id>/return')
+    api.add_resource(BookAvailabilityResource, '/books/<int:book_id>/availability')
+    api.add_resource(OverdueResource, '/overdue')
+    api.add_resource(GradeResource, '/grades', '/grades/<int:grade_id>')
+    api.add_resource(ScheduleResource, '/schedules', '/schedules/<int:schedule_id>')
+    api.add_resource(SearchResource, '/search')
+    api.add_resource(TimetableResource, '/timetable/generate')
+    api.add_resource(GradeBulkResource, '/grades/bulk')
+    api.add_resource(GradeSummaryResource, '/grades/summary')
+    api.add_resource(ClassRankingResource, '/classes/<int:class_id>/rankings')
+    api.add_resource(ReportCardResource, '/students/<int:student_id>/report-card')
+    api.add_resource(ScheduleBulkResource, '/schedules/bulk')
+    api.add_resource(CheckoutRecordBulkResource, '/checkout-records/bulk')
+    api.add_resource(RosterImportResource, '/imports/<string:kind>')
+
+
+# Application factory: `gunicorn 'app:create_app()'` in production (see
+# gunicorn.conf.py), `flask run` or `python app.py` in development.
+def create_app(config=Config):
+    app = Flask(__name__)
+    app.config.from_object(config)
+
+    db.init_app(app)
+    init_engine(app, db)
+
+    api = Api(app)
+    jwt.init_app(app)
+    migrate.init_app(app, db, render_as_batch=True)
+
+    CORS(app)
+    auth.init_app(app)
+    passwords.init_app(app)
+    cache.init_app(app)
+    compression.init_app(app)
+    messages.init_app(app)
+    library.init_app(app)
+    uploads.init_app(app)
+    exports.init_app(app)
+    jobs.init_app(app)
+    metrics.init_app(app, db)
+    # After metrics, so refused requests are still timed and counted
+    ratelimit.init_app(app)
+    reports.init_app(app)
+    roster.init_app(app)
+    seed.init_app(app)
+    representations.init_app(app, api)
+    register_resources(api)
+
+    with app.app_context():
+        db.create_all()
+        ensure_watermarks()
+    return app
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
@@ -0,0 +1,179 @@
+from urllib.parse import parse_qsl
+
+import jwt
+from a2wsgi import WSGIMiddleware
+from flask_jwt_extended.exceptions import JWTExtendedException
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from werkzeug.datastructures import MIMEAccept, MultiDict
+from werkzeug.http import parse_accept_header, parse_date, parse_etags
+
+from app import create_app
+from auth import claims_from_token
+from compression import compress, negotiate
+from config import apply_sqlite_pragmas, engine_options, is_memory_sqlite, is_sqlite
+from models import Book, CheckoutRecord, Class, File, Forum, Link, Schedule
+from pagination import NDJSON_MIMETYPE, keyset, page_args, page_size, page_url
+from ratelimit import too_many_requests
+from representations import native_datetimes
+from serializers import serializer_for
+from watermarks import is_not_modified, set_validators, validators, watermark_select
+
+# Optional ASGI entry point: `uvicorn asgi:app --workers 4` (needs
+# `pip install uvicorn a2wsgi aiosqlite`).
+#
+# Plain list pages of the tables below hit the database on every request
+# (they have no response cache), so they are answered here on the event loop
+# through an async engine: a slow query waits without holding a thread.
+# Every other request, including ?include= and NDJSON streams of these
+# lists, goes to the Flask app on a thread pool of ASGI_WSGI_THREADS. Pages
+# served here are not counted in /metrics, but get the same ETag/304,
+# compression and per-user 'list' rate limit (without the concurrency cap:
+# a waiting query holds no thread) as the Flask app.
+ASYNC_LISTS = {
+    '/books': Book,
+    '/checkout-records': CheckoutRecord,
+    '/classes': Class,
+    '/files': File,
+    '/forums': Forum,
+    '/links': Link,
+    '/schedules': Schedule,
+}
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg'}
+
+
+def async_database_url(url):
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise RuntimeError(f'No async driver configured for {backend}; set ASYNC_DATABASE_URL')
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+def _header(scope, name):
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return ''
+
+
+def _base_url(scope):
+    host = _header(scope, b'host')
+    if not host and scope.get('server'):
+        host = '%s:%s' % scope['server']
+    return f"{scope.get('scheme', 'http')}://{host}{scope.get('root_path', '')}{scope['path']}"
+
+
+class AsyncListApp:
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        config = flask_app.config
+        url = make_url(config['ASYNC_DATABASE_URL'] or async_database_url(config['SQLALCHEMY_DATABASE_URI']))
+        options = engine_options(url)
+        if is_sqlite(url) and not is_memory_sqlite(url):
+            # aiosqlite defaults to NullPool here, which would reconnect and
+            # rerun the pragmas on every request
+            options['poolclass'] = AsyncAdaptedQueuePool
+        self.engine = create_async_engine(url, **options)
+        if is_sqlite(url):
+            wal = config['SQLITE_WAL'] and not is_memory_sqlite(url)
+
+            @event.listens_for(self.engine.sync_engine, 'connect')
+            def on_connect(dbapi_connection, connection_record):
+                apply_sqlite_pragmas(dbapi_connection, wal, config['SQLITE_SYNCHRONOUS'],
+                                     config['SQLITE_BUSY_TIMEOUT_MS'])
+
+        self.wsgi = WSGIMiddleware(flask_app, workers=config['ASGI_WSGI_THREADS'])
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http' and scope['method'] == 'GET' and scope['path'] in ASYNC_LISTS:
+            args = MultiDict(parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True))
+            accept = parse_accept_header(_header(scope, b'accept'), MIMEAccept)
+            if not args.get('include') and args.get('format') != 'ndjson' and accept.best != NDJSON_MIMETYPE:
+                return await self.list_page(scope, send, ASYNC_LISTS[scope['path']], args)
+        await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def list_page(self, scope, send, model, args):
+        with self.flask_app.app_context():
+            scheme, _, token = _header(scope, b'authorization').partition(' ')
+            if scheme.lower() != 'bearer' or not token.strip():
+                return await self.respond(send, 401, {'error': 'Missing Authorization Header'})
+            try:
+                claims = claims_from_token(token.strip())
+            except (JWTExtendedException, jwt.PyJWTError) as e:
+                return await self.respond(send, 401, {'error': str(e)})
+            limiter = self.flask_app.extensions.get('rate_limiter')
+            if limiter is not None:
+                retry_after = limiter.take('list', f"user:{claims['sub']}", claims.get('role'))
+                if retry_after is not None:
+                    data, status, headers = too_many_requests(retry_after)
+                    return await self.respond(send, status, data, [(b'retry-after', headers['Retry-After'].encode())])
+
+            serializer = serializer_for(model)
+            try:
+                after_id, limit, fields = page_args(serializer, args)
+            except ValueError as e:
+                return await self.respond(send, 400, {'error': str(e)})
+            limit = page_size(limit, self.flask_app.config)
+            stmt = keyset(serializer.select(fields), model, after_id).limit(limit + 1)
+            tables = (model.__tablename__,)
+
+            async with self.engine.connect() as connection:
+                etag, last_modified = validators(tables, (await connection.execute(watermark_select(tables))).all())
+                validator_headers = [
+                    (name.lower().encode(), value.encode('latin-1'))
+                    for name, value in set_validators({}, etag, last_modified, 0).items()
+                ]
+                if is_not_modified(etag, last_modified, parse_etags(_header(scope, b'if-none-match') or None),
+                                   parse_date(_header(scope, b'if-modified-since') or None)):
+                    return await self.not_modified(send, validator_headers)
+                rows = (await connection.execute(stmt)).all()
+
+            headers = validator_headers
+            if len(rows) > limit:
+                rows = rows[:limit]
+                last_id = rows[-1][0]
+                headers.append((b'x-next-after-id', str(last_id).encode()))
+                link = page_url(_base_url(scope), args, last_id, limit)
+                headers.append((b'link', f'<{link}>; rel="next"'.encode('latin-1')))
+            to_dict = serializer.row_factory(fields, convert=not native_datetimes())
+            return await self.respond(send, 200, [to_dict(row) for row in rows], headers, scope)
+
+    async def not_modified(self, send, headers):
+        await send({'type': 'http.response.start', 'status': 304, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def respond(self, send, status, data, headers=(), scope=None):
+        body = (self.flask_app.json.dumps(data) + '\n').encode()
+        headers = list(headers)
+        config = self.flask_app.config
+        if scope is not None and config['COMPRESS_ENABLED'] and len(body) >= config['COMPRESS_MIN_SIZE']:
+            headers.append((b'vary', b'Accept-Encoding'))
+            encoding = negotiate(parse_accept_header(_header(scope, b'accept-encoding')))
+            if encoding is not None:
+                body = compress(body, encoding)
+                headers.append((b'content-encoding', encoding.encode()))
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()),
+                        *headers],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+app = AsyncListApp(create_app())
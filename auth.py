@@ -0,0 +1,125 @@
+import time
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+
+import jwt
+from flask import current_app, g, request
+from flask_jwt_extended import decode_token, get_jwt, verify_jwt_in_request
+from flask_jwt_extended.exceptions import JWTExtendedException, WrongTokenError
+
+
+# LRU of verified token claims keyed by JTI. An entry is only served for the
+# exact token string it was verified from, and never past the token's own
+# expiry, so a hit is as trustworthy as a fresh signature check.
+class ClaimsCache:
+    def __init__(self, maxsize=10000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _jti(token):
+        try:
+            return jwt.decode(token, options={'verify_signature': False}).get('jti')
+        except jwt.InvalidTokenError:
+            return None
+
+    def get(self, token):
+        jti = self._jti(token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(jti) if jti else None
+            if entry is None or entry[0] != token or entry[1] <= now:
+                if entry is not None and entry[1] <= now:
+                    del self._entries[jti]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(jti)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, token, claims):
+        jti = claims.get('jti')
+        if not jti:
+            return
+        expires_at = time.time() + self.ttl
+        if claims.get('exp'):
+            expires_at = min(expires_at, claims['exp'])
+        with self._lock:
+            self._entries[jti] = (token, expires_at, claims)
+            self._entries.move_to_end(jti)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def init_app(app):
+    app.config.setdefault('JWT_CLAIMS_CACHE_SIZE', 10000)
+    app.config.setdefault('JWT_CLAIMS_CACHE_TTL', 300)
+    size = app.config['JWT_CLAIMS_CACHE_SIZE']
+    app.extensions['claims_cache'] = ClaimsCache(size, app.config['JWT_CLAIMS_CACHE_TTL']) if size else None
+
+
+def _bearer_token():
+    header = request.headers.get('Authorization', '')
+    scheme, _, token = header.partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        return None
+    return token.strip()
+
+
+# Claims of the token on the current request. Role and identity come straight
+# from the verified claims, so authorization never touches the database.
+def current_claims():
+    if 'jwt_claims' in g:
+        return g.jwt_claims
+    cache = current_app.extensions.get('claims_cache')
+    token = _bearer_token()
+    claims = cache.get(token) if cache is not None and token else None
+    if claims is None:
+        verify_jwt_in_request()
+        claims = get_jwt()
+        if cache is not None and token:
+            cache.put(token, claims)
+    g.jwt_claims = claims
+    return claims
+
+
+# The same checks for a bare token, outside any Flask request; used by the
+# async list endpoints in asgi.py. Needs an app context.
+def claims_from_token(token):
+    cache = current_app.extensions.get('claims_cache')
+    claims = cache.get(token) if cache is not None else None
+    if claims is None:
+        claims = decode_token(token)
+        if claims.get('type') == 'refresh':
+            raise WrongTokenError('Only non-refresh tokens are allowed')
+        if cache is not None:
+            cache.put(token, claims)
+    return claims
+
+
+def current_user_id():
+    return current_claims()['sub']
+
+
+def role_required(allowed_roles=None):
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            # Flask-RESTful turns JWT errors into 500s, so report them here.
+            try:
+                claims = current_claims()
+            except (JWTExtendedException, jwt.PyJWTError) as e:
+                return {'error': str(e)}, 401
+            if allowed_roles is not None and claims.get('role') not in allowed_roles:
+                return {'error': 'Unauthorized access'}, 403
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
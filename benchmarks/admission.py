@@ -0,0 +1,97 @@
+"""Rate limiting and admission control benchmark.
+
+Seeds a temporary database with `seed.py` at --scale, then for --seconds
+has one user flood GET /grades?limit=1000 from --threads threads while a
+second user requests GET /subjects every 50 ms, first with the limiter off
+and then on (default budgets). Reports the flooding user's responses by
+status and the other user's success rate and p50/p95 latency: with the
+limiter on the flood is turned away cheaply with 429/503 and the second
+user's latency should stay close to an idle server's.
+
+    python benchmarks/admission.py [--scale 0.01] [--threads 16] [--seconds 10]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{_tmp.name}/admission.db')
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(_tmp.name, 'uploads'))
+os.environ.setdefault('METRICS_ENABLED', 'false')
+os.environ.setdefault('RESPONSE_CACHE_ENABLED', 'false')
+
+from flask_jwt_extended import create_access_token  # noqa: E402
+
+from app import create_app  # noqa: E402
+from config import Config  # noqa: E402
+from seed import counts_for, seed  # noqa: E402
+
+
+class Unlimited(Config):
+    RATELIMIT_ENABLED = False
+
+
+class Limited(Config):
+    RATELIMIT_ENABLED = True
+
+
+def run(app, threads, seconds):
+    with app.app_context():
+        flooder = create_access_token(identity=1, additional_claims={'role': 'admin'})
+        polite = create_access_token(identity=2, additional_claims={'role': 'teacher'})
+    statuses = Counter()
+    latencies, failures = [], 0
+    deadline = time.monotonic() + seconds
+
+    def flood():
+        client = app.test_client()
+        headers = {'Authorization': f'Bearer {flooder}'}
+        while time.monotonic() < deadline:
+            response = client.get('/grades?limit=1000', headers=headers)
+            response.close()
+            statuses[response.status_code] += 1
+
+    workers = [threading.Thread(target=flood) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {polite}'}
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        response = client.get('/subjects', headers=headers)
+        latencies.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            failures += 1
+        time.sleep(0.05)
+    for worker in workers:
+        worker.join()
+    latencies.sort()
+    return statuses, failures, len(latencies), latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=float, default=0.01)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    unlimited = create_app(Unlimited)
+    with unlimited.app_context():
+        seed(counts_for(args.scale), 1)
+
+    print(f"{'limiter':<8} {'flood 200':>10} {'429':>7} {'503':>7} {'polite ok':>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, app in (('off', unlimited), ('on', create_app(Limited))):
+        statuses, failures, total, p50, p95 = run(app, args.threads, args.seconds)
+        print(f'{name:<8} {statuses[200]:>10} {statuses[429]:>7} {statuses[503]:>7} '
+              f'{(total - failures) / total:>10.0%} {p50:>8.1f} {p95:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
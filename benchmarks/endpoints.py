@@ -0,0 +1,340 @@
+"""Per-endpoint latency baseline for every resource in app.py.
+
+Seeds a temporary database with `seed.py` at --scale, then runs each endpoint
+below through the Flask test client (one request at a time, in process) and,
+with --modes client,server, through gunicorn over HTTP with --concurrency
+connections. For each endpoint reports throughput, p50/p95/p99 latency, SQL
+queries per request (client mode) and peak RSS (of this process in client
+mode, of all gunicorn processes in server mode).
+
+Save a run as the baseline, then compare later runs against it; the script
+exits 1 when an endpoint's p50/p95 latency or throughput got worse than
+--tolerance, or it issues more queries per request than before:
+
+    python benchmarks/endpoints.py --scale 0.02 --save-baseline benchmarks/baseline.json
+    python benchmarks/endpoints.py --scale 0.02 --baseline benchmarks/baseline.json
+
+Baselines are only comparable on the same machine, scale and request count.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{_tmp.name}/endpoints.db')
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(_tmp.name, 'uploads'))
+os.environ.setdefault('METRICS_ENABLED', 'false')
+os.environ.setdefault('RATELIMIT_ENABLED', 'false')
+# The seeded users' password is hashed once; keep login cheap to measure the
+# endpoint rather than bcrypt's cost factor
+os.environ.setdefault('BCRYPT_LOG_ROUNDS', '4')
+
+from flask_jwt_extended import create_access_token  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+from app import create_app  # noqa: E402
+from models import db  # noqa: E402
+from seed import PASSWORD, counts_for, seed  # noqa: E402
+
+# Latency differences under this many milliseconds are noise, not regressions
+NOISE_MS = 2.0
+
+
+# (name, method, path, body, token, statuses). Paths and bodies are filled
+# in per request from the seeded row counts, so repeated requests don't all
+# hit the same row.
+def endpoints(counts):
+    def pick(name):
+        return random.randint(1, counts[name])
+
+    student = lambda: pick('students')  # noqa: E731
+    book = lambda: pick('books')  # noqa: E731
+    return [
+        ('home', 'GET', lambda: '/', None, None, (200,)),
+        ('login', 'POST', lambda: '/login',
+         lambda: {'email': f'student{student()}@school.test', 'password': PASSWORD}, None, (200,)),
+        ('classes list', 'GET', lambda: '/classes?limit=50', None, 'admin', (200,)),
+        ('class rankings', 'GET', lambda: f'/classes/{pick("classes")}/rankings', None, 'admin', (200,)),
+        ('subjects list', 'GET', lambda: '/subjects', None, 'admin', (200,)),
+        ('news list', 'GET', lambda: '/news?limit=20', None, 'admin', (200,)),
+        ('events list', 'GET', lambda: '/events?limit=50', None, 'admin', (200,)),
+        ('files list', 'GET', lambda: f'/files?limit=50&after_id={pick("files")}', None, 'admin', (200,)),
+        ('links list', 'GET', lambda: f'/links?limit=50&after_id={pick("links")}', None, 'admin', (200,)),
+        ('forums list', 'GET', lambda: '/forums?limit=50', None, 'admin', (200,)),
+        ('clubs list', 'GET', lambda: '/clubs', None, 'admin', (200,)),
+        ('sports list', 'GET', lambda: '/sports', None, 'admin', (200,)),
+        ('libraries list', 'GET', lambda: '/libraries', None, 'admin', (200,)),
+        ('books list', 'GET', lambda: f'/books?limit=50&after_id={pick("books")}', None, 'admin', (200,)),
+        ('books include', 'GET', lambda: f'/books?limit=20&after_id={pick("books")}&include=checkout_records',
+         None, 'admin', (200,)),
+        ('book availability', 'GET', lambda: f'/books/{book()}/availability', None, 'admin', (200,)),
+        ('checkout-records list', 'GET', lambda: f'/checkout-records?limit=50&after_id={pick("checkouts")}',
+         None, 'admin', (200,)),
+        ('overdue', 'GET', lambda: '/overdue?limit=50', None, 'admin', (200,)),
+        ('grades list', 'GET', lambda: f'/grades?limit=50&after_id={pick("grades")}', None, 'admin', (200,)),
+        ('grades by student', 'GET', lambda: f'/grades?student_id={student()}', None, 'admin', (200,)),
+        ('grade summary', 'GET', lambda: f'/grades/summary?group_by=subject&student_id={student()}',
+         None, 'admin', (200,)),
+        ('report card', 'GET', lambda: f'/students/{student()}/report-card', None, 'admin', (200, 404)),
+        ('schedules list', 'GET', lambda: '/schedules?limit=50', None, 'admin', (200,)),
+        ('search', 'GET', lambda: f'/search?q={random.choice(["exam", "library", "sci*", "music+festival"])}',
+         None, 'admin', (200,)),
+        ('inbox', 'GET', lambda: '/messages?limit=20', None, 'student', (200,)),
+        ('unread count', 'GET', lambda: '/messages/unread-count', None, 'student', (200,)),
+        ('export grades', 'GET', lambda: '/exports/grades?limit=1000', None, 'admin', (200,)),
+        ('send message', 'POST', lambda: '/messages',
+         lambda: {'recipient_ids': [pick('users')], 'content': 'benchmark'}, 'student', (201,)),
+        ('record grade', 'POST', lambda: '/grades',
+         lambda: {'student_id': student(), 'subject_id': random.randint(1, 18), 'grade': 70.0}, 'admin', (201,)),
+        ('checkout book', 'POST', lambda: '/checkout-records', lambda: {'book_id': book()}, 'admin', (201, 409)),
+    ]
+
+
+def percentile(latencies, p):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] * 1000 if latencies else 0.0
+
+
+def summarize(latencies, elapsed, errors):
+    latencies = sorted(latencies)
+    return {'rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0, 'p50': round(percentile(latencies, 50), 2),
+            'p95': round(percentile(latencies, 95), 2), 'p99': round(percentile(latencies, 99), 2), 'errors': errors}
+
+
+def _max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_client(app, counts, tokens, args):
+    client = app.test_client()
+    queries = [0]
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def count(*_):
+        queries[0] += 1
+
+    results = {}
+    for name, method, path, body, token, statuses in endpoints(counts):
+        headers = {'Authorization': f'Bearer {tokens[token]}'} if token else {}
+        latencies, errors = [], 0
+
+        # Streamed bodies are generated while they are read, so read them in
+        # full, and close each response before the next request
+        def send():
+            with client.open(path(), method=method, json=body() if body else None, headers=headers) as response:
+                response.get_data()
+                return response.status_code
+
+        for _ in range(args.warmup):
+            send()
+        queries[0] = 0
+        started = time.perf_counter()
+        for _ in range(args.requests):
+            request_started = time.perf_counter()
+            status = send()
+            latencies.append(time.perf_counter() - request_started)
+            if status not in statuses:
+                errors += 1
+        results[name] = summarize(latencies, time.perf_counter() - started, errors)
+        results[name]['queries'] = round(queries[0] / args.requests, 1)
+        results[name]['rss_mb'] = round(_max_rss_mb(), 1)
+    event.remove(engine, 'before_cursor_execute', count)
+    return results
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/')
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'server on port {port} did not start')
+
+
+# Peak resident memory (VmHWM) of the gunicorn master and its workers
+def _server_rss_mb(pid):
+    total = 0
+    pids = [pid]
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            pids += [int(child) for child in f.read().split()]
+    except OSError:
+        return None
+    for process in pids:
+        try:
+            with open(f'/proc/{process}/status') as f:
+                total += next(int(line.split()[1]) for line in f if line.startswith('VmHWM'))
+        except (OSError, StopIteration):
+            pass
+    return round(total / 1024, 1)
+
+
+def drive(port, method, path, body, headers, statuses, requests, concurrency):
+    lock = threading.Lock()
+    latencies, errors = [], [0]
+    remaining = [requests]
+
+    def run():
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        local = []
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+            payload = json.dumps(body()) if body else None
+            request_headers = dict(headers, **({'Content-Type': 'application/json'} if payload else {}))
+            started = time.perf_counter()
+            try:
+                connection.request(method, path(), body=payload, headers=request_headers)
+                response = connection.getresponse()
+                response.read()
+                ok = response.status in statuses
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                ok = False
+            local.append(time.perf_counter() - started)
+            if not ok:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=run) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, time.perf_counter() - started, errors[0])
+
+
+def run_server(counts, tokens, args):
+    port = free_port()
+    env = dict(os.environ, GUNICORN_WORKERS=str(args.workers), GUNICORN_BIND=f'127.0.0.1:{port}')
+    server = subprocess.Popen(['gunicorn', 'app:create_app()', '-c', 'gunicorn.conf.py'], cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    results = {}
+    try:
+        wait_ready(port)
+        for name, method, path, body, token, statuses in endpoints(counts):
+            headers = {'Authorization': f'Bearer {tokens[token]}'} if token else {}
+            drive(port, method, path, body, headers, statuses, args.warmup, 1)
+            results[name] = drive(port, method, path, body, headers, statuses, args.requests, args.concurrency)
+            results[name]['rss_mb'] = _server_rss_mb(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for mode, endpoints_ in results.items():
+        for name, now in endpoints_.items():
+            before = baseline.get(mode, {}).get(name)
+            if before is None:
+                continue
+            # p99 of a few hundred requests is a handful of samples, too noisy to gate on
+            for metric in ('p50', 'p95'):
+                if now[metric] > before[metric] * (1 + tolerance) and now[metric] - before[metric] > NOISE_MS:
+                    regressions.append(f'{mode} {name}: {metric} {before[metric]:.1f} -> {now[metric]:.1f} ms')
+            if now['rps'] < before['rps'] * (1 - tolerance):
+                regressions.append(f"{mode} {name}: {before['rps']:.0f} -> {now['rps']:.0f} req/s")
+            if now.get('queries') is not None and before.get('queries') is not None \
+                    and now['queries'] > before['queries']:
+                regressions.append(f"{mode} {name}: {before['queries']} -> {now['queries']} queries/request")
+    return regressions
+
+
+def print_table(mode, results, baseline):
+    print(f'\n{mode}')
+    print(f"{'endpoint':<24} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8} "
+          f"{'RSS MiB':>8} {'errors':>7} {'p95 vs base':>12}")
+    for name, r in results.items():
+        before = baseline.get(mode, {}).get(name) if baseline else None
+        delta = f"{(r['p95'] / before['p95'] - 1) * 100:+.0f}%" if before and before['p95'] else ''
+        queries = '' if r.get('queries') is None else r['queries']
+        print(f"{name:<24} {r['rps']:>8.0f} {r['p50']:>8.1f} {r['p95']:>8.1f} {r['p99']:>8.1f} {queries:>8} "
+              f"{r['rss_mb'] or '':>8} {r['errors']:>7} {delta:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=float, default=0.02, help='seed.py scale (1 = 50k students, 5M grades)')
+    parser.add_argument('--modes', default='client', help='client, server or client,server')
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=8, help='connections in server mode')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers in server mode')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', help='compare against this saved run')
+    parser.add_argument('--save-baseline', help='write this run here')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown before failing')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    app = create_app()
+    counts = counts_for(args.scale)
+    with app.app_context():
+        seed(counts, args.seed)
+        counts['classes'] = db.session.execute(db.text('SELECT count(*) FROM classes')).scalar()
+        counts['users'] = db.session.execute(db.text('SELECT count(*) FROM users')).scalar()
+        admin_id = db.session.execute(db.text("SELECT min(id) FROM users WHERE role = 'admin'")).scalar()
+        tokens = {
+            'admin': create_access_token(identity=admin_id, additional_claims={'role': 'admin'},
+                                         expires_delta=False),
+            'student': create_access_token(identity=1, additional_claims={'role': 'student'}, expires_delta=False),
+        }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    results = {}
+    for mode in args.modes.split(','):
+        if mode == 'client':
+            results[mode] = run_client(app, counts, tokens, args)
+        else:
+            results[mode] = run_server(counts, tokens, args)
+        print_table(mode, results[mode], baseline)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f'\nSaved baseline to {args.save_baseline}')
+    if baseline:
+        regressions = compare(results, baseline, args.tolerance)
+        print(f'\n{len(regressions)} regression(s) against {args.baseline}')
+        for line in regressions:
+            print(f'  {line}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Export memory benchmark.
+
+Seeds a temporary database with a large grades table, then dumps it through
+GET /exports/grades in each format, with and without gzip, reading the
+response as a client would. Reports rows/second, output size and the peak
+Python memory allocated while each export ran, next to the old approach of
+Grade.query.all() plus jsonify. The export peak should not grow with --rows.
+
+    python benchmarks/exports.py [--rows 200000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{_tmp.name}/exports.db')
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(_tmp.name, 'uploads'))
+os.environ.setdefault('METRICS_ENABLED', 'false')
+os.environ.setdefault('RATELIMIT_ENABLED', 'false')
+
+from flask import jsonify  # noqa: E402
+from flask_jwt_extended import create_access_token  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+
+from app import create_app  # noqa: E402
+from models import db, Grade, Student, Subject, User  # noqa: E402
+
+app = create_app()
+
+
+def seed(rows, rng):
+    db.session.execute(insert(User.__table__), [
+        {'email': 'admin@school.test', 'username': 'admin', 'password': 'x', 'role': 'admin'},
+    ])
+    db.session.execute(insert(Student.__table__), [
+        {'username': f'student{i}', 'email': f'student{i}@school.test', 'grade': i % 12 + 1} for i in range(2000)
+    ])
+    db.session.execute(insert(Subject.__table__), [{'name': f'Subject {i}'} for i in range(20)])
+    start = datetime(2026, 1, 5)
+    for offset in range(0, rows, 50000):
+        db.session.execute(insert(Grade.__table__), [
+            {'student_id': rng.randint(1, 2000), 'subject_id': rng.randint(1, 20),
+             'grade': round(rng.uniform(20, 100), 1), 'recorded_at': start + timedelta(minutes=i)}
+            for i in range(offset, min(rows, offset + 50000))
+        ])
+    db.session.commit()
+
+
+def measure(run):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+    size = run()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return size, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    with app.app_context():
+        seed(args.rows, random.Random(args.seed))
+        token = create_access_token(identity=1, additional_claims={'role': 'admin'})
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {token}'}
+
+    def export(query):
+        def run():
+            response = client.get(f'/exports/grades?{query}', headers=headers, buffered=False)
+            assert response.status_code == 200, response.status_code
+            size = sum(len(chunk) for chunk in response.response)
+            response.close()
+            return size
+        return run
+
+    def query_all():
+        with app.test_request_context():
+            return len(jsonify([grade.to_dict() for grade in Grade.query.all()]).get_data())
+
+    cases = [('query.all() + jsonify', query_all)] + [
+        (f'{fmt}{" gzip" if gzip else ""}', export(f'format={fmt}' + ('&compress=gzip' if gzip else '')))
+        for fmt in ('csv', 'ndjson', 'columns') for gzip in (False, True)
+    ]
+    print(f'{args.rows} grades')
+    print(f"{'export':<24} {'rows/s':>9} {'MiB out':>8} {'peak MiB':>9}")
+    for name, run in cases:
+        size, elapsed, peak = measure(run)
+        print(f'{name:<24} {args.rows / elapsed:>9.0f} {size / 2 ** 20:>8.1f} {peak / 2 ** 20:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Conditional GET and compression benchmark.
+
+Seeds a temporary database with `seed.py` at --scale, then requests a few
+list endpoints through the Flask test client in four ways: a plain request,
+one accepting gzip, one accepting br (with `pip install brotli`), and a
+revalidation sending back the ETag of an earlier response. For each reports
+bytes on the wire, p50/p95 latency and SQL queries per request. A 304 should
+cost one watermark lookup and no body.
+
+    python benchmarks/http_caching.py [--scale 0.02] [--requests 200]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{_tmp.name}/http_caching.db')
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(_tmp.name, 'uploads'))
+os.environ.setdefault('METRICS_ENABLED', 'false')
+os.environ.setdefault('RATELIMIT_ENABLED', 'false')
+
+from flask_jwt_extended import create_access_token  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+from app import create_app  # noqa: E402
+from compression import encodings  # noqa: E402
+from models import db  # noqa: E402
+from seed import counts_for, seed  # noqa: E402
+
+app = create_app()
+
+PATHS = [
+    '/news?limit=100',
+    '/books?limit=100',
+    '/grades?limit=100',
+    '/classes?limit=100',
+    '/subjects',
+    '/search?q=music+festival',
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=float, default=0.02)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    with app.app_context():
+        seed(counts_for(args.scale), 1)
+        token = create_access_token(identity=1, additional_claims={'role': 'admin'})
+        engine = db.engine
+    client = app.test_client()
+    auth = {'Authorization': f'Bearer {token}'}
+
+    queries = [0]
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def count(*args):
+        queries[0] += 1
+
+    def run(path, headers, status):
+        timings, size = [], 0
+        queries[0] = 0
+        for _ in range(args.requests):
+            started = time.perf_counter()
+            response = client.get(path, headers=headers)
+            size = len(response.data)
+            timings.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == status, (path, response.status_code)
+        timings.sort()
+        return size, timings[len(timings) // 2], timings[int(len(timings) * 0.95)], queries[0] / args.requests
+
+    print(f"{'endpoint':<28} {'request':<12} {'bytes':>8} {'p50 ms':>8} {'p95 ms':>8} {'queries':>8}")
+    for path in PATHS:
+        etag = client.get(path, headers=auth).headers['ETag']
+        cases = [('identity', {}, 200)] + [(encoding, {'Accept-Encoding': encoding}, 200)
+                                           for encoding in reversed(encodings())]
+        cases.append(('304', {'If-None-Match': etag}, 304))
+        sizes = []
+        for name, headers, status in cases:
+            size, p50, p95, per_request = run(path, {**auth, **headers}, status)
+            sizes.append(size)
+            print(f'{path:<28} {name:<12} {size:>8} {p50:>8.2f} {p95:>8.2f} {per_request:>8.1f}')
+        if sizes[0]:
+            print(f"{'':<28} {'saved':<12} {statistics.mean(1 - s / sizes[0] for s in sizes[1:-1]):>8.0%}")
+
+
+if __name__ == '__main__':
+    main()
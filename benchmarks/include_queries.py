@@ -0,0 +1,87 @@
+"""Check that ?include= eager loading runs a constant number of queries.
+
+Requests /classes?include=students,schedule and /grades?include=student,subject
+at two dataset sizes and fails if the number of SQL statements grows with the
+number of rows.
+
+    python benchmarks/include_queries.py
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{_tmp.name}/include.db')
+os.environ.setdefault('RESPONSE_CACHE_ENABLED', 'false')
+
+from flask_jwt_extended import create_access_token  # noqa: E402
+from sqlalchemy import event, insert  # noqa: E402
+
+from app import create_app  # noqa: E402
+from models import db, Class, Grade, Schedule, Student, Subject, student_class  # noqa: E402
+
+app = create_app()
+
+URLS = [
+    '/classes?limit=1000&include=students,schedule',
+    '/grades?limit=1000&include=student,subject',
+    '/subjects?limit=1000&include=grades,teachers',
+]
+
+
+def seed(classes):
+    db.drop_all()
+    db.create_all()
+    db.session.execute(insert(Subject.__table__), [{'name': f'subject{i}'} for i in range(10)])
+    db.session.execute(insert(Class.__table__), [{'name': f'class{i}'} for i in range(classes)])
+    db.session.execute(insert(Student.__table__), [{'username': f'student{i}'} for i in range(classes * 5)])
+    db.session.execute(insert(student_class), [
+        {'student_id': s + 1, 'class_id': s // 5 + 1} for s in range(classes * 5)
+    ])
+    db.session.execute(insert(Schedule.__table__), [
+        {'class_id': c % classes + 1, 'location': 'room'} for c in range(classes * 3)
+    ])
+    db.session.execute(insert(Grade.__table__), [
+        {'student_id': g % (classes * 5) + 1, 'subject_id': g % 10 + 1, 'grade': 70.0} for g in range(classes * 4)
+    ])
+    db.session.commit()
+
+
+def count_queries(client, headers, url):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        response = client.get(url, headers=headers)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return len(statements), len(response.json)
+
+
+def main():
+    client = app.test_client()
+    with app.app_context():
+        headers = {'Authorization': 'Bearer ' + create_access_token(identity=1, additional_claims={'role': 'admin'})}
+    failed = False
+    results = {}
+    for size in (10, 200):
+        with app.app_context():
+            seed(size)
+            for url in URLS:
+                results.setdefault(url, []).append(count_queries(client, headers, url))
+    for url, ((small_queries, small_rows), (large_queries, large_rows)) in results.items():
+        ok = small_queries == large_queries
+        failed |= not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {url}: {small_queries} queries for {small_rows} rows, "
+              f"{large_queries} queries for {large_rows} rows")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
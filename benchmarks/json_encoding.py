@@ -0,0 +1,81 @@
+"""JSON encoding microbenchmark.
+
+Seeds a temporary database with `seed.py` at --scale, loads up to --rows
+rows of several resources as the list endpoints do (column tuples), then
+times turning them into a response body three ways:
+
+* stdlib: dates converted in Python, then json.dumps (Flask-RESTful's
+  default representation, and ours without orjson)
+* orjson: the same converted dicts, encoded by orjson
+* orjson native: dicts straight from the tuples, dates written by orjson
+
+Reports rows/second and MiB/second of output for each.
+
+    python benchmarks/json_encoding.py [--scale 0.02] [--rows 20000]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{_tmp.name}/json_encoding.db')
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(_tmp.name, 'uploads'))
+os.environ.setdefault('METRICS_ENABLED', 'false')
+
+from app import create_app  # noqa: E402
+from models import db, Book, CheckoutRecord, Grade, Message, News, Schedule  # noqa: E402
+from representations import FastJSONProvider, orjson  # noqa: E402
+from seed import counts_for, seed  # noqa: E402
+from serializers import serializer_for  # noqa: E402
+
+app = create_app()
+
+MODELS = [Grade, Message, Schedule, CheckoutRecord, News, Book]
+
+
+def timed(encode, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = encode()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return len(body), best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=float, default=0.02)
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    if orjson is None:
+        sys.exit('orjson is not installed (pip install orjson)')
+
+    provider = FastJSONProvider(app)
+    print(f"{'resource':<18} {'encoder':<15} {'rows':>7} {'rows/s':>10} {'MiB/s':>8}")
+    with app.app_context():
+        seed(counts_for(args.scale), 1)
+        for model in MODELS:
+            serializer = serializer_for(model)
+            rows = db.session.execute(serializer.select().limit(args.rows)).all()
+            converted = serializer.row_factory()
+            native = serializer.row_factory(convert=False)
+            encoders = [
+                ('stdlib', lambda: (json.dumps([converted(row) for row in rows]) + '\n').encode()),
+                ('orjson', lambda: provider.dumpb([converted(row) for row in rows], sort_keys=False)),
+                ('orjson native', lambda: provider.dumpb([native(row) for row in rows], sort_keys=False)),
+            ]
+            for name, encode in encoders:
+                size, elapsed = timed(encode, args.repeat)
+                print(f'{model.__tablename__:<18} {name:<15} {len(rows):>7} {len(rows) / elapsed:>10.0f} '
+                      f'{size / elapsed / 2 ** 20:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
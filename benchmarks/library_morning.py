@@ -0,0 +1,157 @@
+"""Load test: a whole school checks out library books in one morning.
+
+Seeds students, books with a few copies each and a circulation history with
+overdue loans. Worker processes, like gunicorn workers, then send every
+student to POST /checkout-records for random books while another process
+runs the overdue fines/reminders job over the history. Reports checkout
+throughput and latency, how long the job took, and fails if any request
+errored or any book ended up lent out more times than it has copies.
+
+    python benchmarks/library_morning.py [--students 3000] [--workers 8]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{_tmp.name}/library.db')
+os.environ.setdefault('METRICS_ENABLED', 'false')
+os.environ.setdefault('RATELIMIT_ENABLED', 'false')
+
+from flask_jwt_extended import create_access_token  # noqa: E402
+from sqlalchemy import func, insert, select  # noqa: E402
+
+from app import create_app  # noqa: E402
+from library import process_overdue  # noqa: E402
+from models import db, Book, CheckoutRecord, Library, User  # noqa: E402
+
+app = create_app()
+
+
+def seed(args, rng):
+    db.drop_all()
+    db.create_all()
+    db.session.execute(insert(Library.__table__), [{'name': 'main'}])
+    db.session.execute(insert(User.__table__), [
+        {'email': f'student{i}@school.test', 'username': f'student{i}', 'password': 'x', 'role': 'student'}
+        for i in range(args.students)
+    ])
+    db.session.execute(insert(Book.__table__), [
+        {'title': f'book {i}', 'library_id': 1, 'copies': rng.randint(1, args.copies)} for i in range(args.books)
+    ])
+    today = date.today()
+    history = []
+    for _ in range(args.history):
+        checkout_date = today - timedelta(days=rng.randint(15, 400))
+        returned = rng.random() > 0.05
+        history.append({
+            'book_id': rng.randint(1, args.books), 'user_id': rng.randint(1, args.students),
+            'checkout_date': checkout_date, 'due_date': checkout_date + timedelta(days=14),
+            'returned_date': checkout_date + timedelta(days=rng.randint(1, 20)) if returned else None,
+        })
+    db.session.execute(insert(CheckoutRecord.__table__), history)
+    db.session.commit()
+    # Copies are on top of the loans still open from the history, so the
+    # over-lending check below only judges the morning's checkouts
+    for book_id, on_loan in db.session.execute(
+        select(CheckoutRecord.book_id, func.count()).where(CheckoutRecord.returned_date.is_(None))
+        .group_by(CheckoutRecord.book_id)
+    ).all():
+        book = db.session.get(Book, book_id)
+        book.copies += on_loan
+    db.session.commit()
+
+
+def checkout_worker(args, worker_id, results):
+    rng = random.Random(worker_id)
+    client = app.test_client()
+    latencies, statuses = [], {}
+    with app.app_context():
+        db.engine.dispose(close=False)
+        for student in range(worker_id, args.students, args.workers):
+            token = create_access_token(identity=student + 1, additional_claims={'role': 'student'})
+            headers = {'Authorization': f'Bearer {token}'}
+            for _ in range(args.loans):
+                started = time.perf_counter()
+                response = client.post('/checkout-records', headers=headers,
+                                       json={'book_id': rng.randint(1, args.books)})
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    results.put(('checkout', latencies, statuses))
+
+
+def overdue_worker(args, results):
+    with app.app_context():
+        db.engine.dispose(close=False)
+        started = time.perf_counter()
+        stats = process_overdue(chunk_size=args.chunk_size)
+        results.put(('overdue', time.perf_counter() - started, stats))
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=3000)
+    parser.add_argument('--loans', type=int, default=2, help='checkout attempts per student')
+    parser.add_argument('--books', type=int, default=1500)
+    parser.add_argument('--copies', type=int, default=3, help='maximum copies per book')
+    parser.add_argument('--history', type=int, default=200000, help='past loans to seed')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--chunk-size', type=int, default=1000, help='overdue job chunk size')
+    args = parser.parse_args()
+
+    with app.app_context():
+        seed(args, random.Random(42))
+        db.engine.dispose()
+
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=checkout_worker, args=(args, n, results)) for n in range(args.workers)]
+    processes.append(multiprocessing.Process(target=overdue_worker, args=(args, results)))
+    started = time.perf_counter()
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - started
+
+    latencies, statuses = [], {}
+    for result in collected:
+        if result[0] == 'checkout':
+            latencies.extend(result[1])
+            for status, count in result[2].items():
+                statuses[status] = statuses.get(status, 0) + count
+        else:
+            job_seconds, job_stats = result[1], result[2]
+
+    with app.app_context():
+        on_loan = select(func.count()).where(
+            CheckoutRecord.returned_date.is_(None), CheckoutRecord.book_id == Book.id,
+        ).scalar_subquery()
+        over_lent = db.session.execute(select(func.count()).where(on_loan > Book.copies)).scalar()
+
+    print(f'{args.students} students x {args.loans} attempts, {args.workers} workers, {args.history} past loans')
+    print(f'checkouts: {len(latencies)} requests in {elapsed:.1f}s ({len(latencies) / elapsed:.0f} req/s), '
+          f'statuses {dict(sorted(statuses.items()))}')
+    print(f'latency: p50 {percentile(latencies, 50):.1f} ms, p95 {percentile(latencies, 95):.1f} ms, '
+          f'p99 {percentile(latencies, 99):.1f} ms')
+    print(f"overdue job: {job_stats['processed']} loans in {job_stats['chunks']} chunks, {job_seconds:.1f}s "
+          f"alongside the checkouts")
+    print(f'books lent beyond their copies: {over_lent}')
+    failed = over_lent or any(status not in (201, 409) for status in statuses)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Compare SQLite query plans and timings with and without the lookup indexes.
+
+    python benchmarks/query_plans.py [--rows 200000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine, insert, text
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from models import db, Book, CheckoutRecord, Grade, Message, Schedule, Teacher  # noqa: E402
+
+QUERIES = [
+    ('grades by student', 'SELECT * FROM grades WHERE student_id = :n'),
+    ('grades by student and subject', 'SELECT * FROM grades WHERE student_id = :n AND subject_id = 3'),
+    ('grades by subject', 'SELECT count(*) FROM grades WHERE subject_id = 3'),
+    ('schedules by teacher', 'SELECT * FROM schedules WHERE teacher_id = :n'),
+    ('checkouts due before', "SELECT * FROM checkout_records WHERE due_date < '2024-01-10'"),
+    ('checkouts by book', 'SELECT * FROM checkout_records WHERE book_id = :n'),
+    ('messages by sender', 'SELECT * FROM messages WHERE sender_id = :n'),
+    ('teacher by email', "SELECT * FROM teachers WHERE email = 'teacher' || :n || '@school.test'"),
+]
+
+
+def seed(engine, rows):
+    rng = random.Random(42)
+    people = max(rows // 100, 10)
+    with engine.begin() as conn:
+        conn.execute(insert(Teacher.__table__), [
+            {'username': f'teacher{i}', 'email': f'teacher{i}@school.test'} for i in range(people)
+        ])
+        conn.execute(insert(Book.__table__), [{'title': f'book{i}'} for i in range(people)])
+        conn.execute(insert(Grade.__table__), [
+            {'student_id': rng.randint(1, people), 'subject_id': rng.randint(1, 20), 'grade': rng.uniform(0, 100)}
+            for _ in range(rows)
+        ])
+        conn.execute(insert(Schedule.__table__), [
+            {'class_id': rng.randint(1, 200), 'teacher_id': rng.randint(1, people), 'location': f'room{i % 50}'}
+            for i in range(rows // 10)
+        ])
+        start = date(2024, 1, 1)
+        conn.execute(insert(CheckoutRecord.__table__), [
+            {'book_id': rng.randint(1, people), 'user_id': rng.randint(1, people),
+             'checkout_date': start, 'due_date': start + timedelta(days=rng.randint(1, 365))}
+            for _ in range(rows // 2)
+        ])
+        conn.execute(insert(Message.__table__), [
+            {'sender_id': rng.randint(1, people), 'content': 'hello'} for _ in range(rows // 2)
+        ])
+    return people
+
+
+def indexes():
+    return [index for table in db.metadata.sorted_tables for index in table.indexes]
+
+
+def run(engine, people, label, repeat=20):
+    print(f'\n== {label} ==')
+    with engine.connect() as conn:
+        for name, sql in QUERIES:
+            params = {'n': people // 2}
+            plan = '; '.join(row[3] for row in conn.execute(text('EXPLAIN QUERY PLAN ' + sql), params))
+            started = time.perf_counter()
+            for _ in range(repeat):
+                conn.execute(text(sql), params).fetchall()
+            elapsed = (time.perf_counter() - started) / repeat * 1000
+            print(f'{name:32} {elapsed:9.3f} ms  {plan}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=200000, help='number of grade rows to generate')
+    args = parser.parse_args()
+
+    engine = create_engine('sqlite://')
+    db.metadata.create_all(engine)
+    for index in indexes():
+        index.drop(engine)
+    people = seed(engine, args.rows)
+    run(engine, people, 'without indexes')
+
+    for index in indexes():
+        index.create(engine)
+    with engine.begin() as conn:
+        conn.execute(text('ANALYZE'))
+    run(engine, people, 'with indexes')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Roster import throughput benchmark.
+
+Generates CSV rosters for a whole school (students, teachers, classes,
+subjects and the enrolment / teaching links between them, with a sprinkling
+of bad rows), imports them with `flask import-roster`'s RosterImport, then
+re-imports the students file with changes to measure the update path.
+Reports rows/second per file.
+
+    python benchmarks/roster_import.py [--students 20000] [--chunk-size 500]
+"""
+import argparse
+import csv
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{_tmp.name}/roster.db')
+os.environ.setdefault('METRICS_ENABLED', 'false')
+os.environ.setdefault('RATELIMIT_ENABLED', 'false')
+
+from app import create_app  # noqa: E402
+from roster import RosterImport, csv_rows  # noqa: E402
+
+
+def write_csv(name, header, rows):
+    path = os.path.join(_tmp.name, f'{name}.csv')
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+    return path
+
+
+def generate(args, rng):
+    classes = [f'{grade}{section}' for grade in range(1, 13) for section in 'ABCDEFGH']
+    subjects = [f'Subject {i}' for i in range(40)]
+    teachers = args.students // 20
+    students = [
+        (f'Student{i}@School.test', f'student{i}', f'07{i:08d}', str(rng.randint(1, 12)))
+        for i in range(args.students)
+    ]
+    # About 1% of rows are bad: missing keys or a non-numeric grade
+    for i in rng.sample(range(args.students), args.students // 100):
+        students[i] = ('', students[i][1], '', students[i][3]) if i % 2 else (*students[i][:3], 'n/a')
+    files = [
+        ('classes', write_csv('classes', ['name', 'grade_level'], [(name, name[:-1]) for name in classes])),
+        ('subjects', write_csv('subjects', ['name', 'description'], [(name, 'core') for name in subjects])),
+        ('teachers', write_csv('teachers', ['email', 'username'],
+                               [(f'teacher{i}@school.test', f'teacher{i}') for i in range(teachers)])),
+        ('students', write_csv('students', ['email', 'username', 'phone_number', 'grade'], students)),
+        ('enrollments', write_csv('enrollments', ['student_email', 'class_name'], [
+            (f'student{i}@school.test', name)
+            for i in range(args.students) for name in rng.sample(classes, args.classes_per_student)
+        ])),
+        ('teacher_subjects', write_csv('teacher_subjects', ['teacher_email', 'subject_name'], [
+            (f'teacher{i}@school.test', name) for i in range(teachers) for name in rng.sample(subjects, 3)
+        ])),
+    ]
+    changed = [(email, username, phone, str(rng.randint(1, 12))) for email, username, phone, _ in students]
+    files.append(('students', write_csv('students_again', ['email', 'username', 'phone_number', 'grade'], changed)))
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=20000)
+    parser.add_argument('--classes-per-student', type=int, default=3)
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    files = generate(args, random.Random(args.seed))
+    app = create_app()
+    print(f"{'file':<22} {'rows':>7} {'created':>8} {'updated':>8} {'same':>7} {'failed':>7} "
+          f"{'seconds':>8} {'rows/s':>8}")
+    with app.app_context():
+        for kind, path in files:
+            with open(path, 'rb') as f:
+                stats = RosterImport(kind, args.chunk_size).run(csv_rows(f))
+            print(f"{os.path.basename(path):<22} {stats['rows']:>7} {stats['created']:>8} {stats['updated']:>8} "
+                  f"{stats['unchanged']:>7} {stats['failed']:>7} {stats['seconds']:>8.2f} "
+                  f"{stats['rows_per_second']:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Measure /search latency against a synthetic full-text corpus.
+
+Generates --rows documents (default 1,000,000) spread over news, forums,
+files, links and books, with words drawn from a Zipf-distributed vocabulary
+so there are very common, mid-frequency and rare terms. Rows are inserted
+through the normal tables so the FTS triggers index them. Each query is then
+run --repeat times through the test client and p50/p95 are reported; the
+script exits non-zero if any p95 exceeds --target-ms.
+
+    python benchmarks/search.py [--rows 1000000] [--target-ms 50]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{_tmp.name}/search.db')
+os.environ.setdefault('RESPONSE_CACHE_ENABLED', 'false')
+os.environ.setdefault('METRICS_ENABLED', 'false')
+os.environ.setdefault('RATELIMIT_ENABLED', 'false')
+
+from flask_jwt_extended import create_access_token  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+
+from app import create_app  # noqa: E402
+from models import db  # noqa: E402
+from search import SOURCES  # noqa: E402
+
+app = create_app()
+
+SHARES = {'news': 0.4, 'forums': 0.15, 'files': 0.15, 'links': 0.15, 'books': 0.15}
+VOCABULARY = 50000
+CHUNK = 10000
+
+
+def make_vocabulary(rng):
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    words = set()
+    while len(words) < VOCABULARY:
+        words.add(''.join(rng.choice(letters) for _ in range(rng.randint(3, 10))))
+    return sorted(words, key=lambda w: rng.random())
+
+
+def make_text(rng, words, weights, length):
+    return ' '.join(rng.choices(words, cum_weights=weights, k=length))
+
+
+def seed(rows, rng):
+    words = make_vocabulary(rng)
+    weights = []
+    total = 0.0
+    for rank in range(1, len(words) + 1):
+        total += 1.0 / rank
+        weights.append(total)
+    db.drop_all()
+    db.create_all()
+    started = time.perf_counter()
+    for name, model, title, body in SOURCES:
+        count = int(rows * SHARES[name])
+        body_length = 8 if name == 'books' else 40
+        for offset in range(0, count, CHUNK):
+            db.session.execute(insert(model.__table__), [
+                {title: make_text(rng, words, weights, 4), body: make_text(rng, words, weights, body_length)}
+                for _ in range(min(CHUNK, count - offset))
+            ])
+            db.session.commit()
+    elapsed = time.perf_counter() - started
+    print(f'indexed {rows} rows in {elapsed:.1f}s ({rows / elapsed:.0f} rows/s)')
+    return words
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000, help='documents to generate')
+    parser.add_argument('--repeat', type=int, default=30, help='runs per query')
+    parser.add_argument('--target-ms', type=float, default=50.0, help='p95 budget per query')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    client = app.test_client()
+    with app.app_context():
+        words = seed(args.rows, rng)
+        headers = {'Authorization': 'Bearer ' + create_access_token(identity=1, additional_claims={'role': 'admin'})}
+
+    # words[0] is the most frequent term; later ranks are progressively rarer
+    queries = [
+        ('frequent term', f'q={words[0]}'),
+        ('mid-frequency term', f'q={words[200]}'),
+        ('rare term', f'q={words[20000]}'),
+        ('two terms', f'q={words[50]} {words[120]}'),
+        ('prefix', f'q={words[300][:3]}*'),
+        ('one type', f'q={words[200]}&type=books'),
+        ('deep page', f'q={words[200]}&offset=200&limit=20'),
+    ]
+    failed = False
+    for label, query in queries:
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            response = client.get(f'/search?{query}', headers=headers)
+            timings.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == 200, response.get_data(as_text=True)
+        p50, p95 = percentile(timings, 50), percentile(timings, 95)
+        ok = p95 <= args.target_ms
+        failed |= not ok
+        print(f"{'ok  ' if ok else 'SLOW'} {label:20} p50 {p50:7.2f} ms  p95 {p95:7.2f} ms  "
+              f"{len(response.json['results'])} results  ?{query}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""WSGI (gunicorn gthread) vs ASGI (uvicorn + async list endpoints) benchmark.
+
+Seeds a temporary SQLite database, starts the app under each server with the
+same number of worker processes, and drives both with a closed-loop HTTP load
+generator (keep-alive connections spread over several processes, wrk-style)
+for a fixed duration. The request mix is mostly list pages, which ASGI mode
+serves on the event loop, plus cached and ?include= pages that both modes
+serve through Flask. Reports requests/sec and p50/p99 latency per mode.
+
+    python benchmarks/serving.py [--workers 4] [--connections 64] [--duration 20]
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{_tmp.name}/serving.db')
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(_tmp.name, 'uploads'))
+os.environ.setdefault('METRICS_ENABLED', 'false')
+os.environ.setdefault('RATELIMIT_ENABLED', 'false')
+
+from flask_jwt_extended import create_access_token  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+
+from app import create_app  # noqa: E402
+from models import db, Book, CheckoutRecord, File, Link, News, User  # noqa: E402
+
+MODES = {
+    'wsgi': ['gunicorn', 'app:create_app()', '-c', 'gunicorn.conf.py'],
+    'asgi': ['uvicorn', 'asgi:app', '--host', '127.0.0.1', '--no-access-log'],
+}
+
+
+def seed(args):
+    app = create_app()
+    with app.app_context():
+        db.session.execute(insert(User.__table__), [
+            {'email': 'admin@school.test', 'username': 'admin', 'password': 'x', 'role': 'admin'},
+        ])
+        db.session.execute(insert(Book.__table__), [
+            {'title': f'Book {i}', 'author': f'Author {i % 997}'} for i in range(args.rows)
+        ])
+        db.session.execute(insert(File.__table__), [
+            {'name': f'file-{i}.pdf', 'file_path': f'/files/{i}', 'description': 'notes ' * 20}
+            for i in range(args.rows)
+        ])
+        db.session.execute(insert(Link.__table__), [
+            {'name': f'link {i}', 'url': f'https://example.test/{i}'} for i in range(args.rows)
+        ])
+        db.session.execute(insert(News.__table__), [
+            {'title': f'News {i}', 'content': 'text ' * 50} for i in range(200)
+        ])
+        db.session.execute(insert(CheckoutRecord.__table__), [
+            {'book_id': random.randint(1, args.rows), 'user_id': 1} for _ in range(args.rows)
+        ])
+        db.session.commit()
+        return create_access_token(identity=1, additional_claims={'role': 'admin'}, expires_delta=False)
+
+
+def request_mix(rows):
+    after = random.randint(0, rows - 50)
+    roll = random.random()
+    if roll < 0.25:
+        return f'/books?limit=50&after_id={after}'
+    if roll < 0.5:
+        return f'/files?limit=50&after_id={after}'
+    if roll < 0.7:
+        return f'/links?limit=50&after_id={after}&fields=name,url'
+    if roll < 0.9:
+        return '/news?limit=20'
+    return f'/books?limit=10&after_id={after}&include=checkout_records'
+
+
+def load_process(port, token, threads, duration, rows, results):
+    deadline = time.monotonic() + duration
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+
+    def run():
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        headers = {'Authorization': f'Bearer {token}'}
+        local = []
+        while time.monotonic() < deadline:
+            url = request_mix(rows)
+            started = time.perf_counter()
+            try:
+                connection.request('GET', url, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                ok = False
+            if ok:
+                local.append(time.perf_counter() - started)
+            else:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(local)
+
+    pool = [threading.Thread(target=run) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    results.put((latencies, errors[0]))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/')
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'server on port {port} did not start')
+
+
+def run_mode(mode, args, token):
+    port = free_port()
+    env = dict(os.environ, GUNICORN_WORKERS=str(args.workers), GUNICORN_THREADS=str(args.threads),
+               GUNICORN_BIND=f'127.0.0.1:{port}', ASGI_WSGI_THREADS=str(args.threads))
+    command = MODES[mode] + (['--port', str(port), '--workers', str(args.workers)] if mode == 'asgi' else [])
+    server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(port)
+        results = multiprocessing.Queue()
+        per_process = max(1, args.connections // args.load_processes)
+        loaders = [
+            multiprocessing.Process(target=load_process,
+                                    args=(port, token, per_process, args.duration, args.rows, results))
+            for _ in range(args.load_processes)
+        ]
+        for loader in loaders:
+            loader.start()
+        collected = [results.get() for _ in loaders]
+        for loader in loaders:
+            loader.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = sorted(latency for part, _ in collected for latency in part)
+    errors = sum(part for _, part in collected)
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] * 1000 if latencies else 0
+
+    return len(latencies) / args.duration, percentile(50), percentile(99), errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4, help='server worker processes')
+    parser.add_argument('--threads', type=int, default=8, help='threads per gunicorn worker / WSGI pool in ASGI')
+    parser.add_argument('--connections', type=int, default=64)
+    parser.add_argument('--load-processes', type=int, default=4)
+    parser.add_argument('--duration', type=int, default=20, help='seconds per mode')
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--modes', default='wsgi,asgi')
+    args = parser.parse_args()
+
+    token = seed(args)
+    print(f'{args.workers} workers, {args.connections} connections, {args.duration}s per mode, {args.rows} rows')
+    print(f"{'mode':<6} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for mode in args.modes.split(','):
+        rps, p50, p99, errors = run_mode(mode, args, token)
+        print(f'{mode:<6} {rps:>8.0f} {p50:>8.1f} {p99:>8.1f} {errors:>7}')
+
+
+if __name__ == '__main__':
+    main()
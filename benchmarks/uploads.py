@@ -0,0 +1,132 @@
+"""Upload and download memory benchmark.
+
+Sends files of growing size through POST /files/upload (multipart), the
+resumable /uploads API and GET /files/<id>/download, with request bodies
+streamed from disk, and reports throughput and the peak Python memory
+allocated while each request ran. The peak should stay flat as files grow.
+
+    python benchmarks/uploads.py [--sizes 16,128,512] [--chunk-mb 8]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{_tmp.name}/uploads.db')
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(_tmp.name, 'uploads'))
+os.environ.setdefault('METRICS_ENABLED', 'false')
+os.environ.setdefault('RATELIMIT_ENABLED', 'false')
+
+from flask_jwt_extended import create_access_token  # noqa: E402
+
+from app import create_app  # noqa: E402
+from models import db, User  # noqa: E402
+
+app = create_app()
+
+BOUNDARY = 'benchmark-boundary'
+
+
+def make_source(path, size_mb, seed):
+    block = os.urandom(1024 * 1024 - 1) + bytes([seed])
+    with open(path, 'wb') as f:
+        for _ in range(size_mb):
+            f.write(block)
+
+
+# A multipart body written to disk, so the client side never holds it either
+def make_multipart(source, path, name):
+    with open(path, 'wb') as body, open(source, 'rb') as f:
+        body.write((f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{name}"\r\n'
+                    f'Content-Type: video/mp4\r\n\r\n').encode())
+        while block := f.read(1024 * 1024):
+            body.write(block)
+        body.write(f'\r\n--{BOUNDARY}--\r\n'.encode())
+
+
+def measure(send):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+    result = send()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='16,128,512', help='file sizes in MiB')
+    parser.add_argument('--chunk-mb', type=int, default=8, help='resumable upload chunk size in MiB')
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(email='admin@school.test', username='admin', password='x', role='admin'))
+        db.session.commit()
+        headers = {'Authorization': f"Bearer {create_access_token(identity=1, additional_claims={'role': 'admin'})}"}
+    client = app.test_client()
+
+    print(f"{'size':>8} {'operation':<12} {'MiB/s':>8} {'peak alloc':>12}")
+    for seed, size_mb in enumerate(int(size) for size in args.sizes.split(',')):
+        source = os.path.join(_tmp.name, f'source-{size_mb}')
+        body = os.path.join(_tmp.name, f'body-{size_mb}')
+        make_source(source, size_mb, seed)
+        make_multipart(source, body, f'lecture-{size_mb}.mp4')
+        size = os.path.getsize(source)
+        rows = []
+
+        def multipart():
+            with open(body, 'rb') as f:
+                return client.post('/files/upload', headers=headers, input_stream=f,
+                                   content_length=os.path.getsize(body),
+                                   content_type=f'multipart/form-data; boundary={BOUNDARY}')
+
+        response, elapsed, peak = measure(multipart)
+        assert response.status_code == 201, response.json
+        file_id = response.json['id']
+        rows.append(('multipart', elapsed, peak))
+
+        # Same bytes again, resumably: the content is deduplicated at the end
+        session = client.post('/uploads', headers=headers, json={'name': 'again.mp4', 'size': size}).json
+        chunk = args.chunk_mb * 1024 * 1024
+
+        def resumable():
+            with open(source, 'rb') as f:
+                for start in range(0, size, chunk):
+                    length = min(chunk, size - start)
+                    f.seek(start)
+                    response = client.patch(
+                        f"/uploads/{session['upload_id']}", input_stream=f, content_length=length,
+                        headers={**headers, 'Content-Range': f'bytes {start}-{start + length - 1}/{size}'},
+                    )
+            return response
+
+        response, elapsed, peak = measure(resumable)
+        assert response.status_code == 201 and response.json['deduplicated'], response.json
+        rows.append(('resumable', elapsed, peak))
+
+        def download():
+            response = client.get(f'/files/{file_id}/download', headers=headers, buffered=False)
+            received = sum(len(block) for block in response.response)
+            response.close()
+            return received
+
+        received, elapsed, peak = measure(download)
+        assert received == size
+        rows.append(('download', elapsed, peak))
+
+        for operation, elapsed, peak in rows:
+            print(f'{size_mb:>5}MiB {operation:<12} {size_mb / elapsed:>8.0f} {peak / 1024:>9.0f}KiB')
+        os.remove(source)
+        os.remove(body)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+import json
+from datetime import date, datetime, time
+from itertools import islice
+
+from flask import current_app, request
+from sqlalchemy import Boolean, Date, DateTime, Float, Integer, Time, bindparam, delete, insert, select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def _coerce_int(value):
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError('expected an integer')
+    return int(value)
+
+
+def _coerce_float(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError('expected a number')
+    return float(value)
+
+
+def _coerce_iso(parse):
+    def coerce(value):
+        if not isinstance(value, str):
+            raise ValueError('expected an ISO 8601 string')
+        return parse(value)
+    return coerce
+
+
+def _coerce_bool(value):
+    if not isinstance(value, bool):
+        raise ValueError('expected a boolean')
+    return value
+
+
+def _coercer(column):
+    column_type = column.type
+    if isinstance(column_type, Boolean):
+        return _coerce_bool
+    if isinstance(column_type, Integer):
+        return _coerce_int
+    if isinstance(column_type, Float):
+        return _coerce_float
+    # DateTime must be checked before Date: both parse from ISO strings here.
+    if isinstance(column_type, DateTime):
+        return _coerce_iso(datetime.fromisoformat)
+    if isinstance(column_type, Date):
+        return _coerce_iso(date.fromisoformat)
+    if isinstance(column_type, Time):
+        return _coerce_iso(time.fromisoformat)
+    return str
+
+
+class RowValidator:
+    def __init__(self, model):
+        self.table = model.__table__
+        self.coercers = {c.key: _coercer(c) for c in self.table.columns}
+        self.required = {
+            c.key for c in self.table.columns
+            if not c.nullable and not c.primary_key and c.default is None and c.server_default is None
+        }
+        self.foreign_keys = {
+            c.key: next(iter(c.foreign_keys)).column for c in self.table.columns if c.foreign_keys
+        }
+
+    def clean(self, row, require_id=False):
+        if not isinstance(row, dict):
+            raise ValueError('each row must be an object')
+        unknown = set(row) - set(self.coercers)
+        if unknown:
+            raise ValueError(f"unknown field(s): {', '.join(sorted(unknown))}")
+        if require_id and row.get('id') is None:
+            raise ValueError("'id' is required")
+        if not require_id:
+            if 'id' in row:
+                raise ValueError("'id' cannot be set on create")
+            missing = self.required - set(row)
+            if missing:
+                raise ValueError(f"missing field(s): {', '.join(sorted(missing))}")
+        cleaned = {}
+        for key, value in row.items():
+            try:
+                cleaned[key] = None if value is None else self.coercers[key](value)
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"invalid '{key}': {e}")
+        return cleaned
+
+    # One IN query per foreign key per chunk, instead of one lookup per row.
+    def check_foreign_keys(self, batch):
+        errors = {}
+        for key, target in self.foreign_keys.items():
+            wanted = {row[key] for _, row in batch if row.get(key) is not None}
+            if not wanted:
+                continue
+            found = set(db.session.execute(select(target).where(target.in_(wanted))).scalars())
+            for index, row in batch:
+                if row.get(key) is not None and row[key] not in found:
+                    errors.setdefault(index, f"'{key}' {row[key]} does not exist")
+        return errors
+
+
+_validators = {}
+
+
+def validator_for(model):
+    if model not in _validators:
+        _validators[model] = RowValidator(model)
+    return _validators[model]
+
+
+# Rows come either as a JSON array or as an NDJSON upload, one object per
+# line. NDJSON bodies are read line by line so large uploads are never held
+# in memory as a whole. Yields (index, row, error) tuples.
+def iter_payload():
+    if request.mimetype == NDJSON_MIMETYPE:
+        index = 0
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield index, json.loads(line), None
+            except ValueError:
+                yield index, None, 'invalid JSON'
+            index += 1
+        return
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('items', data.get('ids'))
+    if not isinstance(data, list):
+        raise ValueError('Expected a JSON array or an NDJSON body')
+    for index, row in enumerate(data):
+        yield index, row, None
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def execute_chunk(stmt, batch, errors):
+    if not batch:
+        return 0
+    try:
+        db.session.execute(stmt, [row for _, row in batch])
+        db.session.commit()
+        return len(batch)
+    except SQLAlchemyError:
+        db.session.rollback()
+    # Something in the chunk was rejected by the database; replay it row by
+    # row so only the offending rows are reported.
+    written = 0
+    for index, row in batch:
+        try:
+            db.session.execute(stmt, [row])
+            db.session.commit()
+            written += 1
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            errors.append({'index': index, 'error': str(e.orig if hasattr(e, 'orig') else e)})
+    return written
+
+
+def _result(key, count, errors):
+    errors.sort(key=lambda e: e['index'])
+    body = {key: count, 'errors': errors}
+    if errors and not count:
+        return body, 400
+    if errors:
+        return body, 207
+    return body, 200 if key != 'created' else 201
+
+
+def _run(model, key, require_id, write, on_commit, check=None):
+    validator = validator_for(model)
+    errors = []
+    count = 0
+    try:
+        payload = iter_payload()
+        for chunk in chunks(payload, current_app.config['BULK_CHUNK_SIZE']):
+            batch = []
+            for index, row, error in chunk:
+                if error is None:
+                    try:
+                        row = validator.clean(row, require_id=require_id)
+                    except ValueError as e:
+                        error = str(e)
+                if error is not None:
+                    errors.append({'index': index, 'error': error})
+                else:
+                    batch.append((index, row))
+            for row_check in (validator.check_foreign_keys, check):
+                if row_check is None:
+                    continue
+                row_errors = row_check(batch)
+                if row_errors:
+                    errors.extend({'index': i, 'error': e} for i, e in row_errors.items())
+                    batch = [(i, row) for i, row in batch if i not in row_errors]
+            written, affected = write(validator.table, batch, errors)
+            count += written
+            if on_commit is not None and affected:
+                on_commit(affected)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    return _result(key, count, errors)
+
+
+# executemany needs the same parameter set for every row, so rows are grouped
+# by which columns they carry.
+def group_by_keys(batch):
+    groups = {}
+    for index, row in batch:
+        groups.setdefault(tuple(sorted(row)), []).append((index, row))
+    return groups
+
+
+# on_commit, when given, is called after each chunk with the rows the chunk
+# touched (for updates and deletes, their state before the change as well),
+# so derived data can be refreshed. check, when given, takes a chunk of
+# (index, row) pairs and returns {index: error} for rows to reject; for
+# updates the rows are the patches, each with its 'id'.
+def bulk_create(model, on_commit=None, check=None):
+    def write(table, batch, errors):
+        written = sum(execute_chunk(insert(table), group, errors) for group in group_by_keys(batch).values())
+        return written, [row for _, row in batch]
+    return _run(model, 'created', False, write, on_commit, check)
+
+
+def bulk_update(model, on_commit=None, check=None):
+    def write(table, batch, errors):
+        ids = {row['id'] for _, row in batch}
+        existing = {
+            row['id']: dict(row) for row in db.session.execute(select(table).where(table.c.id.in_(ids))).mappings()
+        }
+        changes = []
+        affected = []
+        for index, row in batch:
+            if row['id'] not in existing:
+                errors.append({'index': index, 'error': f"id {row['id']} not found"})
+                continue
+            params = {('_' + k if k == 'id' else k): v for k, v in row.items()}
+            if len(params) == 1:
+                errors.append({'index': index, 'error': 'nothing to update'})
+                continue
+            changes.append((index, params))
+            affected.extend((existing[row['id']], row))
+        written = 0
+        for keys, group in group_by_keys(changes).items():
+            stmt = (
+                update(table)
+                .where(table.c.id == bindparam('_id'))
+                .values({k: bindparam(k) for k in keys if k != '_id'})
+            )
+            written += execute_chunk(stmt, group, errors)
+        return written, affected
+    return _run(model, 'updated', True, write, on_commit, check)
+
+
+def bulk_delete(model, on_commit=None):
+    table = model.__table__
+    errors = []
+    deleted = 0
+    try:
+        payload = iter_payload()
+        for chunk in chunks(payload, current_app.config['BULK_CHUNK_SIZE']):
+            ids = {}
+            for index, value, error in chunk:
+                if error is None and (isinstance(value, bool) or not isinstance(value, int)):
+                    error = 'expected an integer id'
+                if error is not None:
+                    errors.append({'index': index, 'error': error})
+                else:
+                    ids[value] = index
+            rows = [dict(row) for row in db.session.execute(select(table).where(table.c.id.in_(ids))).mappings()]
+            existing = {row['id'] for row in rows}
+            errors.extend({'index': i, 'error': f'id {v} not found'} for v, i in ids.items() if v not in existing)
+            if existing:
+                db.session.execute(delete(table).where(table.c.id.in_(existing)))
+                db.session.commit()
+                deleted += len(existing)
+                if on_commit is not None:
+                    on_commit(rows)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    return _result('deleted', deleted, errors)
@@ -0,0 +1,143 @@
+import time
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+
+from flask import Response, current_app, request
+from flask_restful import unpack
+
+from compression import compress, negotiate, should_compress
+from pagination import wants_stream
+from representations import output_json
+from watermarks import (conditional, is_not_modified, not_modified_response, read as read_watermarks,
+                        set_validators, validators, versions_key)
+
+
+# Anything that can get/set values can back the response cache, e.g. a
+# Redis or memcached client wrapper shared by all workers.
+class CacheBackend:
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class LocalCache(CacheBackend):
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Entries are keyed by the request URL and the current watermark version of
+# every table the response reads (see watermarks.py). Committing a write to
+# one of those tables bumps its version in the database, so stale entries
+# can no longer be reached from any worker and simply age out of the LRU.
+class ResponseCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, versions):
+        args = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+        return f'response:{request.path}?{args}|{versions}'
+
+
+def init_app(app, backend=None):
+    app.config.setdefault('RESPONSE_CACHE_ENABLED', True)
+    app.config.setdefault('RESPONSE_CACHE_SIZE', 1024)
+    app.config.setdefault('RESPONSE_CACHE_TTL', 300)
+    if not app.config['RESPONSE_CACHE_ENABLED']:
+        app.extensions['response_cache'] = None
+        return
+    if backend is None:
+        backend = LocalCache(app.config['RESPONSE_CACHE_SIZE'], app.config['RESPONSE_CACHE_TTL'])
+    app.extensions['response_cache'] = ResponseCache(backend)
+
+
+# Conditional GET (see watermarks.conditional) plus a cache of the encoded
+# JSON body, and of its compressed forms as clients ask for them. Must sit
+# below the auth decorator. Responses with ?include= read other tables and
+# are not cached.
+def cached_response(*tables, max_age=0):
+    def decorator(fn):
+        conditional_fn = conditional(*tables, max_age=max_age)(fn)
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            cache = current_app.extensions.get('response_cache')
+            if cache is None or wants_stream() or request.args.get('include'):
+                return conditional_fn(*args, **kwargs)
+            rows = read_watermarks(tables)
+            etag, last_modified = validators(tables, rows)
+            if is_not_modified(etag, last_modified, request.if_none_match, request.if_modified_since):
+                return not_modified_response(etag, last_modified, max_age)
+            key = cache.key(versions_key(tables, rows))
+            entry = cache.backend.get(key)
+            if entry is None:
+                cache.misses += 1
+                data, status, headers = unpack(fn(*args, **kwargs))
+                if status != 200:
+                    return data, status, headers
+                body = output_json(data, status).get_data()
+                entry = (body, dict(headers or {}), {})
+                cache.backend.set(key, entry)
+                state = 'MISS'
+            else:
+                cache.hits += 1
+                state = 'HIT'
+            body, headers, encoded = entry
+            response = Response(body, 200, headers, mimetype='application/json')
+            if should_compress(response) and len(body) >= current_app.config['COMPRESS_MIN_SIZE']:
+                response.vary.add('Accept-Encoding')
+                encoding = negotiate(request.accept_encodings)
+                if encoding is not None:
+                    if encoding not in encoded:
+                        encoded[encoding] = compress(body, encoding)
+                    response.set_data(encoded[encoding])
+                    response.headers['Content-Encoding'] = encoding
+            response.headers['X-Cache'] = state
+            set_validators(response.headers, etag, last_modified, max_age)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,65 @@
+import gzip
+
+from flask import current_app, request
+
+from pagination import NDJSON_MIMETYPE
+
+# brotli is optional (pip install brotli); without it only gzip is offered.
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ('application/json', NDJSON_MIMETYPE, 'text/csv', 'text/plain', 'text/html')
+
+
+def encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+# Honours q-values, so "gzip;q=1, br;q=0.5" gets gzip and "br;q=0" never br.
+def negotiate(accept_encodings):
+    return accept_encodings.best_match(encodings())
+
+
+def compress(body, encoding):
+    config = current_app.config
+    if encoding == 'br':
+        return brotli.compress(body, quality=config['COMPRESS_BROTLI_QUALITY'])
+    return gzip.compress(body, compresslevel=config['COMPRESS_LEVEL'], mtime=0)
+
+
+def should_compress(response):
+    return (
+        current_app.config['COMPRESS_ENABLED']
+        and response.status_code == 200
+        and not response.direct_passthrough
+        and not response.is_streamed
+        and 'Content-Encoding' not in response.headers
+        and response.mimetype in COMPRESSIBLE_MIMETYPES
+    )
+
+
+# Buffered responses of COMPRESS_MIN_SIZE bytes or more are compressed with
+# the best encoding the client accepts. Small bodies gain little, and
+# streamed ones (NDJSON, SSE, exports, file downloads) are left alone.
+def _compress_response(response):
+    if not should_compress(response) or response.content_length is None:
+        return response
+    if response.content_length < current_app.config['COMPRESS_MIN_SIZE']:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate(request.accept_encodings)
+    if encoding is None:
+        return response
+    response.set_data(compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_app(app):
+    app.config.setdefault('COMPRESS_ENABLED', True)
+    app.config.setdefault('COMPRESS_MIN_SIZE', 1024)
+    app.config.setdefault('COMPRESS_LEVEL', 6)
+    app.config.setdefault('COMPRESS_BROTLI_QUALITY', 5)
+    app.after_request(_compress_response)
@@ -0,0 +1,169 @@
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+
+def env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+def env_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value not in (None, '') else default
+
+
+def env_bool(name, default):
+    value = os.environ.get(name)
+    if value in (None, ''):
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+def database_url():
+    url = os.environ.get('DATABASE_URL', 'sqlite:///school.db')
+    # Some hosts still hand out the pre-SQLAlchemy-1.4 scheme
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def is_sqlite(url):
+    return make_url(url).get_backend_name() == 'sqlite'
+
+
+def is_memory_sqlite(url):
+    url = make_url(url)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+# Pool settings only apply to server databases; SQLite file databases use
+# SQLAlchemy's default QueuePool and rely on WAL plus a busy timeout instead.
+def engine_options(url):
+    options = {'pool_pre_ping': env_bool('DB_POOL_PRE_PING', True)}
+    if is_sqlite(url):
+        if not is_memory_sqlite(url):
+            options['connect_args'] = {'timeout': env_int('SQLITE_BUSY_TIMEOUT_MS', 5000) / 1000}
+        return options
+    options.update(
+        pool_size=env_int('DB_POOL_SIZE', 5),
+        max_overflow=env_int('DB_MAX_OVERFLOW', 10),
+        pool_recycle=env_int('DB_POOL_RECYCLE', 1800),
+        pool_timeout=env_int('DB_POOL_TIMEOUT', 30),
+    )
+    return options
+
+
+class Config:
+    SQLALCHEMY_DATABASE_URI = database_url()
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'your_secret_key')
+    JWT_CLAIMS_CACHE_SIZE = env_int('JWT_CLAIMS_CACHE_SIZE', 10000)
+    JWT_CLAIMS_CACHE_TTL = env_int('JWT_CLAIMS_CACHE_TTL', 300)
+
+    SQLITE_WAL = env_bool('SQLITE_WAL', True)
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT_MS = env_int('SQLITE_BUSY_TIMEOUT_MS', 5000)
+
+    PAGE_SIZE_DEFAULT = env_int('PAGE_SIZE_DEFAULT', 100)
+    PAGE_SIZE_MAX = env_int('PAGE_SIZE_MAX', 1000)
+    STREAM_BATCH_SIZE = env_int('STREAM_BATCH_SIZE', 500)
+    BULK_CHUNK_SIZE = env_int('BULK_CHUNK_SIZE', 1000)
+
+    RESPONSE_CACHE_ENABLED = env_bool('RESPONSE_CACHE_ENABLED', True)
+    RESPONSE_CACHE_SIZE = env_int('RESPONSE_CACHE_SIZE', 1024)
+    RESPONSE_CACHE_TTL = env_int('RESPONSE_CACHE_TTL', 300)
+    FAST_JSON = env_bool('FAST_JSON', True)
+    COMPRESS_ENABLED = env_bool('COMPRESS_ENABLED', True)
+    COMPRESS_MIN_SIZE = env_int('COMPRESS_MIN_SIZE', 1024)
+    COMPRESS_LEVEL = env_int('COMPRESS_LEVEL', 6)
+    COMPRESS_BROTLI_QUALITY = env_int('COMPRESS_BROTLI_QUALITY', 5)
+
+    RATELIMIT_ENABLED = env_bool('RATELIMIT_ENABLED', True)
+    RATELIMIT_DEFAULT = os.environ.get('RATELIMIT_DEFAULT', '600/minute')
+    RATELIMIT_LIST = os.environ.get('RATELIMIT_LIST', '120/minute')
+    RATELIMIT_EXPORT = os.environ.get('RATELIMIT_EXPORT', '10/minute')
+    RATELIMIT_LOGIN = os.environ.get('RATELIMIT_LOGIN', '300/minute')
+    RATELIMIT_LOGIN_ACCOUNT = os.environ.get('RATELIMIT_LOGIN_ACCOUNT', '10/minute')
+    RATELIMIT_ROLE_MULTIPLIERS = os.environ.get('RATELIMIT_ROLE_MULTIPLIERS', 'admin=4,teacher=2')
+    RATELIMIT_LIST_CONCURRENCY = env_int('RATELIMIT_LIST_CONCURRENCY', 8)
+    RATELIMIT_EXPORT_CONCURRENCY = env_int('RATELIMIT_EXPORT_CONCURRENCY', 2)
+    RATELIMIT_STORAGE_SIZE = env_int('RATELIMIT_STORAGE_SIZE', 100000)
+
+    MESSAGE_STREAM_TIMEOUT = env_int('MESSAGE_STREAM_TIMEOUT', 55)
+    MESSAGE_KEEPALIVE_SECONDS = env_int('MESSAGE_KEEPALIVE_SECONDS', 15)
+    MESSAGE_UNREAD_CACHE_SIZE = env_int('MESSAGE_UNREAD_CACHE_SIZE', 10000)
+    MESSAGE_UNREAD_CACHE_TTL = env_int('MESSAGE_UNREAD_CACHE_TTL', 60)
+    # 'database' reaches clients on every worker; 'local' only the sender's
+    MESSAGE_BROKER = os.environ.get('MESSAGE_BROKER', 'database')
+    MESSAGE_BROKER_POLL_SECONDS = env_float('MESSAGE_BROKER_POLL_SECONDS', 1.0)
+
+    LIBRARY_LOAN_DAYS = env_int('LIBRARY_LOAN_DAYS', 14)
+    LIBRARY_FINE_PER_DAY = env_float('LIBRARY_FINE_PER_DAY', 0.1)
+    LIBRARY_FINE_CAP = env_float('LIBRARY_FINE_CAP', 10.0)
+    LIBRARY_REMINDER_INTERVAL_DAYS = env_int('LIBRARY_REMINDER_INTERVAL_DAYS', 3)
+    LIBRARY_REMINDER_SENDER_ID = env_int('LIBRARY_REMINDER_SENDER_ID', None)
+    OVERDUE_CHUNK_SIZE = env_int('OVERDUE_CHUNK_SIZE', 1000)
+
+    UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER')
+    UPLOAD_MAX_BYTES = env_int('UPLOAD_MAX_BYTES', 4 * 1024 ** 3)
+    UPLOAD_BUFFER_SIZE = env_int('UPLOAD_BUFFER_SIZE', 1024 * 1024)
+    UPLOAD_SESSION_TTL_HOURS = env_int('UPLOAD_SESSION_TTL_HOURS', 24)
+    USE_X_SENDFILE = env_bool('USE_X_SENDFILE', False)
+    FILE_ACCEL_REDIRECT_PREFIX = os.environ.get('FILE_ACCEL_REDIRECT_PREFIX')
+    EXPORT_CHUNK_SIZE = env_int('EXPORT_CHUNK_SIZE', 5000)
+    EXPORT_GZIP_LEVEL = env_int('EXPORT_GZIP_LEVEL', 6)
+    EXPORT_TTL_HOURS = env_int('EXPORT_TTL_HOURS', 24)
+
+    JOB_MAX_ATTEMPTS = env_int('JOB_MAX_ATTEMPTS', 3)
+    JOB_RETRY_BACKOFF_SECONDS = env_int('JOB_RETRY_BACKOFF_SECONDS', 30)
+    JOB_RETRY_BACKOFF_MAX_SECONDS = env_int('JOB_RETRY_BACKOFF_MAX_SECONDS', 3600)
+    JOB_POLL_SECONDS = env_float('JOB_POLL_SECONDS', 2.0)
+    JOB_STALE_SECONDS = env_int('JOB_STALE_SECONDS', 600)
+    JOB_PROGRESS_INTERVAL = env_float('JOB_PROGRESS_INTERVAL', 1.0)
+    JOB_TTL_DAYS = env_int('JOB_TTL_DAYS', 7)
+
+    SEARCH_MAX_RESULTS = env_int('SEARCH_MAX_RESULTS', 1000)
+    SEARCH_RANK_WINDOW = env_int('SEARCH_RANK_WINDOW', 5000)
+    SCHEDULE_LESSON_MINUTES = env_int('SCHEDULE_LESSON_MINUTES', 60)
+
+    ASYNC_DATABASE_URL = os.environ.get('ASYNC_DATABASE_URL')
+    ASGI_WSGI_THREADS = env_int('ASGI_WSGI_THREADS', 16)
+
+    METRICS_ENABLED = env_bool('METRICS_ENABLED', True)
+    SLOW_QUERY_MS = env_int('SLOW_QUERY_MS', 0)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+    BCRYPT_LOG_ROUNDS = env_int('BCRYPT_LOG_ROUNDS', 12)
+    PASSWORD_HASH_WORKERS = env_int('PASSWORD_HASH_WORKERS', max(1, (os.cpu_count() or 2) // 2))
+    PASSWORD_HASH_QUEUE_DEPTH = env_int('PASSWORD_HASH_QUEUE_DEPTH', 16)
+    PASSWORD_HASH_EXECUTOR = os.environ.get('PASSWORD_HASH_EXECUTOR', 'thread')
+
+
+def apply_sqlite_pragmas(dbapi_connection, wal=True, synchronous='NORMAL', busy_timeout_ms=5000):
+    cursor = dbapi_connection.cursor()
+    # WAL lets readers run alongside the single writer; NORMAL is durable
+    # across application crashes and only syncs at checkpoints.
+    if wal:
+        cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute(f'PRAGMA synchronous={synchronous}')
+    cursor.execute(f'PRAGMA busy_timeout={int(busy_timeout_ms)}')
+    cursor.close()
+
+
+def init_engine(app, db):
+    url = app.config['SQLALCHEMY_DATABASE_URI']
+    if not is_sqlite(url):
+        return
+    wal = app.config.get('SQLITE_WAL', True) and not is_memory_sqlite(url)
+    synchronous = app.config.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    busy_timeout_ms = app.config.get('SQLITE_BUSY_TIMEOUT_MS', 5000)
+
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        apply_sqlite_pragmas(dbapi_connection, wal, synchronous, busy_timeout_ms)
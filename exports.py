@@ -0,0 +1,312 @@
+import csv
+import io
+import os
+import zlib
+from datetime import datetime, timedelta
+
+import click
+from flask import Response, current_app, request, stream_with_context
+from flask.cli import with_appcontext
+from sqlalchemy import delete, func, select
+
+from auth import current_user_id
+from jobs import enqueue, job_handler
+from models import (db, Book, CheckoutRecord, Class, ClassRanking, Club, Event, Export, File, Forum, Grade,
+                    Library, Link, Message, News, ReportCard, Schedule, Sports, SportsEvent, Student, Subject,
+                    Teacher, User)
+from pagination import NDJSON_MIMETYPE, keyset, page_args
+from representations import native_datetimes
+from serializers import serializer_for
+from uploads import send_stored
+
+EXPORTS = {
+    'books': Book,
+    'checkout-records': CheckoutRecord,
+    'class-rankings': ClassRanking,
+    'classes': Class,
+    'clubs': Club,
+    'events': Event,
+    'files': File,
+    'forums': Forum,
+    'grades': Grade,
+    'libraries': Library,
+    'links': Link,
+    'messages': Message,
+    'news': News,
+    'report-cards': ReportCard,
+    'schedules': Schedule,
+    'sports': Sports,
+    'sports-events': SportsEvent,
+    'students': Student,
+    'subjects': Subject,
+    'teachers': Teacher,
+    'users': User,
+}
+# format -> (mimetype, file extension)
+FORMATS = {
+    'csv': ('text/csv', '.csv'),
+    'ndjson': (NDJSON_MIMETYPE, '.ndjson'),
+    'columns': (NDJSON_MIMETYPE, '.columns.ndjson'),
+}
+GZIP_MIMETYPE = 'application/gzip'
+
+
+def _csv(fields, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def write(rows):
+        writer.writerows(rows)
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return text
+
+    return write([fields]), write
+
+
+def _ndjson(fields, columns):
+    dumps = current_app.json.dumps
+
+    def write(rows):
+        return ''.join(dumps(dict(zip(fields, row))) + '\n' for row in rows)
+
+    return '', write
+
+
+# Column-oriented NDJSON: a header line naming the columns and their SQL
+# types, then one line per chunk holding an array of values for each column.
+# Names are written once instead of once per row, and runs of similar values
+# sit together, so it is smaller than NDJSON and compresses better.
+def _columns(fields, columns):
+    dumps = current_app.json.dumps
+    header = dumps({'columns': list(fields), 'types': [str(column.type) for column in columns]}) + '\n'
+
+    def write(rows):
+        return dumps([list(values) for values in zip(*rows)]) + '\n'
+
+    return header, write
+
+
+WRITERS = {'csv': _csv, 'ndjson': _ndjson, 'columns': _columns}
+
+
+def _converter(serializer, fields):
+    converted = [(i, serializer.converters[name]) for i, name in enumerate(fields) if serializer.converters[name]]
+    if not converted:
+        return None
+
+    def convert(row):
+        values = list(row)
+        for i, fn in converted:
+            values[i] = fn(values[i])
+        return values
+
+    return convert
+
+
+# Rows are fetched EXPORT_CHUNK_SIZE at a time (a server-side cursor on
+# PostgreSQL) and each chunk is formatted as one piece of text, so memory
+# stays flat whatever the size of the table. `stats` counts rows written.
+# Only CSV needs dates turned into strings first when app.json writes them.
+# `bind` reads through another connection than the session's.
+def generate(model, fields, fmt, after_id=0, limit=None, stats=None, bind=None):
+    serializer = serializer_for(model)
+    header, write = WRITERS[fmt](fields, [serializer.by_name[name] for name in fields])
+    convert = _converter(serializer, fields) if fmt == 'csv' or not native_datetimes() else None
+    stmt = keyset(serializer.select(fields), model, after_id)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    stmt = stmt.execution_options(yield_per=current_app.config['EXPORT_CHUNK_SIZE'])
+    if header:
+        yield header
+    for rows in (bind or db.session).execute(stmt).partitions():
+        if convert is not None:
+            rows = [convert(row) for row in rows]
+        if stats is not None:
+            stats['rows'] += len(rows)
+        yield write(rows)
+
+
+def encode(pieces, compress=False):
+    if not compress:
+        for piece in pieces:
+            yield piece.encode()
+        return
+    # wbits=31 writes a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(current_app.config['EXPORT_GZIP_LEVEL'], zlib.DEFLATED, 31)
+    for piece in pieces:
+        data = compressor.compress(piece.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _options(data):
+    fmt = data.get('format') or 'csv'
+    if fmt not in FORMATS:
+        raise ValueError(f"'format' must be one of {', '.join(FORMATS)}")
+    compress = data.get('compress') or None
+    if compress not in (None, 'gzip'):
+        raise ValueError("'compress' must be gzip")
+    return fmt, compress == 'gzip'
+
+
+def _filename(resource, fmt, compress):
+    return f'{resource}{FORMATS[fmt][1]}' + ('.gz' if compress else '')
+
+
+# GET /exports/<resource>?format=csv|ndjson|columns&compress=gzip streams the
+# whole table (or ?fields= of it, from ?after_id= to resume) as a download.
+def export_stream(resource):
+    model = EXPORTS.get(resource)
+    if model is None:
+        return {'error': f"Unknown resource '{resource}'"}, 404
+    try:
+        after_id, limit, fields = page_args(serializer_for(model), request.args)
+        fmt, compress = _options(request.args)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    body = encode(generate(model, fields, fmt, after_id, limit), compress)
+    response = Response(stream_with_context(body), mimetype=GZIP_MIMETYPE if compress else FORMATS[fmt][0])
+    response.headers.set('Content-Disposition', 'attachment', filename=_filename(resource, fmt, compress))
+    return response
+
+
+def _path(export):
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], 'exports', str(export.id))
+
+
+def _state(export):
+    data = export.to_dict()
+    if export.status == 'done':
+        data['download_url'] = f'{request.url_root}exports/{export.id}/download'
+    return data
+
+
+# Run by `flask worker`. A failed attempt puts the export back to pending
+# until the job runs out of retries.
+@job_handler('export')
+def run_export(payload, job):
+    export = db.session.get(Export, payload['export_id'])
+    if export is None:
+        return {'rows': 0}
+    export.status = 'running'
+    db.session.commit()
+    model = EXPORTS[export.resource]
+    total = db.session.execute(select(func.count()).select_from(model.__table__)).scalar()
+    job.progress(0, total, force=True)
+    path = _path(export)
+    part = path + '.part'
+    stats = {'rows': 0}
+    fields, fmt, compress = tuple(export.fields.split(',')), export.format, export.compress
+    try:
+        # Rows stream over their own connection, so progress can commit on
+        # the session between chunks
+        with db.engine.connect() as connection, open(part, 'wb') as f:
+            pieces = generate(model, fields, fmt, stats=stats, bind=connection)
+            for data in encode(pieces, compress):
+                f.write(data)
+                job.progress(stats['rows'], total)
+        os.replace(part, path)
+    except Exception as e:
+        db.session.rollback()
+        if os.path.exists(part):
+            os.remove(part)
+        export = db.session.get(Export, payload['export_id'])
+        export.status, export.error = ('failed' if job.final_attempt else 'pending'), str(e)
+        if job.final_attempt:
+            export.finished_at = datetime.utcnow()
+        db.session.commit()
+        raise
+    export.status, export.rows, export.size = 'done', stats['rows'], os.path.getsize(path)
+    export.finished_at = datetime.utcnow()
+    db.session.commit()
+    return {'rows': export.rows, 'size': export.size}
+
+
+# POST /exports {"resource", "format", "fields", "compress"} queues a job that
+# writes the export to disk (see jobs.py) and returns its id at once; poll
+# GET /exports/<id> until status is 'done', then download.
+def create_export():
+    data = request.get_json(silent=True) or {}
+    model = EXPORTS.get(data.get('resource'))
+    if model is None:
+        return {'error': f"'resource' must be one of {', '.join(EXPORTS)}"}, 400
+    fields = data.get('fields')
+    if isinstance(fields, list):
+        fields = ','.join(str(name) for name in fields)
+    try:
+        fields = serializer_for(model).parse_fields(fields)
+        fmt, compress = _options(data)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    export = Export(user_id=current_user_id(), resource=data['resource'], format=fmt, fields=','.join(fields),
+                    compress=compress, status='pending', created_at=datetime.utcnow())
+    db.session.add(export)
+    db.session.flush()
+    job = enqueue('export', {'export_id': export.id}, user_id=export.user_id)
+    db.session.commit()
+    return {**_state(export), 'job_id': job.id}, 202, {'Location': f'{request.url_root}exports/{export.id}'}
+
+
+def export_status(export_id):
+    export = db.session.get(Export, export_id)
+    if export is None:
+        return {'error': 'Export not found'}, 404
+    return _state(export), 200, {'Cache-Control': 'no-store'}
+
+
+def download_export(export_id):
+    export = db.session.get(Export, export_id)
+    if export is None:
+        return {'error': 'Export not found'}, 404
+    if export.status != 'done':
+        return {'error': f'Export is {export.status}'}, 409
+    if not os.path.exists(_path(export)):
+        return {'error': 'Export file has expired'}, 410
+    name = _filename(export.resource, export.format, export.compress)
+    mime_type = GZIP_MIMETYPE if export.compress else FORMATS[export.format][0]
+    etag = f'export-{export.id}-{export.size}'
+    db.session.close()
+    return send_stored(os.path.join('exports', str(export_id)), name, mime_type, etag)
+
+
+def _remove_file(export):
+    for path in (_path(export), _path(export) + '.part'):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def delete_export(export_id):
+    export = db.session.get(Export, export_id)
+    if export is None:
+        return {'error': 'Export not found'}, 404
+    _remove_file(export)
+    db.session.delete(export)
+    db.session.commit()
+    return {'message': 'Export deleted'}, 200
+
+
+@click.command('prune-exports')
+@click.option('--hours', type=int, help='Remove exports created longer ago than this.')
+@with_appcontext
+def prune_exports_command(hours):
+    """Remove old export files and their records."""
+    hours = hours or current_app.config['EXPORT_TTL_HOURS']
+    cutoff = datetime.utcnow() - timedelta(hours=hours)
+    old = db.session.execute(select(Export).where(Export.created_at < cutoff)).scalars().all()
+    for export in old:
+        _remove_file(export)
+    if old:
+        db.session.execute(delete(Export).where(Export.id.in_([export.id for export in old])))
+        db.session.commit()
+    click.echo(f'Removed {len(old)} exports')
+
+
+def init_app(app):
+    app.config.setdefault('EXPORT_CHUNK_SIZE', 5000)
+    app.config.setdefault('EXPORT_GZIP_LEVEL', 6)
+    app.config.setdefault('EXPORT_TTL_HOURS', 24)
+    os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'exports'), exist_ok=True)
+    app.cli.add_command(prune_exports_command)
@@ -0,0 +1,126 @@
+from datetime import date, datetime, time
+
+from flask import request
+from sqlalchemy import and_, case, func, select
+
+from models import db, Grade, student_class
+
+PERCENTILES = (25, 50, 75, 90)
+BUCKET_WIDTH = 10
+BUCKET_COUNT = 10
+
+GROUPS = {
+    'student': Grade.student_id,
+    'subject': Grade.subject_id,
+    'class': student_class.c.class_id,
+}
+
+
+def _parse_datetime(name, end_of_day=False):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        if len(value) == 10:
+            day = date.fromisoformat(value)
+            return datetime.combine(day, time.max if end_of_day else time.min)
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"'{name}' must be an ISO 8601 date or datetime")
+
+
+def _parse_int(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"'{name}' must be an integer")
+
+
+# SQL conditions for ?student_id=&subject_id=&class_id=&from=&to=, shared by
+# the grade list and the summary so both filter in the database.
+def grade_filters():
+    filters = []
+    student_id = _parse_int('student_id')
+    subject_id = _parse_int('subject_id')
+    class_id = _parse_int('class_id')
+    recorded_from = _parse_datetime('from')
+    recorded_to = _parse_datetime('to', end_of_day=True)
+    if student_id is not None:
+        filters.append(Grade.student_id == student_id)
+    if subject_id is not None:
+        filters.append(Grade.subject_id == subject_id)
+    if class_id is not None:
+        filters.append(Grade.student_id.in_(
+            select(student_class.c.student_id).where(student_class.c.class_id == class_id)
+        ))
+    if recorded_from is not None:
+        filters.append(Grade.recorded_at >= recorded_from)
+    if recorded_to is not None:
+        filters.append(Grade.recorded_at <= recorded_to)
+    return filters
+
+
+def _bucket_label(i):
+    low = i * BUCKET_WIDTH
+    return f'{low}-{low + BUCKET_WIDTH}'
+
+
+# Mean, min, max, count, nearest-rank percentiles and a 10-point grade
+# distribution per group, all in one statement. Window functions rank the
+# grades inside each group; the outer GROUP BY picks the percentile rows.
+def summary_statement(group_by, filters):
+    key = GROUPS[group_by]
+    ranked = select(
+        key.label('key'),
+        Grade.grade.label('grade'),
+        func.row_number().over(partition_by=key, order_by=Grade.grade).label('rn'),
+        func.count().over(partition_by=key).label('n'),
+    ).where(Grade.grade.isnot(None), *filters)
+    if group_by == 'class':
+        ranked = ranked.join_from(Grade, student_class, student_class.c.student_id == Grade.student_id)
+    ranked = ranked.subquery()
+
+    columns = [
+        ranked.c.key,
+        func.count().label('count'),
+        func.avg(ranked.c.grade).label('mean'),
+        func.min(ranked.c.grade).label('min'),
+        func.max(ranked.c.grade).label('max'),
+    ]
+    for p in PERCENTILES:
+        # ceil(p/100 * n) in integer arithmetic, which every backend has
+        rank = (ranked.c.n * p + 99) // 100
+        columns.append(func.max(case((ranked.c.rn == rank, ranked.c.grade))).label(f'p{p}'))
+    for i in range(BUCKET_COUNT):
+        low = ranked.c.grade >= i * BUCKET_WIDTH
+        high = ranked.c.grade < (i + 1) * BUCKET_WIDTH
+        if i == BUCKET_COUNT - 1:
+            high = ranked.c.grade <= (i + 1) * BUCKET_WIDTH
+        columns.append(func.sum(case((and_(low, high), 1), else_=0)).label(f'bucket{i}'))
+    return select(*columns).group_by(ranked.c.key).order_by(ranked.c.key)
+
+
+def grade_summary():
+    group_by = request.args.get('group_by', 'student')
+    if group_by not in GROUPS:
+        return {'error': f"'group_by' must be one of {', '.join(GROUPS)}"}, 400
+    try:
+        filters = grade_filters()
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    results = []
+    for row in db.session.execute(summary_statement(group_by, filters)).mappings():
+        results.append({
+            f'{group_by}_id': row['key'],
+            'count': row['count'],
+            'mean': row['mean'],
+            'min': row['min'],
+            'max': row['max'],
+            'percentiles': {f'p{p}': row[f'p{p}'] for p in PERCENTILES},
+            'distribution': {_bucket_label(i): row[f'bucket{i}'] for i in range(BUCKET_COUNT)},
+        })
+    return results, 200
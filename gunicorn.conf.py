@@ -0,0 +1,39 @@
+import os
+
+from config import env_bool, env_int
+
+# gunicorn 'app:create_app()' -c gunicorn.conf.py
+#
+# gthread workers: each process serves GUNICORN_THREADS requests at once, so
+# handlers blocked on SQLite or bcrypt (which runs on its own pool, see
+# PASSWORD_HASH_WORKERS) don't hold a whole process. /messages/stream holds
+# a thread for up to MESSAGE_STREAM_TIMEOUT, so leave threads to spare for it.
+# Pushes reach streams on every worker through MESSAGE_BROKER=database (the
+# default); with MESSAGE_BROKER=local run a single worker.
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+workers = env_int('GUNICORN_WORKERS', (os.cpu_count() or 1) * 2 + 1)
+worker_class = 'gthread'
+threads = env_int('GUNICORN_THREADS', 8)
+timeout = env_int('GUNICORN_TIMEOUT', 60)
+graceful_timeout = env_int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+keepalive = env_int('GUNICORN_KEEPALIVE', 5)
+# Recycle workers now and then so slow leaks can't build up; the jitter keeps
+# them from all restarting at once
+max_requests = env_int('GUNICORN_MAX_REQUESTS', 10000)
+max_requests_jitter = env_int('GUNICORN_MAX_REQUESTS_JITTER', 1000)
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or None
+
+# Loading the app once in the master runs create_all() a single time instead
+# of once per worker racing on a fresh database, and shares the imported code
+# between workers.
+preload_app = env_bool('GUNICORN_PRELOAD', True)
+
+
+# Connections opened in the master (create_all) must not be shared with the
+# forked workers; drop them from the pool without closing the master's.
+def post_fork(server, worker):
+    from models import db
+
+    app = server.app.wsgi()
+    with app.app_context():
+        db.engine.dispose(close=False)
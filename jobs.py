@@ -0,0 +1,348 @@
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, request
+from flask.cli import with_appcontext
+from sqlalchemy import delete, or_, select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from auth import current_user_id
+from models import db, Job
+from pagination import paginate
+
+logger = logging.getLogger(__name__)
+
+JOBS = Job.__table__
+# kind -> handler(payload, job); registered by the modules that own the work
+HANDLERS = {}
+# Kinds admins may queue with POST /jobs. Imports and exports are queued by
+# their own endpoints, which store the file or record the job needs first.
+SUBMITTABLE = set()
+FINISHED = ('done', 'failed', 'cancelled')
+# Longest wait between retries when the database itself is failing
+MAX_ERROR_WAIT = 60
+
+
+# Raised by a handler for failures a retry can't fix (a malformed file, a
+# bad payload): the job fails at once instead of being retried.
+class JobFailed(Exception):
+    pass
+
+
+def job_handler(kind, submittable=False):
+    def decorator(fn):
+        HANDLERS[kind] = fn
+        if submittable:
+            SUBMITTABLE.add(kind)
+        return fn
+    return decorator
+
+
+# Added to the caller's session without committing, so a job is queued in
+# the same transaction as the rows it works on (or not at all).
+def enqueue(kind, payload=None, user_id=None, max_attempts=None, delay=0):
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind '{kind}'")
+    now = datetime.utcnow()
+    job = Job(kind=kind, payload=payload or {}, status='queued', attempts=0,
+              max_attempts=max_attempts or current_app.config['JOB_MAX_ATTEMPTS'],
+              run_at=now + timedelta(seconds=delay), user_id=user_id, created_at=now)
+    db.session.add(job)
+    return job
+
+
+def backoff(attempts):
+    config = current_app.config
+    return min(config['JOB_RETRY_BACKOFF_SECONDS'] * 2 ** (attempts - 1), config['JOB_RETRY_BACKOFF_MAX_SECONDS'])
+
+
+# What a handler sees of its job. Progress is written and committed through
+# the handler's own session, so call it between the handler's commits (as
+# the chunked handlers do) and never while its session holds writes: on
+# SQLite a second connection would only queue behind them. Writes are
+# throttled to one per JOB_PROGRESS_INTERVAL seconds and double as the job's
+# heartbeat.
+class JobContext:
+    def __init__(self, job):
+        self.id = job.id
+        self.attempt = job.attempts
+        self.max_attempts = job.max_attempts
+        self._written = 0.0
+
+    @property
+    def final_attempt(self):
+        return self.attempt >= self.max_attempts
+
+    def progress(self, done, total=None, force=False):
+        now = time.monotonic()
+        if not force and now - self._written < current_app.config['JOB_PROGRESS_INTERVAL']:
+            return
+        self._written = now
+        values = {'progress': done, 'heartbeat_at': datetime.utcnow()}
+        if total is not None:
+            values['total'] = total
+        db.session.execute(update(JOBS).where(JOBS.c.id == self.id).values(**values))
+        db.session.commit()
+
+
+# One statement takes the oldest due job, so two workers can never both get
+# it: SQLite holds the write lock for the whole UPDATE, and on PostgreSQL
+# SKIP LOCKED lets concurrent workers pass over each other's rows.
+def claim(worker):
+    now = datetime.utcnow()
+    due = (
+        select(JOBS.c.id)
+        .where(JOBS.c.status == 'queued', JOBS.c.run_at <= now)
+        .order_by(JOBS.c.run_at, JOBS.c.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    job_id = db.session.execute(
+        update(JOBS)
+        .where(JOBS.c.id == due, JOBS.c.status == 'queued')
+        .values(status='running', worker=worker, attempts=JOBS.c.attempts + 1, started_at=now, heartbeat_at=now)
+        .returning(JOBS.c.id)
+    ).scalar()
+    db.session.commit()
+    return db.session.get(Job, job_id) if job_id is not None else None
+
+
+def _worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+# A worker on this machine can be asked directly whether it is still
+# running; for one elsewhere only its heartbeats tell.
+def _alive(worker):
+    host, _, pid = (worker or '').rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# Jobs whose worker stopped sending heartbeats (killed, or its machine went
+# away) go back on the queue, counting the lost run as an attempt. A live
+# local worker keeps its job however old the heartbeat: a long transaction
+# can hold up heartbeats on SQLite. `worker` is between jobs when it calls
+# this, so any job still marked as its own was cut off by an error.
+def requeue_stale(worker=None):
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config['JOB_STALE_SECONDS'])
+    running = db.session.execute(
+        select(Job).where(Job.status == 'running', or_(Job.heartbeat_at < cutoff, Job.worker == worker))
+    ).scalars().all()
+    stale = [job for job in running if job.worker == worker or not _alive(job.worker)]
+    for job in stale:
+        _finish_attempt(job, 'Worker stopped responding', retry=True)
+    if stale:
+        db.session.commit()
+    return len(stale)
+
+
+def _finish_attempt(job, error, retry):
+    now = datetime.utcnow()
+    job.error = error
+    if retry and job.attempts < job.max_attempts:
+        job.status = 'queued'
+        job.run_at = now + timedelta(seconds=backoff(job.attempts))
+    else:
+        job.status = 'failed'
+        job.finished_at = now
+
+
+# Keeps heartbeat_at fresh for handlers that report no progress. On SQLite
+# it waits behind the handler's own write transaction, which is why local
+# workers are also checked with _alive().
+def _heartbeat(app, job_id, stop):
+    interval = app.config['JOB_STALE_SECONDS'] / 4
+    with app.app_context():
+        while not stop.wait(interval):
+            try:
+                with db.engine.begin() as connection:
+                    connection.execute(
+                        update(JOBS).where(JOBS.c.id == job_id).values(heartbeat_at=datetime.utcnow())
+                    )
+            except Exception:
+                logger.warning('Heartbeat for job %s failed', job_id, exc_info=True)
+
+
+def run(job):
+    job_id = job.id
+    context = JobContext(job)
+    handler = HANDLERS.get(job.kind)
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(current_app._get_current_object(), job_id, stop),
+                                 daemon=True)
+    heartbeat.start()
+    try:
+        if handler is None:
+            raise JobFailed(f"No handler for job kind '{job.kind}'")
+        result = handler(job.payload or {}, context)
+    except Exception as e:
+        logger.exception('Job %s (%s) failed on attempt %s', job_id, job.kind, context.attempt)
+        db.session.rollback()
+        job = db.session.get(Job, job_id)
+        _finish_attempt(job, str(e) or type(e).__name__, retry=not isinstance(e, JobFailed))
+    else:
+        job = db.session.get(Job, job_id)
+        job.status, job.result, job.error = 'done', result, None
+        job.finished_at = datetime.utcnow()
+        if job.total is not None:
+            job.progress = job.total
+    finally:
+        stop.set()
+        heartbeat.join()
+    db.session.commit()
+    return job
+
+
+# Database errors (SQLite's "database is locked" while another process
+# holds a long write) are logged and retried with a growing wait instead of
+# stopping the worker; a job they interrupted is requeued on the next pass.
+def work(worker=None, once=False, poll=None, stop=None):
+    worker = worker or _worker_name()
+    poll = poll or current_app.config['JOB_POLL_SECONDS']
+    stop = stop or threading.Event()
+    ran = failures = 0
+    while not stop.is_set():
+        try:
+            requeue_stale(worker)
+            job = claim(worker)
+            if job is not None:
+                run(job)
+                ran += 1
+        except SQLAlchemyError:
+            failures += 1
+            wait = min(poll * 2 ** (failures - 1), MAX_ERROR_WAIT)
+            logger.exception('Worker %s hit a database error, retrying in %ss', worker, wait)
+            db.session.rollback()
+            db.session.remove()
+            stop.wait(wait)
+            continue
+        failures = 0
+        db.session.remove()
+        if job is None:
+            if once:
+                break
+            stop.wait(poll)
+    return ran
+
+
+# Job status for GET /jobs/<id>; progress is in `progress` of `total` units
+# (rows, loans) when the handler knows the total.
+def job_status(job_id):
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return {'error': 'Job not found'}, 404
+    return job.to_dict(), 200, {'Cache-Control': 'no-store'}
+
+
+def list_jobs():
+    filters = []
+    for name in ('status', 'kind'):
+        if request.args.get(name):
+            filters.append(getattr(Job, name) == request.args[name])
+    return paginate(Job, filters=filters)
+
+
+# POST /jobs {"kind": "process_overdue", "payload": {"as_of": "2026-10-01"}}
+def submit_job():
+    data = request.get_json(silent=True) or {}
+    kind = data.get('kind')
+    if kind not in SUBMITTABLE:
+        return {'error': f"'kind' must be one of {', '.join(sorted(SUBMITTABLE))}"}, 400
+    payload = data.get('payload') or {}
+    if not isinstance(payload, dict):
+        return {'error': "'payload' must be an object"}, 400
+    job = enqueue(kind, payload, user_id=current_user_id())
+    db.session.commit()
+    return accepted(job)
+
+
+def accepted(job):
+    return job.to_dict(), 202, {'Location': f'{request.url_root}jobs/{job.id}'}
+
+
+def cancel_job(job_id):
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return {'error': 'Job not found'}, 404
+    cancelled = db.session.execute(
+        update(JOBS).where(JOBS.c.id == job_id, JOBS.c.status == 'queued')
+        .values(status='cancelled', finished_at=datetime.utcnow())
+    ).rowcount
+    db.session.commit()
+    if not cancelled:
+        return {'error': f'Job is {db.session.get(Job, job_id).status}'}, 409
+    return {'message': 'Job cancelled'}, 200
+
+
+@click.command('worker')
+@click.option('--once', is_flag=True, help='Run every job that is due, then exit.')
+@click.option('--poll', type=float, help='Seconds to wait when the queue is empty.')
+@with_appcontext
+def worker_command(once, poll):
+    """Run queued background jobs until stopped (SIGTERM lets the current job finish)."""
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stop.set())
+    click.echo(f"Worker started for {', '.join(sorted(HANDLERS))}")
+    ran = work(once=once, poll=poll, stop=stop)
+    click.echo(f'Worker stopped after {ran} jobs')
+
+
+# The upload an import job was queued with, if it is one of ours: payloads
+# of admin-submitted jobs are client input and never name files to remove.
+def _spool_path(job):
+    path = (job.payload or {}).get('path')
+    if job.kind != 'import_roster' or not isinstance(path, str):
+        return None
+    folder = os.path.realpath(os.path.join(current_app.config['UPLOAD_FOLDER'], 'jobs'))
+    path = os.path.realpath(path)
+    return path if os.path.dirname(path) == folder else None
+
+
+@click.command('prune-jobs')
+@click.option('--days', type=int, help='Remove finished jobs older than this.')
+@with_appcontext
+def prune_jobs_command(days):
+    """Remove finished jobs, and files left by failed imports."""
+    if days is None:
+        days = current_app.config['JOB_TTL_DAYS']
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    old = db.session.execute(
+        select(Job).where(Job.status.in_(FINISHED), Job.finished_at < cutoff)
+    ).scalars().all()
+    for job in old:
+        path = _spool_path(job)
+        if path and os.path.exists(path):
+            os.remove(path)
+    if old:
+        db.session.execute(delete(Job).where(Job.id.in_([job.id for job in old])))
+        db.session.commit()
+    click.echo(f'Removed {len(old)} jobs')
+
+
+def init_app(app):
+    app.config.setdefault('JOB_MAX_ATTEMPTS', 3)
+    app.config.setdefault('JOB_RETRY_BACKOFF_SECONDS', 30)
+    app.config.setdefault('JOB_RETRY_BACKOFF_MAX_SECONDS', 3600)
+    app.config.setdefault('JOB_POLL_SECONDS', 2.0)
+    app.config.setdefault('JOB_STALE_SECONDS', 600)
+    app.config.setdefault('JOB_PROGRESS_INTERVAL', 1.0)
+    app.config.setdefault('JOB_TTL_DAYS', 7)
+    os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'jobs'), exist_ok=True)
+    app.cli.add_command(worker_command)
+    app.cli.add_command(prune_jobs_command)
@@ -0,0 +1,328 @@
+import time
+from datetime import date, datetime, timedelta
+from urllib.parse import urlencode
+
+import click
+from flask import current_app, request
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, func, insert, literal, select, tuple_, update
+
+from auth import current_claims, current_user_id
+from bulk import validator_for
+from jobs import JobFailed, job_handler
+from messages import deliver
+from models import db, Book, CheckoutRecord, Message, MessageRecipient
+
+# Matches the partial indexes on checkout_records, so open-loan lookups only
+# ever touch books that are currently out.
+OPEN = CheckoutRecord.returned_date.is_(None)
+# Roles that may check a book out in someone else's name
+STAFF_ROLES = ('admin', 'teacher')
+
+
+def fine_for(due_date, day):
+    days = (day - due_date).days if due_date else 0
+    if days <= 0:
+        return 0.0
+    fine = days * current_app.config['LIBRARY_FINE_PER_DAY']
+    cap = current_app.config['LIBRARY_FINE_CAP']
+    return round(min(fine, cap) if cap else fine, 2)
+
+
+def _open_loans(book_ids):
+    stmt = (
+        select(CheckoutRecord.book_id, func.count())
+        .where(OPEN, CheckoutRecord.book_id.in_(book_ids))
+        .group_by(CheckoutRecord.book_id)
+    )
+    return dict(db.session.execute(stmt).all())
+
+
+def availability(book_id):
+    book = db.session.execute(select(Book.copies).where(Book.id == book_id)).first()
+    if book is None:
+        return {'error': 'Book not found'}, 404
+    on_loan, next_due = db.session.execute(
+        select(func.count(), func.min(CheckoutRecord.due_date)).where(OPEN, CheckoutRecord.book_id == book_id)
+    ).one()
+    return {
+        'book_id': book_id,
+        'copies': book.copies,
+        'on_loan': on_loan,
+        'available': max(book.copies - on_loan, 0),
+        'next_due_date': next_due.isoformat() if next_due else None,
+    }, 200
+
+
+# The loan is only inserted if a copy is still free when the INSERT runs:
+# the availability check and the write are one statement, so two requests
+# for the last copy can't both succeed. Server databases also lock the book
+# row first; SQLite's single writer already serializes the statement. The
+# borrower is the caller unless staff name another user_id.
+def checkout():
+    try:
+        row = validator_for(CheckoutRecord).clean(request.get_json(silent=True) or {})
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    book_id = row.get('book_id')
+    if book_id is None:
+        return {'error': "'book_id' is required"}, 400
+    user_id = current_user_id()
+    if row.get('user_id') not in (None, user_id):
+        if current_claims().get('role') not in STAFF_ROLES:
+            return {'error': 'Only staff can check out books for another user'}, 403
+        user_id = row['user_id']
+    checkout_date = row.get('checkout_date') or date.today()
+    due_date = row.get('due_date') or checkout_date + timedelta(days=current_app.config['LIBRARY_LOAN_DAYS'])
+
+    book = db.session.execute(select(Book.copies).where(Book.id == book_id).with_for_update()).first()
+    if book is None:
+        db.session.rollback()
+        return {'error': 'Book not found'}, 404
+    on_loan = select(func.count()).where(OPEN, CheckoutRecord.book_id == book_id).scalar_subquery()
+    values = select(literal(book_id), literal(user_id), literal(checkout_date), literal(due_date)).where(
+        on_loan < book.copies
+    )
+    stmt = insert(CheckoutRecord.__table__).from_select(
+        ['book_id', 'user_id', 'checkout_date', 'due_date'], values,
+    ).returning(CheckoutRecord.__table__.c.id)
+    created = db.session.execute(stmt).first()
+    db.session.commit()
+    if created is None:
+        return {'error': 'No copies available', 'book_id': book_id}, 409
+    return db.session.get(CheckoutRecord, created.id).to_dict(), 201
+
+
+def return_book(checkout_record_id):
+    record = db.session.get(CheckoutRecord, checkout_record_id)
+    if record is None:
+        return {'error': 'Checkout record not found'}, 404
+    if record.returned_date is not None:
+        return {'error': 'Book already returned'}, 409
+    record.returned_date = date.today()
+    record.fine_amount = fine_for(record.due_date, record.returned_date)
+    db.session.commit()
+    return record.to_dict(), 200
+
+
+# Bulk-create check for POST /checkout-records/bulk: the checkout() borrower
+# rule per row (rows without a user_id are lent to the caller), then
+# availability.
+def check_bulk_checkout(batch):
+    user_id = current_user_id()
+    staff = current_claims().get('role') in STAFF_ROLES
+    errors = {}
+    for i, row in batch:
+        if row.get('user_id') is None:
+            row['user_id'] = user_id
+        elif row['user_id'] != user_id and not staff:
+            errors[i] = 'only staff can check out books for another user'
+    errors.update(check_availability([(i, row) for i, row in batch if i not in errors]))
+    return errors
+
+
+# Bulk-update check: fines are derived from the due date by process_overdue
+# and return_book, never set by hand.
+def check_loan_update(batch):
+    return {i: "'fine_amount' is set by the library, not updated directly" for i, row in batch
+            if 'fine_amount' in row}
+
+
+# Bulk-create check: rejects loans for books with no copy left, counting
+# earlier rows of the same chunk. Records that arrive already returned
+# (history imports) are not checked.
+def check_availability(batch):
+    loans = [(i, row) for i, row in batch if row.get('book_id') is not None and row.get('returned_date') is None]
+    if not loans:
+        return {}
+    book_ids = {row['book_id'] for _, row in loans}
+    copies = dict(db.session.execute(select(Book.id, Book.copies).where(Book.id.in_(book_ids))).all())
+    on_loan = _open_loans(book_ids)
+    errors = {}
+    for i, row in loans:
+        book_id = row['book_id']
+        if book_id not in copies:
+            continue
+        if on_loan.get(book_id, 0) >= copies[book_id]:
+            errors[i] = f'no copies of book {book_id} available'
+        else:
+            on_loan[book_id] = on_loan.get(book_id, 0) + 1
+    return errors
+
+
+def _overdue_row(row, as_of):
+    return {
+        'id': row.id, 'book_id': row.book_id, 'user_id': row.user_id,
+        'checkout_date': row.checkout_date.isoformat() if row.checkout_date else None,
+        'due_date': row.due_date.isoformat(), 'days_overdue': (as_of - row.due_date).days,
+        'fine_amount': row.fine_amount,
+        'reminded_at': row.reminded_at.isoformat() if row.reminded_at else None,
+    }
+
+
+def _next_url(last):
+    args = request.args.copy()
+    args['after_due_date'] = last['due_date']
+    args['after_id'] = last['id']
+    return f"{request.base_url}?{urlencode(list(args.items(multi=True)))}"
+
+
+# /overdue?library_id=&user_id=&as_of=, oldest due date first, paged by
+# (due_date, id) keyset straight off the open-loans due_date index.
+def overdue():
+    try:
+        as_of = date.fromisoformat(request.args['as_of']) if request.args.get('as_of') else date.today()
+        after_due_date = request.args.get('after_due_date')
+        after_due_date = date.fromisoformat(after_due_date) if after_due_date else None
+        after_id = request.args.get('after_id', type=int)
+        library_id = request.args.get('library_id', type=int)
+        user_id = request.args.get('user_id', type=int)
+        limit = min(int(request.args.get('limit', current_app.config['PAGE_SIZE_DEFAULT'])),
+                    current_app.config['PAGE_SIZE_MAX'])
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    stmt = select(
+        CheckoutRecord.id, CheckoutRecord.book_id, CheckoutRecord.user_id, CheckoutRecord.checkout_date,
+        CheckoutRecord.due_date, CheckoutRecord.fine_amount, CheckoutRecord.reminded_at,
+    ).where(OPEN, CheckoutRecord.due_date < as_of)
+    if library_id is not None:
+        stmt = stmt.where(CheckoutRecord.book_id.in_(select(Book.id).where(Book.library_id == library_id)))
+    if user_id is not None:
+        stmt = stmt.where(CheckoutRecord.user_id == user_id)
+    if after_due_date is not None:
+        stmt = stmt.where(tuple_(CheckoutRecord.due_date, CheckoutRecord.id) > (after_due_date, after_id or 0))
+    stmt = stmt.order_by(CheckoutRecord.due_date, CheckoutRecord.id).limit(limit + 1)
+
+    rows = [_overdue_row(row, as_of) for row in db.session.execute(stmt)]
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers['Link'] = f'<{_next_url(rows[-1])}>; rel="next"'
+    return rows, 200, headers
+
+
+# Writes the reminders in the caller's transaction and returns them as
+# (message_id, content, recipient_id) for delivery once it commits.
+def _send_reminders(rows, now):
+    sender_id = current_app.config['LIBRARY_REMINDER_SENDER_ID']
+    if not sender_id:
+        return []
+    messages = Message.__table__
+    contents = [f"Reminder: '{row.title or f'book {row.book_id}'}' was due on {row.due_date.isoformat()}"
+                for row in rows]
+    created = db.session.execute(
+        insert(messages).returning(messages.c.id, sort_by_parameter_order=True),
+        [{'sender_id': sender_id, 'sent_at': now, 'content': content} for content in contents],
+    ).scalars().all()
+    db.session.execute(insert(MessageRecipient.__table__), [
+        {'message_id': message_id, 'recipient_id': row.user_id, 'sent_at': now}
+        for message_id, row in zip(created, rows)
+    ])
+    return [(message_id, content, row.user_id) for message_id, content, row in zip(created, contents, rows)]
+
+
+def _deliver_reminders(reminders, now):
+    sender_id = current_app.config['LIBRARY_REMINDER_SENDER_ID']
+    for message_id, content, recipient_id in reminders:
+        deliver(message_id, sender_id, None, content, now, [recipient_id])
+
+
+# Recomputes fines and sends reminders for every overdue loan. Loans are read
+# chunk_size at a time in (due_date, id) order and each chunk is written and
+# committed on its own, so the write lock is only ever held for one chunk and
+# checkouts carry on while the job runs. Safe to re-run: fines are derived
+# from the date, and reminders respect LIBRARY_REMINDER_INTERVAL_DAYS.
+def process_overdue(as_of=None, chunk_size=None, on_chunk=None):
+    as_of = as_of or date.today()
+    chunk_size = chunk_size or current_app.config['OVERDUE_CHUNK_SIZE']
+    now = datetime.utcnow()
+    remind_before = now - timedelta(days=current_app.config['LIBRARY_REMINDER_INTERVAL_DAYS'])
+    sender_id = current_app.config['LIBRARY_REMINDER_SENDER_ID']
+    table = CheckoutRecord.__table__
+    set_fine = update(table).where(table.c.id == bindparam('record_id')).values(fine_amount=bindparam('fine'))
+    stats = {'processed': 0, 'fined': 0, 'reminded': 0, 'chunks': 0}
+
+    after = None
+    while True:
+        stmt = (
+            select(CheckoutRecord.id, CheckoutRecord.book_id, CheckoutRecord.user_id, CheckoutRecord.due_date,
+                   CheckoutRecord.fine_amount, CheckoutRecord.reminded_at, Book.title)
+            .join_from(CheckoutRecord, Book, Book.id == CheckoutRecord.book_id, isouter=True)
+            .where(OPEN, CheckoutRecord.due_date < as_of)
+            .order_by(CheckoutRecord.due_date, CheckoutRecord.id)
+            .limit(chunk_size)
+        )
+        if after is not None:
+            stmt = stmt.where(tuple_(CheckoutRecord.due_date, CheckoutRecord.id) > after)
+        rows = db.session.execute(stmt).all()
+        if not rows:
+            break
+        after = (rows[-1].due_date, rows[-1].id)
+
+        fines = []
+        for row in rows:
+            fine = fine_for(row.due_date, as_of)
+            if fine != row.fine_amount:
+                fines.append({'record_id': row.id, 'fine': fine})
+        # Without a sender no reminder is written, so loans aren't marked as
+        # reminded either and get one once LIBRARY_REMINDER_SENDER_ID is set
+        remind = [row for row in rows if sender_id and row.user_id is not None
+                  and (row.reminded_at is None or row.reminded_at <= remind_before)]
+        if fines:
+            db.session.execute(set_fine, fines)
+        reminders = []
+        if remind:
+            db.session.execute(
+                update(table).where(table.c.id.in_([row.id for row in remind])).values(reminded_at=now)
+            )
+            reminders = _send_reminders(remind, now)
+        db.session.commit()
+        _deliver_reminders(reminders, now)
+
+        stats['processed'] += len(rows)
+        stats['fined'] += len(fines)
+        stats['reminded'] += len(remind)
+        stats['chunks'] += 1
+        if on_chunk is not None:
+            on_chunk(stats)
+    return stats
+
+
+@click.command('process-overdue')
+@click.option('--date', 'as_of', type=click.DateTime(formats=['%Y-%m-%d']), help='Assess as of this day.')
+@click.option('--chunk-size', type=int, help='Loans per transaction.')
+@with_appcontext
+def process_overdue_command(as_of, chunk_size):
+    """Assess fines and send reminders for overdue loans, one chunk per transaction."""
+    started = time.perf_counter()
+    stats = process_overdue(as_of.date() if as_of else None, chunk_size)
+    elapsed = time.perf_counter() - started
+    click.echo(f"Processed {stats['processed']} overdue loans in {stats['chunks']} chunks ({elapsed:.1f}s): "
+               f"{stats['fined']} fines updated, {stats['reminded']} reminders")
+
+
+# POST /jobs {"kind": "process_overdue", "payload": {"as_of": "2026-10-01"}}
+# runs the same pass from a worker, reporting loans processed of the total.
+@job_handler('process_overdue', submittable=True)
+def process_overdue_job(payload, job):
+    try:
+        as_of = date.fromisoformat(payload['as_of']) if payload.get('as_of') else date.today()
+        chunk_size = int(payload['chunk_size']) if payload.get('chunk_size') else None
+    except (TypeError, ValueError) as e:
+        raise JobFailed(f'Invalid payload: {e}')
+    total = db.session.execute(
+        select(func.count(CheckoutRecord.id)).where(OPEN, CheckoutRecord.due_date < as_of)
+    ).scalar()
+    job.progress(0, total, force=True)
+    return process_overdue(as_of, chunk_size, on_chunk=lambda stats: job.progress(stats['processed'], total))
+
+
+def init_app(app):
+    app.config.setdefault('LIBRARY_LOAN_DAYS', 14)
+    app.config.setdefault('LIBRARY_FINE_PER_DAY', 0.1)
+    app.config.setdefault('LIBRARY_FINE_CAP', 10.0)
+    app.config.setdefault('LIBRARY_REMINDER_INTERVAL_DAYS', 3)
+    app.config.setdefault('LIBRARY_REMINDER_SENDER_ID', None)
+    app.config.setdefault('OVERDUE_CHUNK_SIZE', 1000)
+    app.cli.add_command(process_overdue_command)
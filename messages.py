@@ -0,0 +1,497 @@
+import json
+import logging
+import os
+import queue
+import time
+from datetime import datetime
+from threading import Event, Lock, Thread
+from urllib.parse import urlencode
+
+from flask import Response, current_app, request
+from sqlalchemy import and_, func, insert, literal, or_, select, tuple_, update
+
+from auth import current_user_id
+from cache import LocalCache
+from models import db, Message, MessageRecipient, TableWatermark, User
+from representations import native_datetimes
+
+logger = logging.getLogger(__name__)
+
+INBOX_PAGE_SIZE = 50
+REPLAY_LIMIT = 500
+WATERMARKS = TableWatermark.__table__
+
+
+# Hands new-message events to the connections waiting for them. LocalBroker
+# only reaches subscribers in its own process; DatabaseBroker (the default)
+# reaches every worker through the database. Something like Redis pub/sub
+# can be plugged in by implementing the same three methods.
+class Broker:
+    def subscribe(self, user_id):
+        raise NotImplementedError
+
+    def unsubscribe(self, user_id, subscription):
+        raise NotImplementedError
+
+    def publish(self, user_ids, event):
+        raise NotImplementedError
+
+
+class LocalBroker(Broker):
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._subscribers = {}
+        self._lock = Lock()
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, user_id):
+        subscription = queue.Queue(self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, user_id, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[user_id]
+
+    # A subscriber that has fallen queue_size events behind misses the rest;
+    # it picks them up from the database when it reconnects with Last-Event-ID.
+    def publish(self, user_ids, event):
+        with self._lock:
+            targets = [s for user_id in user_ids for s in self._subscribers.get(user_id, ())]
+            self.published += 1
+        for subscription in targets:
+            try:
+                subscription.put_nowait(event)
+            except queue.Full:
+                self.dropped += 1
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+# Cross-process delivery without extra infrastructure. Each worker runs one
+# thread that checks the message_recipients watermark (a primary key
+# lookup) every MESSAGE_BROKER_POLL_SECONDS. When another worker has
+# written, the thread reads the recipient rows past the last id it saw and
+# hands them to its local subscribers. publish() only wakes the thread, so
+# every event takes the same path and is delivered once. Listeners (the
+# unread-count cache) are told about every write, reads included.
+#
+# Rows are read in id order. On databases where a transaction can commit
+# after a later id is seen (PostgreSQL sequences), such a row can be
+# missed by live streams; clients catch up from Last-Event-ID or after_id.
+class DatabaseBroker(LocalBroker):
+    def __init__(self, app, interval=1.0, queue_size=100):
+        super().__init__(queue_size)
+        self.app = app
+        self.interval = interval
+        self.listeners = []
+        self._wake = Event()
+        self._stopped = Event()
+        self._start_lock = Lock()
+        self._pid = None
+        self._version = None
+        self._last_id = None
+
+    # Threads don't survive a fork, so each worker process starts its own
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            with self.app.app_context():
+                self._version = self._current_version()
+                self._last_id = db.session.execute(select(func.max(MessageRecipient.id))).scalar() or 0
+                db.session.remove()
+            Thread(target=self._run, daemon=True, name='message-broker').start()
+            self._pid = os.getpid()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def subscribe(self, user_id):
+        self.start()
+        return super().subscribe(user_id)
+
+    def publish(self, user_ids, event):
+        self.start()
+        self._wake.set()
+
+    def _current_version(self):
+        return db.session.execute(
+            select(WATERMARKS.c.version).where(WATERMARKS.c.table_name == MessageRecipient.__tablename__)
+        ).scalar()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopped.is_set():
+                return
+            try:
+                with self.app.app_context():
+                    try:
+                        self.poll()
+                    finally:
+                        db.session.remove()
+            except Exception:
+                logger.exception('Message broker poll failed')
+
+    def poll(self):
+        version = self._current_version()
+        if version == self._version:
+            return
+        while True:
+            rows = db.session.execute(
+                select(MessageRecipient.id, MessageRecipient.recipient_id, *COLUMNS)
+                .join_from(MessageRecipient, Message, Message.id == MessageRecipient.message_id)
+                .where(MessageRecipient.id > self._last_id)
+                .order_by(MessageRecipient.id)
+                .limit(REPLAY_LIMIT)
+            ).all()
+            for row in rows:
+                LocalBroker.publish(self, [row[1]], _message(tuple(row[2:]) + (None,)))
+            if rows:
+                self._last_id = rows[-1][0]
+            if len(rows) < REPLAY_LIMIT:
+                break
+        self._version = version
+        for listener in self.listeners:
+            listener()
+
+
+# Unread counts are cached per user and dropped whenever a message arrives
+# for them or they read one. With DatabaseBroker every worker also drops its
+# whole cache when it sees any write to message_recipients; otherwise other
+# workers only see the change once their entry expires, so the TTL bounds
+# how stale a badge can get.
+class UnreadCounts:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, user_id):
+        key = f'unread:{user_id}'
+        count = self.backend.get(key)
+        if count is None:
+            count = db.session.execute(
+                select(func.count()).select_from(MessageRecipient)
+                .where(MessageRecipient.recipient_id == user_id, MessageRecipient.read_at.is_(None))
+            ).scalar()
+            self.backend.set(key, count)
+        return count
+
+    def invalidate(self, user_ids):
+        for user_id in user_ids:
+            self.backend.delete(f'unread:{user_id}')
+
+    def clear(self):
+        self.backend.clear()
+
+
+def init_app(app, broker=None):
+    app.config.setdefault('MESSAGE_STREAM_TIMEOUT', 55)
+    app.config.setdefault('MESSAGE_KEEPALIVE_SECONDS', 15)
+    app.config.setdefault('MESSAGE_UNREAD_CACHE_SIZE', 10000)
+    app.config.setdefault('MESSAGE_UNREAD_CACHE_TTL', 60)
+    app.config.setdefault('MESSAGE_BROKER', 'database')
+    app.config.setdefault('MESSAGE_BROKER_POLL_SECONDS', 1.0)
+    counts = UnreadCounts(
+        LocalCache(app.config['MESSAGE_UNREAD_CACHE_SIZE'], app.config['MESSAGE_UNREAD_CACHE_TTL'])
+    )
+    if broker is None:
+        if app.config['MESSAGE_BROKER'] == 'database':
+            broker = DatabaseBroker(app, app.config['MESSAGE_BROKER_POLL_SECONDS'])
+        else:
+            broker = LocalBroker()
+    if isinstance(broker, DatabaseBroker):
+        broker.listeners.append(counts.clear)
+    app.extensions['message_broker'] = broker
+    app.extensions['unread_counts'] = counts
+
+
+def _isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+COLUMNS = (Message.id, Message.sender_id, Message.thread_id, Message.content, Message.sent_at)
+
+
+# convert=False leaves the datetimes for app.json to write.
+def _message(row, convert=True):
+    message_id, sender_id, thread_id, content, sent_at, read_at = row
+    if convert:
+        sent_at, read_at = _isoformat(sent_at), _isoformat(read_at)
+    return {'id': message_id, 'sender_id': sender_id, 'thread_id': thread_id, 'content': content,
+            'sent_at': sent_at, 'read_at': read_at}
+
+
+def _parse_int(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"'{name}' must be an integer")
+
+
+def _next_url(last):
+    args = request.args.copy()
+    args['before_sent_at'] = _isoformat(last.sent_at)
+    args['before_id'] = last.id
+    return f"{request.base_url}?{urlencode(list(args.items(multi=True)))}"
+
+
+# The caller's own messages only, newest first: ?box=sent for what they sent,
+# ?unread=true, ?thread_id= for one conversation. Pages follow the
+# (recipient_id, sent_at) index and continue from ?before_sent_at=&before_id=.
+def inbox():
+    user_id = current_user_id()
+    try:
+        thread_id = _parse_int('thread_id')
+        before_id = _parse_int('before_id')
+        limit = min(_parse_int('limit') or INBOX_PAGE_SIZE, current_app.config['PAGE_SIZE_MAX'])
+        before_sent_at = request.args.get('before_sent_at')
+        before_sent_at = datetime.fromisoformat(before_sent_at) if before_sent_at else None
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    if thread_id is not None:
+        # Both sides of the conversation, via the thread_id index
+        sent_at, message_id = Message.sent_at, Message.id
+        received = and_(MessageRecipient.message_id == Message.id, MessageRecipient.recipient_id == user_id)
+        stmt = (
+            select(*COLUMNS, MessageRecipient.read_at)
+            .outerjoin_from(Message, MessageRecipient, received)
+            .where(or_(Message.thread_id == thread_id, Message.id == thread_id))
+            .where(or_(Message.sender_id == user_id, MessageRecipient.id.isnot(None)))
+        )
+    elif request.args.get('box') == 'sent':
+        sent_at, message_id = Message.sent_at, Message.id
+        stmt = select(*COLUMNS, literal(None)).where(Message.sender_id == user_id)
+    else:
+        sent_at, message_id = MessageRecipient.sent_at, MessageRecipient.message_id
+        stmt = (
+            select(*COLUMNS, MessageRecipient.read_at)
+            .join_from(MessageRecipient, Message, Message.id == MessageRecipient.message_id)
+            .where(MessageRecipient.recipient_id == user_id)
+        )
+        if request.args.get('unread', '').lower() in ('1', 'true', 'yes'):
+            stmt = stmt.where(MessageRecipient.read_at.is_(None))
+    if before_sent_at is not None and before_id is not None:
+        stmt = stmt.where(tuple_(sent_at, message_id) < (before_sent_at, before_id))
+    stmt = stmt.order_by(sent_at.desc(), message_id.desc()).limit(limit + 1)
+
+    rows = db.session.execute(stmt).all()
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers['Link'] = f'<{_next_url(rows[-1])}>; rel="next"'
+    convert = not native_datetimes()
+    messages = [_message(row, convert) for row in rows]
+    unread = current_app.extensions['unread_counts'].get(user_id)
+    return {'unread': unread, 'messages': messages}, 200, headers
+
+
+def unread_count():
+    return {'unread': current_app.extensions['unread_counts'].get(current_user_id())}, 200
+
+
+def _thread_root(user_id, thread_id):
+    parent = db.session.get(Message, thread_id)
+    if parent is None:
+        return None
+    if parent.sender_id != user_id and not db.session.execute(
+        select(MessageRecipient.id).where(
+            MessageRecipient.message_id == parent.id, MessageRecipient.recipient_id == user_id,
+        )
+    ).first():
+        return None
+    return parent.thread_id or parent.id
+
+
+# Body: {"recipient_ids": [...], "content": "...", "thread_id": optional id of
+# any message in the conversation being replied to}. The sender is always the
+# caller.
+def send_message():
+    user_id = current_user_id()
+    data = request.get_json(silent=True) or {}
+    recipient_ids = data.get('recipient_ids')
+    content = data.get('content')
+    if not isinstance(recipient_ids, list) or not recipient_ids or \
+            not all(isinstance(r, int) and not isinstance(r, bool) for r in recipient_ids):
+        return {'error': "'recipient_ids' must be a non-empty list of user ids"}, 400
+    if not isinstance(content, str) or not content.strip():
+        return {'error': "'content' is required"}, 400
+    recipient_ids = sorted(set(recipient_ids))
+    found = set(db.session.execute(select(User.id).where(User.id.in_(recipient_ids))).scalars())
+    missing = [r for r in recipient_ids if r not in found]
+    if missing:
+        return {'error': f"Unknown recipient(s): {', '.join(map(str, missing))}"}, 400
+
+    thread_id = None
+    if data.get('thread_id') is not None:
+        thread_id = _thread_root(user_id, data['thread_id'])
+        if thread_id is None:
+            return {'error': 'Thread not found'}, 404
+
+    now = datetime.utcnow()
+    message = Message(sender_id=user_id, content=content, thread_id=thread_id, sent_at=now)
+    db.session.add(message)
+    db.session.flush()
+    db.session.execute(insert(MessageRecipient.__table__), [
+        {'message_id': message.id, 'recipient_id': r, 'sent_at': now} for r in recipient_ids
+    ])
+    db.session.commit()
+
+    event = deliver(message.id, user_id, thread_id, content, now, recipient_ids)
+    return {**event, 'recipient_ids': recipient_ids}, 201
+
+
+# Pushes a committed message to its recipients' open streams and long-polls
+# and drops their cached unread counts. Call after the commit, so a client
+# woken by the event can already read the message.
+def deliver(message_id, sender_id, thread_id, content, sent_at, recipient_ids):
+    event = _message((message_id, sender_id, thread_id, content, sent_at, None))
+    current_app.extensions['unread_counts'].invalidate(recipient_ids)
+    current_app.extensions['message_broker'].publish(recipient_ids, event)
+    return event
+
+
+# PATCH /messages/<id> marks one message read; PATCH /messages with
+# {"ids": [...]} marks several, or {"all": true} the whole inbox.
+def mark_read(message_id=None):
+    user_id = current_user_id()
+    stmt = (
+        update(MessageRecipient)
+        .where(MessageRecipient.recipient_id == user_id, MessageRecipient.read_at.is_(None))
+        .values(read_at=datetime.utcnow())
+    )
+    if message_id is not None:
+        stmt = stmt.where(MessageRecipient.message_id == message_id)
+    else:
+        data = request.get_json(silent=True) or {}
+        ids = data.get('ids')
+        if isinstance(ids, list) and ids:
+            stmt = stmt.where(MessageRecipient.message_id.in_(ids))
+        elif data.get('all') is not True:
+            return {'error': "Expected {'ids': [...]} or {'all': true}"}, 400
+    updated = db.session.execute(stmt).rowcount
+    db.session.commit()
+    if message_id is not None and not updated and not db.session.execute(
+        select(MessageRecipient.id).where(
+            MessageRecipient.message_id == message_id, MessageRecipient.recipient_id == user_id,
+        )
+    ).first():
+        return {'error': 'Message not found'}, 404
+    counts = current_app.extensions['unread_counts']
+    counts.invalidate([user_id])
+    return {'marked_read': updated, 'unread': counts.get(user_id)}, 200
+
+
+def _messages_after(user_id, after_id):
+    stmt = (
+        select(*COLUMNS, MessageRecipient.read_at)
+        .join_from(MessageRecipient, Message, Message.id == MessageRecipient.message_id)
+        .where(MessageRecipient.recipient_id == user_id, MessageRecipient.message_id > after_id)
+        .order_by(MessageRecipient.message_id)
+        .limit(REPLAY_LIMIT)
+    )
+    return [_message(row) for row in db.session.execute(stmt)]
+
+
+def _sse(event):
+    return f"id: {event['id']}\nevent: message\ndata: {json.dumps(event)}\n\n"
+
+
+# Server-Sent Events: new messages are pushed as they are sent. A reconnecting
+# client sends Last-Event-ID and first gets what it missed from the database.
+# Connections close after MESSAGE_STREAM_TIMEOUT so a worker is never pinned
+# for good; EventSource reconnects by itself. Needs a threaded or async
+# worker class, as each open stream holds a worker thread.
+def stream():
+    user_id = current_user_id()
+    timeout = current_app.config['MESSAGE_STREAM_TIMEOUT']
+    keepalive = current_app.config['MESSAGE_KEEPALIVE_SECONDS']
+    try:
+        last_id = int(request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0)
+    except ValueError:
+        return {'error': 'Last-Event-ID must be a message id'}, 400
+
+    broker = current_app.extensions['message_broker']
+    # Subscribe before reading the backlog so nothing sent in between is lost
+    subscription = broker.subscribe(user_id)
+    backlog = _messages_after(user_id, last_id) if last_id else []
+    # The generator never touches the database; give the connection back now
+    db.session.close()
+
+    def generate():
+        seen = last_id
+        try:
+            yield f'retry: {keepalive * 1000}\n\n'
+            for event in backlog:
+                seen = event['id']
+                yield _sse(event)
+            deadline = time.monotonic() + timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    event = subscription.get(timeout=min(keepalive, remaining))
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                if event['id'] > seen:
+                    seen = event['id']
+                    yield _sse(event)
+        finally:
+            broker.unsubscribe(user_id, subscription)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+# Long-poll fallback for clients without EventSource: answers at once when
+# there are messages after ?after_id=, otherwise waits up to ?wait= seconds
+# for the next one.
+def poll():
+    user_id = current_user_id()
+    try:
+        after_id = _parse_int('after_id') or 0
+        wait = _parse_int('wait')
+        if wait is not None and wait < 0:
+            raise ValueError("'wait' must not be negative")
+        wait = min(25 if wait is None else wait, current_app.config['MESSAGE_STREAM_TIMEOUT'])
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    broker = current_app.extensions['message_broker']
+    subscription = broker.subscribe(user_id)
+    try:
+        messages = _messages_after(user_id, after_id)
+        if not messages:
+            db.session.close()
+            # wait=0 only collects what is already queued
+            if wait:
+                try:
+                    messages = [subscription.get(timeout=wait)]
+                except queue.Empty:
+                    pass
+            while True:
+                try:
+                    messages.append(subscription.get_nowait())
+                except queue.Empty:
+                    break
+    finally:
+        broker.unsubscribe(user_id, subscription)
+    messages = [m for m in messages if m['id'] > after_id]
+    return {'messages': messages}, 200
@@ -0,0 +1,242 @@
+import hmac
+import logging
+import time
+from threading import Lock
+
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(**labels):
+    return ','.join(f'{k}="{str(v)}"' for k, v in labels.items())
+
+
+# Per-process request and SQL statistics, keyed by Flask endpoint. Each
+# gunicorn worker keeps its own; Prometheus adds them up across targets.
+class Metrics:
+    def __init__(self):
+        self._lock = Lock()
+        self.latency = {}
+        self.requests = {}
+        self.queries = {}
+        self.query_seconds = {}
+        self.rows = {}
+        self.slow_queries = {}
+        self._collectors = []
+
+    def record_request(self, endpoint, method, status, seconds, queries, query_seconds, rows):
+        key = (endpoint, method)
+        with self._lock:
+            self.latency.setdefault(key, Histogram()).observe(seconds)
+            status_key = (endpoint, method, status)
+            self.requests[status_key] = self.requests.get(status_key, 0) + 1
+            self.queries[key] = self.queries.get(key, 0) + queries
+            self.query_seconds[key] = self.query_seconds.get(key, 0.0) + query_seconds
+            self.rows[key] = self.rows.get(key, 0) + rows
+
+    def record_slow_query(self, endpoint):
+        with self._lock:
+            self.slow_queries[endpoint] = self.slow_queries.get(endpoint, 0) + 1
+
+    # Other modules register callables returning (name, type, help, samples)
+    # where samples is a list of (labels dict, value).
+    def register_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        with self._lock:
+            family('http_request_duration_seconds', 'histogram', 'Request latency by endpoint.')
+            for (endpoint, method), hist in sorted(self.latency.items()):
+                labels = _labels(endpoint=endpoint, method=method)
+                for bound, count in zip(hist.buckets, hist.counts):
+                    lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {hist.count}')
+                lines.append(f'http_request_duration_seconds_sum{{{labels}}} {hist.sum}')
+                lines.append(f'http_request_duration_seconds_count{{{labels}}} {hist.count}')
+
+            family('http_requests_total', 'counter', 'Requests by endpoint and status.')
+            for (endpoint, method, status), value in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{{{_labels(endpoint=endpoint, method=method, status=status)}}} {value}')
+
+            for name, help_text, values in (
+                ('db_queries_total', 'SQL statements executed.', self.queries),
+                ('db_query_duration_seconds_total', 'Time spent executing SQL.', self.query_seconds),
+                ('db_rows_fetched_total', 'Rows read or written by SQL.', self.rows),
+            ):
+                family(name, 'counter', help_text)
+                for (endpoint, method), value in sorted(values.items()):
+                    lines.append(f'{name}{{{_labels(endpoint=endpoint, method=method)}}} {value}')
+
+            family('db_slow_queries_total', 'counter', 'SQL statements slower than SLOW_QUERY_MS.')
+            for endpoint, value in sorted(self.slow_queries.items()):
+                lines.append(f'db_slow_queries_total{{{_labels(endpoint=endpoint)}}} {value}')
+
+        for collector in self._collectors:
+            for name, kind, help_text, samples in collector():
+                family(name, kind, help_text)
+                for labels, value in samples:
+                    label_text = '{' + _labels(**labels) + '}' if labels else ''
+                    lines.append(f'{name}{label_text} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _endpoint():
+    return request.endpoint or 'unmatched'
+
+
+def record_rows(count):
+    if has_request_context() and 'sql_rows' in g:
+        g.sql_rows += count
+
+
+def _before_request():
+    g.request_started = time.perf_counter()
+    g.sql_queries = 0
+    g.sql_seconds = 0.0
+    g.sql_rows = 0
+
+
+# A streamed body is generated after this hook, so its request is recorded
+# when the response is closed, with the queries and rows of the stream.
+def _after_request(response):
+    if 'request_started' not in g:
+        return response
+    metrics = current_app.extensions['metrics']
+    endpoint, method, status = _endpoint(), request.method, response.status_code
+    state = g._get_current_object()
+
+    def record():
+        metrics.record_request(
+            endpoint, method, status, time.perf_counter() - state.request_started,
+            state.sql_queries, state.sql_seconds, state.sql_rows,
+        )
+
+    if response.is_streamed:
+        response.call_on_close(record)
+    else:
+        record()
+    return response
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _make_after_cursor_execute(app):
+    metrics = app.extensions['metrics']
+    slow_seconds = app.config['SLOW_QUERY_MS'] / 1000
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        if not has_request_context() or 'sql_queries' not in g:
+            return
+        g.sql_queries += 1
+        g.sql_seconds += elapsed
+        # rowcount covers writes; reads are counted by record_rows()
+        if cursor.rowcount and cursor.rowcount > 0:
+            g.sql_rows += cursor.rowcount
+        if slow_seconds and elapsed >= slow_seconds:
+            metrics.record_slow_query(_endpoint())
+            logger.warning('Slow query on %s (%.1f ms): %s', _endpoint(), elapsed * 1000, statement)
+
+    return after_cursor_execute
+
+
+# Scrapers send METRICS_TOKEN as a bearer token (Prometheus' `authorization`
+# scrape setting); the figures name endpoints and internal load, so they are
+# not served to anyone else.
+def metrics_view():
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(token.encode(), current_app.config['METRICS_TOKEN'].encode()):
+        return Response('Unauthorized\n', status=401, mimetype='text/plain',
+                        headers={'WWW-Authenticate': 'Bearer realm="metrics"'})
+    body = current_app.extensions['metrics'].render()
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+
+def _extension_collector(app):
+    def collect():
+        families = []
+        hasher = app.extensions.get('password_hasher')
+        if hasher is not None:
+            stats = hasher.stats()
+            families.append(('password_hash_completed_total', 'counter', 'Password hashes and checks run.',
+                             [({}, stats['completed'])]))
+            families.append(('password_hash_rejected_total', 'counter', 'Hash calls rejected as saturated.',
+                             [({}, stats['rejected'])]))
+            families.append(('password_hash_in_flight', 'gauge', 'Hash calls running or queued.',
+                             [({}, stats['in_flight'])]))
+            families.append(('password_hash_queue_wait_seconds_total', 'counter', 'Time spent queued for the pool.',
+                             [({}, stats['queue_wait_seconds'])]))
+            families.append(('password_hash_seconds_total', 'counter', 'Time spent hashing.',
+                             [({}, stats['hash_seconds'])]))
+        broker = app.extensions.get('message_broker')
+        if hasattr(broker, 'subscriber_count'):
+            families.append(('message_stream_subscribers', 'gauge', 'Open message streams and long-polls.',
+                             [({}, broker.subscriber_count())]))
+            families.append(('message_events_dropped_total', 'counter', 'Events dropped for slow subscribers.',
+                             [({}, broker.dropped)]))
+        limiter = app.extensions.get('rate_limiter')
+        if limiter is not None:
+            stats = limiter.stats()
+            for name, kind, help_text in (
+                ('allowed', 'counter', 'Requests let through by the rate limiter, by budget.'),
+                ('limited', 'counter', 'Requests refused with 429, by budget.'),
+                ('shed', 'counter', 'Requests refused with 503 over a concurrency cap, by budget.'),
+            ):
+                families.append((f'rate_limit_{name}_total', kind, help_text,
+                                 [({'budget': budget}, value) for budget, value in sorted(stats[name].items())]))
+            families.append(('rate_limit_in_flight', 'gauge', 'Requests holding a concurrency slot, by endpoint.',
+                             [({'endpoint': endpoint}, value) for endpoint, value in sorted(stats['in_flight'].items())]))
+        for name, extension in (('jwt_claims_cache', 'claims_cache'), ('response_cache', 'response_cache')):
+            cache = app.extensions.get(extension)
+            if cache is not None:
+                families.append((f'{name}_hits_total', 'counter', f'{name} hits.', [({}, cache.hits)]))
+                families.append((f'{name}_misses_total', 'counter', f'{name} misses.', [({}, cache.misses)]))
+        return families
+    return collect
+
+
+def init_app(app, db):
+    app.config.setdefault('METRICS_ENABLED', True)
+    app.config.setdefault('SLOW_QUERY_MS', 0)
+    app.config.setdefault('METRICS_TOKEN', None)
+    if not app.config['METRICS_ENABLED']:
+        return
+    app.extensions['metrics'] = Metrics()
+    app.extensions['metrics'].register_collector(_extension_collector(app))
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    # Without a token nothing may read the figures, so there is no route
+    if app.config['METRICS_TOKEN']:
+        app.add_url_rule('/metrics', 'metrics', metrics_view)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _make_after_cursor_execute(app))
@@ -0,0 +1,47 @@
+"""add indexes on foreign keys and lookup columns
+
+Revision ID: 3f2a9c1d7e01
+Revises: 
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c1d7e01'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    ('ix_teachers_email', 'teachers', ['email']),
+    ('ix_student_class_class_id', 'student_class', ['class_id']),
+    ('ix_teacher_subject_subject_id', 'teacher_subject', ['subject_id']),
+    ('ix_schedules_class_id', 'schedules', ['class_id']),
+    ('ix_schedules_teacher_id', 'schedules', ['teacher_id']),
+    ('ix_grades_student_id_subject_id', 'grades', ['student_id', 'subject_id']),
+    ('ix_grades_subject_id', 'grades', ['subject_id']),
+    ('ix_files_subject_id', 'files', ['subject_id']),
+    ('ix_links_subject_id', 'links', ['subject_id']),
+    ('ix_messages_sender_id', 'messages', ['sender_id']),
+    ('ix_forums_subject_id', 'forums', ['subject_id']),
+    ('ix_sports_events_sport_id', 'sports_events', ['sport_id']),
+    ('ix_books_library_id', 'books', ['library_id']),
+    ('ix_checkout_records_book_id', 'checkout_records', ['book_id']),
+    ('ix_checkout_records_user_id', 'checkout_records', ['user_id']),
+    ('ix_checkout_records_due_date', 'checkout_records', ['due_date']),
+]
+
+
+def upgrade():
+    # Databases created by db.create_all() after this change already have
+    # these indexes, hence if_not_exists.
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, unique=False, if_not_exists=True)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table, if_exists=True)
@@ -0,0 +1,28 @@
+"""add grades.recorded_at for date range filtering
+
+Revision ID: 8b41d2e6c5a3
+Revises: 3f2a9c1d7e01
+Create Date: 2026-10-18 12:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b41d2e6c5a3'
+down_revision = '3f2a9c1d7e01'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('grades', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('recorded_at', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_grades_recorded_at', ['recorded_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('grades', schema=None) as batch_op:
+        batch_op.drop_index('ix_grades_recorded_at')
+        batch_op.drop_column('recorded_at')
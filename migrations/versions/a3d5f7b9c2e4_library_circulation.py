@@ -0,0 +1,46 @@
+"""add library circulation columns and open-loan indexes
+
+Revision ID: a3d5f7b9c2e4
+Revises: f2c6a8e1d4b7
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3d5f7b9c2e4'
+down_revision = 'f2c6a8e1d4b7'
+branch_labels = None
+depends_on = None
+
+OPEN = sa.text('returned_date IS NULL')
+
+
+def upgrade():
+    # Only ADD COLUMN here, so batch mode never rebuilds books and drops its
+    # full-text search triggers
+    with op.batch_alter_table('books', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('copies', sa.Integer(), nullable=False, server_default='1'))
+
+    with op.batch_alter_table('checkout_records', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('returned_date', sa.Date(), nullable=True))
+        batch_op.add_column(sa.Column('fine_amount', sa.Float(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('reminded_at', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_checkout_records_open_book_id', ['book_id', 'due_date'], unique=False,
+                              sqlite_where=OPEN, postgresql_where=OPEN)
+        batch_op.create_index('ix_checkout_records_open_due_date', ['due_date', 'id'], unique=False,
+                              sqlite_where=OPEN, postgresql_where=OPEN)
+
+
+def downgrade():
+    with op.batch_alter_table('checkout_records', schema=None) as batch_op:
+        batch_op.drop_index('ix_checkout_records_open_due_date')
+        batch_op.drop_index('ix_checkout_records_open_book_id')
+        batch_op.drop_column('reminded_at')
+        batch_op.drop_column('fine_amount')
+        batch_op.drop_column('returned_date')
+
+    # A plain ALTER TABLE ... DROP COLUMN (SQLite 3.35+) for the same reason
+    op.drop_column('books', 'copies')
@@ -0,0 +1,56 @@
+"""add uploaded file content columns and upload_sessions
+
+Revision ID: b8e1f4a6c3d2
+Revises: a3d5f7b9c2e4
+Create Date: 2026-10-18 13:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8e1f4a6c3d2'
+down_revision = 'a3d5f7b9c2e4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Only ADD COLUMN and CREATE INDEX, so batch mode never rebuilds files
+    # and drops its full-text search triggers
+    with op.batch_alter_table('files', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('content_hash', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('size', sa.BigInteger(), nullable=True))
+        batch_op.add_column(sa.Column('mime_type', sa.String(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_files_content_hash'), ['content_hash'], unique=False)
+
+    # The app's create_all() may already have made the new table
+    if sa.inspect(op.get_bind()).has_table('upload_sessions'):
+        return
+    op.create_table(
+        'upload_sessions',
+        sa.Column('id', sa.String(length=32), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=True),
+        sa.Column('description', sa.Text(), nullable=True),
+        sa.Column('subject_id', sa.Integer(), nullable=True),
+        sa.Column('mime_type', sa.String(), nullable=True),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('sha256', sa.String(length=64), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['subject_id'], ['subjects.id']),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_upload_sessions_user_id'), 'upload_sessions', ['user_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_upload_sessions_user_id'), table_name='upload_sessions')
+    op.drop_table('upload_sessions')
+    op.drop_index(op.f('ix_files_content_hash'), table_name='files')
+    # A plain ALTER TABLE ... DROP COLUMN (SQLite 3.35+) for the same reason
+    op.drop_column('files', 'mime_type')
+    op.drop_column('files', 'size')
+    op.drop_column('files', 'content_hash')
@@ -0,0 +1,45 @@
+"""add exports
+
+Revision ID: c4a9d2e7f1b5
+Revises: b8e1f4a6c3d2
+Create Date: 2026-10-18 15:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4a9d2e7f1b5'
+down_revision = 'b8e1f4a6c3d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The app's create_all() may already have made the new table
+    if sa.inspect(op.get_bind()).has_table('exports'):
+        return
+    op.create_table(
+        'exports',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('resource', sa.String(), nullable=False),
+        sa.Column('format', sa.String(length=16), nullable=False),
+        sa.Column('fields', sa.Text(), nullable=True),
+        sa.Column('compress', sa.Boolean(), nullable=False),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('rows', sa.Integer(), nullable=True),
+        sa.Column('size', sa.BigInteger(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_exports_user_id'), 'exports', ['user_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_exports_user_id'), table_name='exports')
+    op.drop_table('exports')
@@ -0,0 +1,59 @@
+"""add materialized report_cards and class_rankings tables
+
+Revision ID: c7d3e9a1f2b4
+Revises: 8b41d2e6c5a3
+Create Date: 2026-10-18 12:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d3e9a1f2b4'
+down_revision = '8b41d2e6c5a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The app's create_all() may already have made the new tables
+    if sa.inspect(op.get_bind()).has_table('report_cards'):
+        return
+    op.create_table(
+        'report_cards',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('student_id', sa.Integer(), nullable=False),
+        sa.Column('subject_id', sa.Integer(), nullable=True),
+        sa.Column('term', sa.String(length=16), nullable=False),
+        sa.Column('grade_count', sa.Integer(), nullable=False),
+        sa.Column('grade_total', sa.Float(), nullable=False),
+        sa.Column('average', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['student_id'], ['students.id']),
+        sa.ForeignKeyConstraint(['subject_id'], ['subjects.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('student_id', 'subject_id', 'term', name='uq_report_cards_student_subject_term'),
+    )
+    op.create_table(
+        'class_rankings',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('class_id', sa.Integer(), nullable=False),
+        sa.Column('student_id', sa.Integer(), nullable=False),
+        sa.Column('term', sa.String(length=16), nullable=False),
+        sa.Column('average', sa.Float(), nullable=False),
+        sa.Column('subject_count', sa.Integer(), nullable=False),
+        sa.Column('rank', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['class_id'], ['classes.id']),
+        sa.ForeignKeyConstraint(['student_id'], ['students.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_class_rankings_class_id_term_rank', 'class_rankings',
+                    ['class_id', 'term', 'rank', 'student_id'], unique=False)
+    op.create_index('ix_class_rankings_student_id', 'class_rankings', ['student_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_class_rankings_student_id', table_name='class_rankings')
+    op.drop_index('ix_class_rankings_class_id_term_rank', table_name='class_rankings')
+    op.drop_table('class_rankings')
+    op.drop_table('report_cards')
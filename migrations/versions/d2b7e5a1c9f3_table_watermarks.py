@@ -0,0 +1,33 @@
+"""add table watermarks
+
+Revision ID: d2b7e5a1c9f3
+Revises: c4a9d2e7f1b5
+Create Date: 2026-10-18 16:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2b7e5a1c9f3'
+down_revision = 'c4a9d2e7f1b5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The app's create_all() may already have made the new table
+    if sa.inspect(op.get_bind()).has_table('table_watermarks'):
+        return
+    op.create_table(
+        'table_watermarks',
+        sa.Column('table_name', sa.String(length=64), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('table_name'),
+    )
+
+
+def downgrade():
+    op.drop_table('table_watermarks')
@@ -0,0 +1,38 @@
+"""add schedules.subject_id and (key, class_time) indexes for conflict checks
+
+Revision ID: d9e2f4b6a8c1
+Revises: c7d3e9a1f2b4
+Create Date: 2026-10-18 12:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9e2f4b6a8c1'
+down_revision = 'c7d3e9a1f2b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('schedules', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('subject_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_schedules_subject_id_subjects', 'subjects', ['subject_id'], ['id'])
+        batch_op.drop_index('ix_schedules_class_id')
+        batch_op.drop_index('ix_schedules_teacher_id')
+        batch_op.create_index('ix_schedules_class_id_class_time', ['class_id', 'class_time'], unique=False)
+        batch_op.create_index('ix_schedules_teacher_id_class_time', ['teacher_id', 'class_time'], unique=False)
+        batch_op.create_index('ix_schedules_location_class_time', ['location', 'class_time'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('schedules', schema=None) as batch_op:
+        batch_op.drop_index('ix_schedules_location_class_time')
+        batch_op.drop_index('ix_schedules_teacher_id_class_time')
+        batch_op.drop_index('ix_schedules_class_id_class_time')
+        batch_op.create_index('ix_schedules_teacher_id', ['teacher_id'], unique=False)
+        batch_op.create_index('ix_schedules_class_id', ['class_id'], unique=False)
+        batch_op.drop_constraint('fk_schedules_subject_id_subjects', type_='foreignkey')
+        batch_op.drop_column('subject_id')
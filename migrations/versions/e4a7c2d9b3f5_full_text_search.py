@@ -0,0 +1,58 @@
+"""add FTS5 search indexes for news, forums, files, links and books
+
+Revision ID: e4a7c2d9b3f5
+Revises: d9e2f4b6a8c1
+Create Date: 2026-10-18 12:40:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a7c2d9b3f5'
+down_revision = 'd9e2f4b6a8c1'
+branch_labels = None
+depends_on = None
+
+
+SOURCES = [
+    ('news', 'title', 'content'),
+    ('forums', 'name', 'description'),
+    ('files', 'name', 'description'),
+    ('links', 'name', 'description'),
+    ('books', 'title', 'author'),
+]
+
+
+def upgrade():
+    # FTS5 is SQLite-only; other backends fall back to LIKE matching
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for table, title, body in SOURCES:
+        fts = f'{table}_fts'
+        insert_row = f"INSERT INTO {fts}(rowid, {title}, {body}) VALUES (new.id, new.{title}, new.{body});"
+        delete_row = (f"INSERT INTO {fts}({fts}, rowid, {title}, {body}) "
+                      f"VALUES ('delete', old.id, old.{title}, old.{body});")
+        op.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+            f"{title}, {body}, content='{table}', content_rowid='id', prefix='2 3', "
+            f"tokenize='unicode61 remove_diacritics 2')"
+        )
+        op.execute(f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN {insert_row} END")
+        op.execute(f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN {delete_row} END")
+        op.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {title}, {body} ON {table} "
+            f"BEGIN {delete_row} {insert_row} END"
+        )
+        # Index the rows that already exist
+        op.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for table, _, _ in reversed(SOURCES):
+        fts = f'{table}_fts'
+        for suffix in ('au', 'ad', 'ai'):
+            op.execute(f'DROP TRIGGER IF EXISTS {fts}_{suffix}')
+        op.execute(f'DROP TABLE IF EXISTS {fts}')
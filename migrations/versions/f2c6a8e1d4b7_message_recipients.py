@@ -0,0 +1,53 @@
+"""add message_recipients and messages.thread_id
+
+Revision ID: f2c6a8e1d4b7
+Revises: e4a7c2d9b3f5
+Create Date: 2026-10-18 12:50:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c6a8e1d4b7'
+down_revision = 'e4a7c2d9b3f5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('thread_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_messages_thread_id_messages', 'messages', ['thread_id'], ['id'])
+        batch_op.create_index('ix_messages_thread_id', ['thread_id'], unique=False)
+
+    # The app's create_all() may already have made the new table
+    if sa.inspect(op.get_bind()).has_table('message_recipients'):
+        return
+    op.create_table(
+        'message_recipients',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('message_id', sa.Integer(), nullable=False),
+        sa.Column('recipient_id', sa.Integer(), nullable=False),
+        sa.Column('sent_at', sa.DateTime(), nullable=False),
+        sa.Column('read_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['message_id'], ['messages.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['recipient_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('message_id', 'recipient_id', name='uq_message_recipients_message_recipient'),
+    )
+    op.create_index('ix_message_recipients_recipient_id_sent_at', 'message_recipients',
+                    ['recipient_id', 'sent_at'], unique=False)
+    op.create_index('ix_message_recipients_recipient_id_read_at', 'message_recipients',
+                    ['recipient_id', 'read_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_message_recipients_recipient_id_read_at', table_name='message_recipients')
+    op.drop_index('ix_message_recipients_recipient_id_sent_at', table_name='message_recipients')
+    op.drop_table('message_recipients')
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.drop_index('ix_messages_thread_id')
+        batch_op.drop_constraint('fk_messages_thread_id_messages', type_='foreignkey')
+        batch_op.drop_column('thread_id')
@@ -5,7 +5,14 @@ from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import ForeignKey
 from sqlalchemy.orm import backref
 from flask_migrate import Migrate
-db = SQLAlchemy()
+from flask_sqlalchemy.model import Model
+from serializers import SerializerMixin, register_serializers
+
+
+class BaseModel(SerializerMixin, Model):
+    pass
+
+db = SQLAlchemy(model_class=BaseModel)
 
 class User(db.Model):
     __tablename__ = 'users'  
@@ -17,7 +24,7 @@ class User(db.Model):
     role = db.Column(db.String(20), default='student')  # Default role is 'student'
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
-    clubs = db.relationship('Club', secondary='club_member', backref=db.backref('members', lazy='dynamic'),
+    clubs = db.relationship('Club', secondary='club_member', backref=db.backref('members'),
                             primaryjoin="User.id == club_member.c.user_id")
 
     def __repr__(self):
@@ -39,7 +46,8 @@ class Student(db.Model):
 
 student_class = db.Table('student_class',
     db.Column('student_id', db.Integer, db.ForeignKey('students.id'), primary_key=True),
-    db.Column('class_id', db.Integer, db.ForeignKey('classes.id'), primary_key=True)
+    db.Column('class_id', db.Integer, db.ForeignKey('classes.id'), primary_key=True),
+    db.Index('ix_student_class_class_id', 'class_id')
 ) 
 
 class Teacher(db.Model):
@@ -47,7 +55,7 @@ class Teacher(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String)
-    email = db.Column(db.String)
+    email = db.Column(db.String, index=True)
     password = db.Column(db.String)
     phone_number = db.Column(db.Integer)
     created_at = db.Column(db.DateTime)
@@ -57,7 +65,8 @@ class Teacher(db.Model):
 teacher_subject = db.Table(
     'teacher_subject',
     db.Column('teacher_id', db.Integer, db.ForeignKey('teachers.id'), primary_key=True),
-    db.Column('subject_id', db.Integer, db.ForeignKey('subjects.id'), primary_key=True)
+    db.Column('subject_id', db.Integer, db.ForeignKey('subjects.id'), primary_key=True),
+    db.Index('ix_teacher_subject_subject_id', 'subject_id')
 )
 
 class Class(db.Model):
@@ -79,23 +88,69 @@ class Subject(db.Model):
 
 class Schedule(db.Model):
     __tablename__ = 'schedules'
+    # Range lookups for timetable conflict checks; also serve the FK lookups
+    __table_args__ = (
+        db.Index('ix_schedules_class_id_class_time', 'class_id', 'class_time'),
+        db.Index('ix_schedules_teacher_id_class_time', 'teacher_id', 'class_time'),
+        db.Index('ix_schedules_location_class_time', 'location', 'class_time'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     class_id = db.Column(db.Integer, db.ForeignKey('classes.id'))
     class_time = db.Column(db.DateTime)
     location = db.Column(db.String)
     teacher_id = db.Column(db.Integer, db.ForeignKey('teachers.id'))
-    teacher = db.relationship('Teacher', backref=backref('schedules', lazy='dynamic'))
+    subject_id = db.Column(db.Integer, db.ForeignKey('subjects.id'))
+    teacher = db.relationship('Teacher', backref=backref('schedules'))
 
 class Grade(db.Model):
     __tablename__ = 'grades'
+    # Also serves lookups on student_id alone
+    __table_args__ = (db.Index('ix_grades_student_id_subject_id', 'student_id', 'subject_id'),)
 
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('students.id'))
-    subject_id = db.Column(db.Integer, db.ForeignKey('subjects.id'))
+    subject_id = db.Column(db.Integer, db.ForeignKey('subjects.id'), index=True)
     grade = db.Column(db.Float)
-    student = db.relationship('Student', backref=backref('grades', lazy='dynamic'))
-    subject = db.relationship('Subject', backref=backref('grades', lazy='dynamic'))
+    recorded_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    student = db.relationship('Student', backref=backref('grades'))
+    subject = db.relationship('Subject', backref=backref('grades'))
+
+# Materialized per-term grade summaries, maintained by reports.py whenever
+# grades are written. Rebuild with `flask rebuild-report-cards`.
+class ReportCard(db.Model):
+    __tablename__ = 'report_cards'
+    __table_args__ = (db.UniqueConstraint('student_id', 'subject_id', 'term', name='uq_report_cards_student_subject_term'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('students.id'), nullable=False)
+    subject_id = db.Column(db.Integer, db.ForeignKey('subjects.id'))
+    term = db.Column(db.String(16), nullable=False)
+    grade_count = db.Column(db.Integer, nullable=False)
+    grade_total = db.Column(db.Float, nullable=False)
+    average = db.Column(db.Float, nullable=False)
+
+class ClassRanking(db.Model):
+    __tablename__ = 'class_rankings'
+    __table_args__ = (db.Index('ix_class_rankings_class_id_term_rank', 'class_id', 'term', 'rank', 'student_id'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    class_id = db.Column(db.Integer, db.ForeignKey('classes.id'), nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('students.id'), nullable=False, index=True)
+    term = db.Column(db.String(16), nullable=False)
+    average = db.Column(db.Float, nullable=False)
+    subject_count = db.Column(db.Integer, nullable=False)
+    rank = db.Column(db.Integer, nullable=False)
+
+# One row per table, bumped in the same transaction as every write to it.
+# List responses take their ETag and Last-Modified from here, so a
+# revalidation is answered without running the list query.
+class TableWatermark(db.Model):
+    __tablename__ = 'table_watermarks'
+
+    table_name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime)
 
 class News(db.Model):
     __tablename__ = 'news'
@@ -122,8 +177,70 @@ class File(db.Model):
     name = db.Column(db.String)
     file_path = db.Column(db.String)
     description = db.Column(db.Text)
+    subject_id = db.Column(db.Integer, db.ForeignKey('subjects.id'), index=True)
+    # Set for uploaded files: file_path is then the content-addressed key
+    # under UPLOAD_FOLDER, shared by every file with the same sha256
+    content_hash = db.Column(db.String(64), index=True)
+    size = db.Column(db.BigInteger)
+    mime_type = db.Column(db.String)
+    subject = db.relationship('Subject', backref=backref('files'))
+
+# A resumable upload in progress. The bytes received so far live in a part
+# file named after the id, so its size on disk is the resume offset.
+class UploadSession(db.Model):
+    __tablename__ = 'upload_sessions'
+
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    name = db.Column(db.String)
+    description = db.Column(db.Text)
     subject_id = db.Column(db.Integer, db.ForeignKey('subjects.id'))
-    subject = db.relationship('Subject', backref=backref('files', lazy='dynamic'))
+    mime_type = db.Column(db.String)
+    size = db.Column(db.BigInteger, nullable=False)
+    sha256 = db.Column(db.String(64))
+    created_at = db.Column(db.DateTime, nullable=False)
+
+# A background export. Its file is written next to uploads, under
+# UPLOAD_FOLDER/exports, once status is 'done'.
+class Export(db.Model):
+    __tablename__ = 'exports'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    resource = db.Column(db.String, nullable=False)
+    format = db.Column(db.String(16), nullable=False)
+    fields = db.Column(db.Text)
+    compress = db.Column(db.Boolean, nullable=False, default=False)
+    status = db.Column(db.String(16), nullable=False, default='pending')
+    rows = db.Column(db.Integer)
+    size = db.Column(db.BigInteger)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False)
+    finished_at = db.Column(db.DateTime)
+
+# Background job queue (see jobs.py). Workers claim the oldest due queued
+# job through the (status, run_at) index.
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    __table_args__ = (db.Index('ix_jobs_status_run_at', 'status', 'run_at'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(32), nullable=False)
+    payload = db.Column(db.JSON)
+    status = db.Column(db.String(16), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_at = db.Column(db.DateTime, nullable=False)
+    progress = db.Column(db.Integer)
+    total = db.Column(db.Integer)
+    result = db.Column(db.JSON)
+    error = db.Column(db.Text)
+    worker = db.Column(db.String(64))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
 
 class Link(db.Model):
     __tablename__ = 'links'
@@ -132,17 +249,36 @@ class Link(db.Model):
     name = db.Column(db.String)
     url = db.Column(db.String)
     description = db.Column(db.Text)
-    subject_id = db.Column(db.Integer, db.ForeignKey('subjects.id'))
-    subject = db.relationship('Subject', backref=backref('links', lazy='dynamic'))
+    subject_id = db.Column(db.Integer, db.ForeignKey('subjects.id'), index=True)
+    subject = db.relationship('Subject', backref=backref('links'))
 
 class Message(db.Model):
     __tablename__ = 'messages'
 
     id = db.Column(db.Integer, primary_key=True)
-    sender_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    sender_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    # id of the first message of the conversation; NULL for a thread's root
+    thread_id = db.Column(db.Integer, db.ForeignKey('messages.id'), index=True)
     content = db.Column(db.Text)
-    sent_at = db.Column(db.DateTime)
-    sender = db.relationship('User', foreign_keys=[sender_id], primaryjoin='Message.sender_id == User.id', backref=backref('sent_messages', lazy='dynamic'))
+    sent_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sender = db.relationship('User', foreign_keys=[sender_id], primaryjoin='Message.sender_id == User.id', backref=backref('sent_messages'))
+    recipients = db.relationship('MessageRecipient', backref='message', cascade='all, delete-orphan')
+
+# One row per recipient of a message. sent_at is copied from the message so
+# an inbox page and the unread count are each a single index range scan.
+class MessageRecipient(db.Model):
+    __tablename__ = 'message_recipients'
+    __table_args__ = (
+        db.UniqueConstraint('message_id', 'recipient_id', name='uq_message_recipients_message_recipient'),
+        db.Index('ix_message_recipients_recipient_id_sent_at', 'recipient_id', 'sent_at'),
+        db.Index('ix_message_recipients_recipient_id_read_at', 'recipient_id', 'read_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    message_id = db.Column(db.Integer, db.ForeignKey('messages.id', ondelete='CASCADE'), nullable=False)
+    recipient_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    sent_at = db.Column(db.DateTime, nullable=False)
+    read_at = db.Column(db.DateTime)
 
 class Forum(db.Model):
     __tablename__ = 'forums'
@@ -150,8 +286,8 @@ class Forum(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
     description = db.Column(db.Text)
-    subject_id = db.Column(db.Integer, db.ForeignKey('subjects.id'))
-    subject = db.relationship('Subject', backref=backref('forums', lazy='dynamic'))
+    subject_id = db.Column(db.Integer, db.ForeignKey('subjects.id'), index=True)
+    subject = db.relationship('Subject', backref=backref('forums'))
 
 club_member = db.Table(
     'club_member',
@@ -186,7 +322,7 @@ class SportsEvent(db.Model):
     date = db.Column(db.Date)
     time = db.Column(db.Time)
     location = db.Column(db.String)
-    sport_id = db.Column(db.Integer, db.ForeignKey('sports.id'))
+    sport_id = db.Column(db.Integer, db.ForeignKey('sports.id'), index=True)
 
 class Library(db.Model):
     __tablename__ = 'libraries'
@@ -201,14 +337,28 @@ class Book(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String)
     author = db.Column(db.String)
-    library_id = db.Column(db.Integer, db.ForeignKey('libraries.id'))
+    library_id = db.Column(db.Integer, db.ForeignKey('libraries.id'), index=True)
+    copies = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     checkout_records = db.relationship('CheckoutRecord', backref='book')
 
 class CheckoutRecord(db.Model):
     __tablename__ = 'checkout_records'
+    # Partial indexes over open loans only (returned_date IS NULL): they stay
+    # as small as the number of books out, whatever the circulation history.
+    __table_args__ = (
+        db.Index('ix_checkout_records_open_book_id', 'book_id', 'due_date',
+                 sqlite_where=db.text('returned_date IS NULL'), postgresql_where=db.text('returned_date IS NULL')),
+        db.Index('ix_checkout_records_open_due_date', 'due_date', 'id',
+                 sqlite_where=db.text('returned_date IS NULL'), postgresql_where=db.text('returned_date IS NULL')),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    book_id = db.Column(db.Integer, db.ForeignKey('books.id'))
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id'), index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
     checkout_date = db.Column(db.Date)
-    due_date = db.Column(db.Date)
+    due_date = db.Column(db.Date, index=True)
+    returned_date = db.Column(db.Date)
+    fine_amount = db.Column(db.Float, nullable=False, default=0.0, server_default='0')
+    reminded_at = db.Column(db.DateTime)
+
+register_serializers(db.Model)
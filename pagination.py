@@ -0,0 +1,168 @@
+from urllib.parse import urlencode
+
+from flask import Response, current_app, request, stream_with_context
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload, load_only, selectinload
+
+from metrics import record_rows
+from models import db
+from representations import native_datetimes
+from serializers import serializer_for
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def _int_arg(args, name, default):
+    value = args.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"'{name}' must be an integer")
+
+
+def wants_stream():
+    if request.args.get('format') == 'ndjson':
+        return True
+    return request.accept_mimetypes.best == NDJSON_MIMETYPE
+
+
+def page_url(base_url, args, after_id, limit):
+    args = args.copy()
+    args['after_id'] = after_id
+    args['limit'] = limit
+    return f"{base_url}?{urlencode(list(args.items(multi=True)))}"
+
+
+def next_page_url(after_id, limit):
+    return page_url(request.base_url, request.args, after_id, limit)
+
+
+# The paging arguments every list endpoint accepts, parsed from a MultiDict
+# so the async list endpoints in asgi.py can share them.
+def page_args(serializer, args):
+    after_id = _int_arg(args, 'after_id', 0)
+    limit = _int_arg(args, 'limit', None)
+    if limit is not None and limit < 1:
+        raise ValueError("'limit' must be positive")
+    return after_id, limit, serializer.parse_fields(args.get('fields'))
+
+
+def keyset(stmt, model, after_id, filters=()):
+    pk = model.__table__.c.id
+    stmt = stmt.where(*filters).order_by(pk)
+    return stmt.where(pk > after_id) if after_id else stmt
+
+
+def page_size(limit, config):
+    return min(limit or config['PAGE_SIZE_DEFAULT'], config['PAGE_SIZE_MAX'])
+
+
+def stream_ndjson(rows):
+    dumps = current_app.json.dumps
+
+    def generate():
+        count = 0
+        try:
+            for row in rows:
+                count += 1
+                yield dumps(row) + '\n'
+        finally:
+            record_rows(count)
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
+def parse_includes(includes):
+    value = request.args.get('include')
+    if not value:
+        return ()
+    requested = tuple(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+    unknown = [name for name in requested if name not in (includes or {})]
+    if unknown:
+        raise ValueError(f"Unknown include(s): {', '.join(unknown)}")
+    return requested
+
+
+# Collections are loaded with one extra SELECT ... IN per relationship and
+# many-to-one relations are joined in, so the number of queries per page does
+# not depend on the number of rows.
+def include_options(includes, names):
+    options = []
+    for name in names:
+        attr = includes[name]
+        strategy = selectinload if attr.property.uselist else joinedload
+        options.append(strategy(attr))
+    return options
+
+
+def _dump_related(value):
+    if value is None:
+        return None
+    if isinstance(value, list):
+        return [serializer_for(type(item)).dump(item) for item in value]
+    return serializer_for(type(value)).dump(value)
+
+
+# Keyset pagination over the primary key. Pages are requested with
+# ?after_id=<last id seen>&limit=<n>; the server caps limit at PAGE_SIZE_MAX.
+# ?format=ndjson (or Accept: application/x-ndjson) streams every remaining row
+# instead, fetching them from the database in STREAM_BATCH_SIZE batches.
+# ?fields=a,b limits the columns selected, so Text columns are only read when
+# asked for. Rows come back as tuples and are never hydrated into ORM objects,
+# unless ?include= asks for one of the relationships listed in `includes`;
+# those are eager loaded onto the page's objects. `filters` are extra SQL
+# conditions applied before paging.
+def paginate(model, includes=None, filters=()):
+    config = current_app.config
+    serializer = serializer_for(model)
+    try:
+        after_id, limit, fields = page_args(serializer, request.args)
+        include_names = parse_includes(includes)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    if include_names:
+        stmt = select(model).options(
+            load_only(*(getattr(model, name) for name in fields)),
+            *include_options(includes, include_names),
+        )
+
+        def to_dict(obj):
+            data = serializer.dump(obj, fields)
+            for name in include_names:
+                data[name] = _dump_related(getattr(obj, name))
+            return data
+
+        def execute(stmt):
+            return db.session.execute(stmt).scalars()
+
+        def key_of(obj):
+            return obj.id
+    else:
+        stmt = serializer.select(fields)
+        to_dict = serializer.row_factory(fields, convert=not native_datetimes())
+        execute = db.session.execute
+
+        def key_of(row):
+            return row[0]
+
+    stmt = keyset(stmt, model, after_id, filters)
+
+    if wants_stream():
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        stmt = stmt.execution_options(yield_per=config['STREAM_BATCH_SIZE'])
+        return stream_ndjson(to_dict(row) for row in execute(stmt))
+
+    limit = page_size(limit, config)
+    rows = execute(stmt.limit(limit + 1)).all()
+    record_rows(len(rows))
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_id = key_of(rows[-1])
+        headers['X-Next-After-Id'] = str(last_id)
+        headers['Link'] = f'<{next_page_url(last_id, limit)}>; rel="next"'
+    return [to_dict(row) for row in rows], 200, headers
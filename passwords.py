@@ -0,0 +1,114 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+
+import bcrypt
+from flask import current_app
+
+
+class HasherSaturated(Exception):
+    pass
+
+
+# Run in the pool, so they have to be module level to be picklable for the
+# process executor. Wall-clock timestamps are used so queue wait can be
+# measured across processes.
+def _timed(fn, *args):
+    started = time.time()
+    result = fn(*args)
+    return result, started, time.time() - started
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _check(password, hashed):
+    return bcrypt.checkpw(password, hashed)
+
+
+# bcrypt is deliberately slow, so it runs on a fixed-size pool instead of the
+# request thread. At most `workers + queue_depth` calls are admitted at once;
+# anything beyond that fails fast with HasherSaturated so a login burst can't
+# starve every other endpoint.
+class PasswordHasher:
+    def __init__(self, workers=2, queue_depth=16, rounds=12, executor='thread'):
+        self.rounds = rounds
+        pool = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+        self._executor = pool(max_workers=workers)
+        self._slots = BoundedSemaphore(workers + queue_depth)
+        self._lock = Lock()
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.completed = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.queue_wait_seconds = 0.0
+        self.hash_seconds = 0.0
+        self.max_queue_wait_seconds = 0.0
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HasherSaturated('Password hashing is saturated, try again shortly')
+        with self._lock:
+            self.in_flight += 1
+        enqueued = time.time()
+        try:
+            result, started, duration = self._executor.submit(_timed, fn, *args).result()
+        finally:
+            self._slots.release()
+            with self._lock:
+                self.in_flight -= 1
+        wait = max(0.0, started - enqueued)
+        with self._lock:
+            self.completed += 1
+            self.queue_wait_seconds += wait
+            self.hash_seconds += duration
+            self.max_queue_wait_seconds = max(self.max_queue_wait_seconds, wait)
+        return result
+
+    def hash(self, password):
+        return self._run(_hash, password.encode('utf-8'), self.rounds).decode('utf-8')
+
+    def check(self, password, hashed):
+        return self._run(_check, password.encode('utf-8'), hashed.encode('utf-8'))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_depth': self.queue_depth,
+                'in_flight': self.in_flight,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'queue_wait_seconds': self.queue_wait_seconds,
+                'hash_seconds': self.hash_seconds,
+                'max_queue_wait_seconds': self.max_queue_wait_seconds,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+def init_app(app):
+    app.config.setdefault('BCRYPT_LOG_ROUNDS', 12)
+    app.config.setdefault('PASSWORD_HASH_WORKERS', max(1, (os.cpu_count() or 2) // 2))
+    app.config.setdefault('PASSWORD_HASH_QUEUE_DEPTH', 16)
+    app.config.setdefault('PASSWORD_HASH_EXECUTOR', 'thread')
+    app.extensions['password_hasher'] = PasswordHasher(
+        workers=app.config['PASSWORD_HASH_WORKERS'],
+        queue_depth=app.config['PASSWORD_HASH_QUEUE_DEPTH'],
+        rounds=app.config['BCRYPT_LOG_ROUNDS'],
+        executor=app.config['PASSWORD_HASH_EXECUTOR'],
+    )
+
+
+def hash_password(password):
+    return current_app.extensions['password_hasher'].hash(password)
+
+
+def check_password(password, hashed):
+    return current_app.extensions['password_hasher'].check(password, hashed)
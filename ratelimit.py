@@ -0,0 +1,231 @@
+import math
+import time
+from collections import OrderedDict
+from threading import Lock
+
+import jwt
+from flask import current_app, g, request
+from flask_jwt_extended.exceptions import JWTExtendedException
+
+from auth import current_claims
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+# Endpoints with their own budget. Other GETs without URL arguments are
+# 'list' (collections and searches), everything else 'default'. Message
+# streams stay 'default' so their long-lived connections don't hold list
+# slots.
+ENDPOINT_BUDGETS = {
+    'userlogin': 'login',
+    'userregister': 'login',
+    'exportresource': 'export',
+    'exportdownloadresource': 'export',
+    'messagestreamresource': 'default',
+    'messagepollresource': 'default',
+}
+EXEMPT_ENDPOINTS = ('metrics',)
+# Login attempts are counted per address even with a token, so a stolen
+# token doesn't lift the budget for guessing other users' passwords.
+IP_BUDGETS = ('login',)
+# Logins also take from a budget for the account being logged into, so the
+# per-address budget can stay high enough for a school behind one NAT
+# address while guessing one user's password stays slow from any number of
+# addresses.
+ACCOUNT_BUDGETS = {'userlogin': 'login_account'}
+
+
+def parse_rate(value):
+    count, _, period = value.partition('/')
+    if period not in PERIODS or not count.strip().isdigit() or int(count) < 1:
+        raise ValueError(f"Invalid rate '{value}'; expected e.g. '100/minute'")
+    return int(count), PERIODS[period]
+
+
+def parse_multipliers(value):
+    multipliers = {}
+    for item in filter(None, (part.strip() for part in (value or '').split(','))):
+        role, _, factor = item.partition('=')
+        multipliers[role.strip()] = float(factor)
+    return multipliers
+
+
+# Anything that can take a token from a named bucket atomically can back the
+# limiter, e.g. a Redis script shared by all workers. Returns (allowed,
+# tokens left, seconds until the next token).
+class RateLimitBackend:
+    def take(self, key, capacity, rate):
+        raise NotImplementedError
+
+
+# Token buckets in this process's memory. The least recently used buckets
+# are dropped past `maxsize`; a dropped bucket starts full again, which only
+# ever errs towards letting a client through.
+class LocalBuckets(RateLimitBackend):
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = Lock()
+
+    def take(self, key, capacity, rate):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return allowed, int(tokens), 0.0 if allowed else (1 - tokens) / rate
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+# A budget of N requests per period is a bucket of N tokens refilled at
+# N/period a second, scaled by the caller's role multiplier. Concurrency caps
+# are per endpoint and per process, counted like the password hasher's
+# slots: a request over the cap is refused at once rather than queued.
+class RateLimiter:
+    def __init__(self, backend, budgets, multipliers=None, concurrency=None):
+        self.backend = backend
+        self.budgets = budgets
+        self.multipliers = multipliers or {}
+        self.concurrency = concurrency or {}
+        self._lock = Lock()
+        self._in_flight = {}
+        self.allowed = {}
+        self.limited = {}
+        self.shed = {}
+
+    def _count(self, counter, budget):
+        with self._lock:
+            counter[budget] = counter.get(budget, 0) + 1
+
+    # None if the request may go ahead, else the seconds to wait.
+    def take(self, budget, key, role=None):
+        count, period = self.budgets[budget]
+        capacity = count * self.multipliers.get(role, 1)
+        allowed, remaining, retry_after = self.backend.take(f'{budget}:{key}', capacity, capacity / period)
+        self._count(self.allowed if allowed else self.limited, budget)
+        return None if allowed else retry_after
+
+    def acquire(self, budget, endpoint):
+        cap = self.concurrency.get(budget)
+        if not cap:
+            return True
+        with self._lock:
+            in_flight = self._in_flight.get(endpoint, 0)
+            if in_flight >= cap:
+                self.shed[budget] = self.shed.get(budget, 0) + 1
+                return False
+            self._in_flight[endpoint] = in_flight + 1
+        return True
+
+    def release(self, endpoint):
+        with self._lock:
+            self._in_flight[endpoint] -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'allowed': dict(self.allowed),
+                'limited': dict(self.limited),
+                'shed': dict(self.shed),
+                'in_flight': dict(self._in_flight),
+            }
+
+
+def too_many_requests(retry_after):
+    seconds = max(1, math.ceil(retry_after))
+    return {'error': f'Rate limit exceeded, retry in {seconds}s'}, 429, {'Retry-After': str(seconds)}
+
+
+def budget_for(endpoint, method, view_args):
+    if endpoint in ENDPOINT_BUDGETS:
+        return ENDPOINT_BUDGETS[endpoint]
+    return 'list' if method == 'GET' and not view_args else 'default'
+
+
+# Authenticated callers are limited per user (and get their role's
+# multiplier), anonymous ones and bad tokens per client address. Behind a
+# proxy, wrap the app in werkzeug's ProxyFix so remote_addr is the client's.
+def _caller(budget):
+    if budget not in IP_BUDGETS:
+        try:
+            claims = current_claims()
+        except (JWTExtendedException, jwt.PyJWTError):
+            pass
+        else:
+            return f"user:{claims['sub']}", claims.get('role')
+    return f'ip:{request.remote_addr}', None
+
+
+# Keyed like find_user looks the account up: by email if given, else username.
+def _account():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return None
+    for field in ('email', 'username'):
+        if data.get(field):
+            return f'{field}:{data[field]}'
+    return None
+
+
+def _limit_request():
+    if request.method == 'OPTIONS' or request.endpoint in EXEMPT_ENDPOINTS:
+        return None
+    limiter = current_app.extensions['rate_limiter']
+    budget = budget_for(request.endpoint, request.method, request.view_args)
+    key, role = _caller(budget)
+    retry_after = limiter.take(budget, key, role)
+    if retry_after is not None:
+        return too_many_requests(retry_after)
+    account_budget = ACCOUNT_BUDGETS.get(request.endpoint)
+    account = account_budget and _account()
+    if account:
+        retry_after = limiter.take(account_budget, account)
+        if retry_after is not None:
+            return too_many_requests(retry_after)
+    endpoint = request.endpoint or 'unmatched'
+    if not limiter.acquire(budget, endpoint):
+        return {'error': 'Server is busy, try again shortly'}, 503, {'Retry-After': '1'}
+    if limiter.concurrency.get(budget):
+        g.rate_limit_slot = endpoint
+    return None
+
+
+# Runs when the request context is torn down, which for streamed responses
+# is after the last chunk, so a slot is held for the whole download.
+def _release_slot(exc):
+    endpoint = g.pop('rate_limit_slot', None)
+    if endpoint is not None:
+        current_app.extensions['rate_limiter'].release(endpoint)
+
+
+def init_app(app, backend=None):
+    app.config.setdefault('RATELIMIT_ENABLED', True)
+    app.config.setdefault('RATELIMIT_DEFAULT', '600/minute')
+    app.config.setdefault('RATELIMIT_LIST', '120/minute')
+    app.config.setdefault('RATELIMIT_EXPORT', '10/minute')
+    app.config.setdefault('RATELIMIT_LOGIN', '300/minute')
+    app.config.setdefault('RATELIMIT_LOGIN_ACCOUNT', '10/minute')
+    app.config.setdefault('RATELIMIT_ROLE_MULTIPLIERS', 'admin=4,teacher=2')
+    app.config.setdefault('RATELIMIT_LIST_CONCURRENCY', 8)
+    app.config.setdefault('RATELIMIT_EXPORT_CONCURRENCY', 2)
+    app.config.setdefault('RATELIMIT_STORAGE_SIZE', 100000)
+    if not app.config['RATELIMIT_ENABLED']:
+        app.extensions['rate_limiter'] = None
+        return
+    config = app.config
+    budgets = {name: parse_rate(config[f'RATELIMIT_{name.upper()}'])
+               for name in ('default', 'list', 'export', 'login', 'login_account')}
+    concurrency = {'list': config['RATELIMIT_LIST_CONCURRENCY'], 'export': config['RATELIMIT_EXPORT_CONCURRENCY']}
+    if backend is None:
+        backend = LocalBuckets(config['RATELIMIT_STORAGE_SIZE'])
+    app.extensions['rate_limiter'] = RateLimiter(
+        backend, budgets, parse_multipliers(config['RATELIMIT_ROLE_MULTIPLIERS']), concurrency,
+    )
+    app.before_request(_limit_request)
+    app.teardown_request(_release_slot)
@@ -0,0 +1,212 @@
+import click
+from flask import request
+from flask.cli import with_appcontext
+from sqlalchemy import delete, func, insert, select, tuple_
+
+from jobs import job_handler
+from models import db, ClassRanking, Grade, ReportCard, student_class
+
+# Terms by calendar month: Jan-Apr, May-Aug, Sep-Dec
+TERM_MONTHS = {1: 'T1', 2: 'T1', 3: 'T1', 4: 'T1', 5: 'T2', 6: 'T2', 7: 'T2', 8: 'T2',
+               9: 'T3', 10: 'T3', 11: 'T3', 12: 'T3'}
+UNDATED_TERM = 'undated'
+REFRESH_CHUNK_SIZE = 500
+
+
+def term_for(recorded_at):
+    if recorded_at is None:
+        return UNDATED_TERM
+    return f'{recorded_at.year}-{TERM_MONTHS[recorded_at.month]}'
+
+
+def _chunks(values, size):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _report_card_rows(grade_rows):
+    totals = {}
+    for student_id, subject_id, recorded_at, grade in grade_rows:
+        key = (student_id, subject_id, term_for(recorded_at))
+        count, total = totals.get(key, (0, 0.0))
+        totals[key] = (count + 1, total + grade)
+    return [
+        {'student_id': student_id, 'subject_id': subject_id, 'term': term,
+         'grade_count': count, 'grade_total': total, 'average': total / count}
+        for (student_id, subject_id, term), (count, total) in totals.items()
+    ]
+
+
+def _grade_rows(student_ids=None):
+    stmt = select(Grade.student_id, Grade.subject_id, Grade.recorded_at, Grade.grade).where(
+        Grade.student_id.isnot(None), Grade.grade.isnot(None),
+    )
+    if student_ids is not None:
+        stmt = stmt.where(Grade.student_id.in_(student_ids))
+    return db.session.execute(stmt.order_by(Grade.student_id).execution_options(yield_per=5000))
+
+
+# A student's overall term average is the mean of their subject averages;
+# ranks are computed per class and term with a window function.
+def _rank_classes(class_ids=None):
+    cards = ReportCard.__table__
+    overall = func.avg(cards.c.average)
+    ranked = (
+        select(
+            student_class.c.class_id,
+            cards.c.student_id,
+            cards.c.term,
+            overall,
+            func.count(),
+            func.rank().over(partition_by=(student_class.c.class_id, cards.c.term), order_by=overall.desc()),
+        )
+        .join_from(cards, student_class, student_class.c.student_id == cards.c.student_id)
+        .group_by(student_class.c.class_id, cards.c.student_id, cards.c.term)
+    )
+    rankings = ClassRanking.__table__
+    clear = delete(rankings)
+    if class_ids is not None:
+        ranked = ranked.where(student_class.c.class_id.in_(class_ids))
+        clear = clear.where(rankings.c.class_id.in_(class_ids))
+    db.session.execute(clear)
+    db.session.execute(insert(rankings).from_select(
+        ['class_id', 'student_id', 'term', 'average', 'subject_count', 'rank'], ranked,
+    ))
+
+
+# Incremental maintenance: recompute the report cards of just these students
+# from their grades (an indexed lookup), then re-rank only the classes they
+# belong to. Cost is proportional to the students' grades and class sizes,
+# not to the school.
+def refresh_students(student_ids):
+    student_ids = sorted({s for s in student_ids if s is not None})
+    if not student_ids:
+        return
+    cards = ReportCard.__table__
+    class_ids = set()
+    for chunk in _chunks(student_ids, REFRESH_CHUNK_SIZE):
+        db.session.execute(delete(cards).where(cards.c.student_id.in_(chunk)))
+        rows = _report_card_rows(_grade_rows(chunk))
+        if rows:
+            db.session.execute(insert(cards), rows)
+        class_ids.update(db.session.execute(
+            select(student_class.c.class_id).where(student_class.c.student_id.in_(chunk))
+        ).scalars())
+    if class_ids:
+        _rank_classes(sorted(class_ids))
+    db.session.commit()
+
+
+# Re-ranks classes whose enrolment changed, in the caller's transaction,
+# which must already have flushed the change.
+def refresh_classes(class_ids):
+    class_ids = sorted({c for c in class_ids if c is not None})
+    if class_ids:
+        _rank_classes(class_ids)
+
+
+# on_commit hook for the bulk grade endpoints
+def refresh_grade_rows(rows):
+    refresh_students(row.get('student_id') for row in rows)
+
+
+def rebuild_all():
+    cards = ReportCard.__table__
+    db.session.execute(delete(cards))
+    batch = []
+    current = None
+    student_grades = []
+    written = 0
+    # Grades arrive ordered by student, so one student's rows are aggregated
+    # at a time and memory stays bounded.
+    for row in _grade_rows():
+        if row[0] != current and student_grades:
+            batch.extend(_report_card_rows(student_grades))
+            student_grades = []
+            if len(batch) >= REFRESH_CHUNK_SIZE:
+                db.session.execute(insert(cards), batch)
+                written += len(batch)
+                batch = []
+        current = row[0]
+        student_grades.append(row)
+    batch.extend(_report_card_rows(student_grades))
+    if batch:
+        db.session.execute(insert(cards), batch)
+        written += len(batch)
+    _rank_classes()
+    db.session.commit()
+    return written
+
+
+@click.command('rebuild-report-cards')
+@with_appcontext
+def rebuild_report_cards_command():
+    """Recompute every report card and class ranking from the grades table."""
+    written = rebuild_all()
+    click.echo(f'Rebuilt {written} report cards')
+
+
+# POST /jobs {"kind": "rebuild_report_cards"}. One transaction, so there is
+# no progress to report until it is done.
+@job_handler('rebuild_report_cards', submittable=True)
+def rebuild_report_cards_job(payload, job):
+    return {'report_cards': rebuild_all()}
+
+
+def init_app(app):
+    app.cli.add_command(rebuild_report_cards_command)
+
+
+def _latest_term(model, column, value):
+    stmt = select(func.max(model.term)).where(column == value, model.term != UNDATED_TERM)
+    return db.session.execute(stmt).scalar()
+
+
+# Reads come straight off the (class_id, term, rank, student_id) index and
+# page by keyset, so a page costs O(page) whatever the school size.
+def class_rankings(class_id):
+    term = request.args.get('term') or _latest_term(ClassRanking, ClassRanking.class_id, class_id)
+    try:
+        limit = max(1, min(int(request.args.get('limit', 50)), 500))
+        after_rank = request.args.get('after_rank', type=int)
+        after_student_id = request.args.get('after_student_id', type=int)
+    except ValueError:
+        return {'error': "'limit' must be an integer"}, 400
+    if term is None:
+        return {'class_id': class_id, 'term': None, 'rankings': []}, 200
+
+    stmt = (
+        select(ClassRanking.student_id, ClassRanking.rank, ClassRanking.average, ClassRanking.subject_count)
+        .where(ClassRanking.class_id == class_id, ClassRanking.term == term)
+        .order_by(ClassRanking.rank, ClassRanking.student_id)
+        .limit(limit)
+    )
+    if after_rank is not None:
+        stmt = stmt.where(tuple_(ClassRanking.rank, ClassRanking.student_id) > (after_rank, after_student_id or 0))
+    rankings = [
+        {'student_id': student_id, 'rank': rank, 'average': average, 'subject_count': subject_count}
+        for student_id, rank, average, subject_count in db.session.execute(stmt)
+    ]
+    return {'class_id': class_id, 'term': term, 'rankings': rankings}, 200
+
+
+def report_card(student_id):
+    term = request.args.get('term') or _latest_term(ReportCard, ReportCard.student_id, student_id)
+    stmt = (
+        select(ReportCard.subject_id, ReportCard.grade_count, ReportCard.average)
+        .where(ReportCard.student_id == student_id, ReportCard.term == term)
+        .order_by(ReportCard.subject_id)
+    )
+    subjects = [
+        {'subject_id': subject_id, 'grade_count': count, 'average': average}
+        for subject_id, count, average in db.session.execute(stmt)
+    ]
+    ranks = [
+        {'class_id': class_id, 'rank': rank, 'average': average}
+        for class_id, rank, average in db.session.execute(
+            select(ClassRanking.class_id, ClassRanking.rank, ClassRanking.average)
+            .where(ClassRanking.student_id == student_id, ClassRanking.term == term)
+        )
+    ]
+    return {'student_id': student_id, 'term': term, 'subjects': subjects, 'class_ranks': ranks}, 200
@@ -0,0 +1,58 @@
+from flask import current_app, make_response
+from flask.json.provider import DefaultJSONProvider
+from flask_restful.representations.json import output_json as stdlib_output_json
+
+# orjson is optional (pip install orjson); without it responses are encoded
+# by the stdlib json module as before.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# app.json backed by orjson. It writes date, time and datetime values itself,
+# as the same ISO 8601 strings the serializers produce, so list rows go from
+# tuple to dict to JSON without converting each value in Python first.
+# Arguments orjson has no equivalent for fall back to the stdlib encoder.
+class FastJSONProvider(DefaultJSONProvider):
+    native_datetimes = True
+
+    def dumpb(self, obj, sort_keys=None, indent=False):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys if sort_keys is None else sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def dumps(self, obj, **kwargs):
+        if set(kwargs) - {'indent', 'separators'}:
+            return super().dumps(obj, **kwargs)
+        return self.dumpb(obj, indent=bool(kwargs.get('indent'))).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+
+def native_datetimes():
+    return getattr(current_app.json, 'native_datetimes', False)
+
+
+# Flask-RESTful representation for application/json. Keys keep the order
+# handlers put them in, as with Flask-RESTful's own encoder.
+def output_json(data, code, headers=None):
+    provider = current_app.json
+    if not isinstance(provider, FastJSONProvider):
+        return stdlib_output_json(data, code, headers)
+    response = make_response(provider.dumpb(data, sort_keys=False, indent=current_app.debug) + b'\n', code)
+    response.headers.extend(headers or {})
+    return response
+
+
+def init_app(app, api):
+    app.config.setdefault('FAST_JSON', True)
+    if orjson is not None and app.config['FAST_JSON']:
+        app.json = FastJSONProvider(app)
+    api.representations['application/json'] = output_json
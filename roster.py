@@ -0,0 +1,375 @@
+import csv
+import io
+import os
+import shutil
+import time
+import uuid
+from tempfile import NamedTemporaryFile
+
+import click
+from flask import current_app, request
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, insert, select, tuple_, update
+
+from auth import current_user_id
+from bulk import chunks, execute_chunk, group_by_keys, validator_for
+from jobs import JobFailed, accepted, enqueue, job_handler
+from models import db, Class, Student, Subject, Teacher, student_class, teacher_subject
+from reports import refresh_students
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+MAX_REPORTED_ERRORS = 1000
+
+
+# A roster file of one kind of record. People and classes are upserted on a
+# natural key (email or name); link files name both ends by those keys.
+class Entity:
+    def __init__(self, model, key, columns):
+        self.model = model
+        self.table = model.__table__
+        self.key = key
+        self.columns = columns
+        self.required = (key,)
+
+
+class Link:
+    def __init__(self, table, left, right, on_commit=None):
+        self.table = table
+        # (csv column, model, key column, link table column)
+        self.left = left
+        self.right = right
+        self.columns = (left[0], right[0])
+        self.required = self.columns
+        self.on_commit = on_commit
+
+
+def _refresh_enrolled(rows):
+    refresh_students(row['student_id'] for row in rows)
+
+
+KINDS = {
+    'students': Entity(Student, 'email', ('email', 'username', 'phone_number', 'grade')),
+    'teachers': Entity(Teacher, 'email', ('email', 'username', 'phone_number')),
+    'classes': Entity(Class, 'name', ('name', 'grade_level')),
+    'subjects': Entity(Subject, 'name', ('name', 'description')),
+    # Class rankings depend on enrolment, so they are refreshed per chunk
+    'enrollments': Link(student_class, ('student_email', Student, 'email', 'student_id'),
+                        ('class_name', Class, 'name', 'class_id'), on_commit=_refresh_enrolled),
+    'teacher_subjects': Link(teacher_subject, ('teacher_email', Teacher, 'email', 'teacher_id'),
+                             ('subject_name', Subject, 'name', 'subject_id')),
+}
+
+
+def _normalize(column, value):
+    value = value.strip()
+    return value.lower() if column == 'email' else value
+
+
+# Natural key -> id for every row of the table, loaded once per import so
+# rows are resolved without a query each.
+def _lookup(model, column):
+    key = getattr(model, column)
+    return {
+        _normalize(column, value): id_ for value, id_ in db.session.execute(select(key, model.id))
+        if value is not None
+    }
+
+
+def csv_rows(stream):
+    return csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+
+
+# openpyxl is optional (pip install openpyxl). Read-only mode streams the
+# sheet row by row instead of loading the workbook.
+def xlsx_rows(path):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError('Excel imports need openpyxl installed; upload a CSV instead')
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(cell).strip() if cell is not None else '' for cell in next(rows, ())]
+        for values in rows:
+            yield {name: '' if value is None else str(value) for name, value in zip(header, values)}
+    finally:
+        workbook.close()
+
+
+class RosterImport:
+    def __init__(self, kind, chunk_size=None):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown roster '{kind}'; expected {', '.join(KINDS)}")
+        self.kind = kind
+        self.spec = KINDS[kind]
+        self.chunk_size = chunk_size or current_app.config['BULK_CHUNK_SIZE']
+        self.stats = {'rows': 0, 'created': 0, 'updated': 0, 'unchanged': 0, 'failed': 0}
+        self.errors = []
+
+    def _check_header(self, header):
+        header = [name for name in header if name]
+        unknown = [name for name in header if name not in self.spec.columns]
+        missing = [name for name in self.spec.required if name not in header]
+        if unknown:
+            raise ValueError(f"Unknown column(s) for {self.kind}: {', '.join(unknown)}")
+        if missing:
+            raise ValueError(f"Missing column(s) for {self.kind}: {', '.join(missing)}")
+
+    # rows is an iterable of {column: text} dicts (csv.DictReader or
+    # xlsx_rows). Line numbers count the header as line 1. on_error is
+    # called with (line, error, row) for every rejected row, on_chunk with the
+    # running stats after every committed chunk.
+    def run(self, rows, on_error=None, on_chunk=None):
+        started = time.perf_counter()
+        spec = self.spec
+        rows = iter(rows)
+        first = next(rows, None)
+        header = list(first) if first is not None else list(getattr(rows, 'fieldnames', None) or ())
+        self._check_header(header)
+        self.on_error = on_error
+        if isinstance(spec, Entity):
+            self.lookup = _lookup(spec.model, spec.key)
+            self.seen = set()
+            process = self._upsert
+        else:
+            self.lookups = (_lookup(spec.left[1], spec.left[2]), _lookup(spec.right[1], spec.right[2]))
+            process = self._link
+        numbered = enumerate(rows if first is None else _prepend(first, rows), start=2)
+        for chunk in chunks(numbered, self.chunk_size):
+            self.stats['rows'] += len(chunk)
+            raw = dict(chunk)
+            failed = []
+            process(chunk, failed)
+            for error in failed:
+                self._fail(error['index'], error['error'], raw[error['index']])
+            if on_chunk is not None:
+                on_chunk(self.stats)
+        elapsed = time.perf_counter() - started
+        self.stats['seconds'] = round(elapsed, 3)
+        self.stats['rows_per_second'] = round(self.stats['rows'] / elapsed) if elapsed else None
+        return self.stats
+
+    def _fail(self, line, error, row):
+        self.stats['failed'] += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': error})
+        if self.on_error is not None:
+            self.on_error(line, error, row)
+
+    def _clean(self, line, row, failed):
+        row = {name: value.strip() for name, value in row.items() if name and value is not None and value.strip()}
+        missing = [name for name in self.spec.required if name not in row]
+        if missing:
+            failed.append({'index': line, 'error': f"missing {', '.join(missing)}"})
+            return None
+        return row
+
+    def _upsert(self, chunk, failed):
+        spec = self.spec
+        validator = validator_for(spec.model)
+        inserts, updates = [], []
+        for line, raw in chunk:
+            row = self._clean(line, raw, failed)
+            if row is None:
+                continue
+            row[spec.key] = _normalize(spec.key, row[spec.key])
+            if row[spec.key] in self.seen:
+                failed.append({'index': line, 'error': f"duplicate {spec.key} {row[spec.key]} in this file"})
+                continue
+            try:
+                row = validator.clean(row)
+            except ValueError as e:
+                failed.append({'index': line, 'error': str(e)})
+                continue
+            self.seen.add(row[spec.key])
+            existing_id = self.lookup.get(row[spec.key])
+            if existing_id is None:
+                inserts.append((line, row))
+            else:
+                updates.append((line, {'_id': existing_id, **row}))
+
+        table = spec.table
+        for group in group_by_keys(inserts).values():
+            self.stats['created'] += execute_chunk(insert(table), group, failed)
+        if inserts:
+            key = table.c[spec.key]
+            new_keys = [row[spec.key] for _, row in inserts]
+            self.lookup.update(db.session.execute(select(key, table.c.id).where(key.in_(new_keys))).all())
+        for keys, group in group_by_keys(updates).items():
+            stmt = update(table).where(table.c.id == bindparam('_id')).values(
+                {k: bindparam(k) for k in keys if k != '_id'}
+            )
+            self.stats['updated'] += execute_chunk(stmt, group, failed)
+
+    def _link(self, chunk, failed):
+        spec = self.spec
+        left_lookup, right_lookup = self.lookups
+        links = []
+        for line, raw in chunk:
+            row = self._clean(line, raw, failed)
+            if row is None:
+                continue
+            left = left_lookup.get(_normalize(spec.left[2], row[spec.left[0]]))
+            right = right_lookup.get(_normalize(spec.right[2], row[spec.right[0]]))
+            if left is None or right is None:
+                column = spec.left[0] if left is None else spec.right[0]
+                failed.append({'index': line, 'error': f'unknown {column} {row[column]}'})
+                continue
+            links.append((line, {spec.left[3]: left, spec.right[3]: right}))
+        if not links:
+            return
+
+        table = spec.table
+        left_column, right_column = table.c[spec.left[3]], table.c[spec.right[3]]
+        wanted = {(row[spec.left[3]], row[spec.right[3]]) for _, row in links}
+        existing = set(db.session.execute(
+            select(left_column, right_column).where(tuple_(left_column, right_column).in_(wanted))
+        ).all())
+        new = []
+        for line, row in links:
+            key = (row[spec.left[3]], row[spec.right[3]])
+            if key in existing:
+                self.stats['unchanged'] += 1
+            else:
+                existing.add(key)
+                new.append((line, row))
+        written = execute_chunk(insert(table), new, failed)
+        self.stats['created'] += written
+        if written and spec.on_commit is not None:
+            spec.on_commit([row for _, row in new])
+
+
+def _prepend(first, rows):
+    yield first
+    yield from rows
+
+
+def _is_xlsx(filename, mimetype):
+    return mimetype == XLSX_MIMETYPE or (filename or '').lower().endswith('.xlsx')
+
+
+# POST /imports/<kind> with a text/csv body, or a multipart `file` (CSV or
+# .xlsx). The body is parsed as it streams in; rejected rows come back as
+# errors with their line numbers. With ?async=true the file is stored and
+# imported by a job instead (202, poll the job in Location).
+def import_roster(kind):
+    if kind not in KINDS:
+        return {'error': f"Unknown roster '{kind}'; expected {', '.join(KINDS)}"}, 404
+    if request.args.get('async', '').lower() in ('1', 'true', 'yes'):
+        return _queue_import(kind)
+    roster = RosterImport(kind)
+    try:
+        if request.mimetype == 'multipart/form-data':
+            upload = request.files.get('file')
+            if upload is None:
+                return {'error': "'file' is required"}, 400
+            if _is_xlsx(upload.filename, upload.mimetype):
+                with NamedTemporaryFile(suffix='.xlsx') as spooled:
+                    upload.save(spooled)
+                    spooled.flush()
+                    stats = roster.run(xlsx_rows(spooled.name))
+            else:
+                stats = roster.run(csv_rows(upload.stream))
+        elif request.mimetype == XLSX_MIMETYPE:
+            with NamedTemporaryFile(suffix='.xlsx') as spooled:
+                while block := request.stream.read(1024 * 1024):
+                    spooled.write(block)
+                spooled.flush()
+                stats = roster.run(xlsx_rows(spooled.name))
+        else:
+            stats = roster.run(csv_rows(request.stream))
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        db.session.rollback()
+        # Chunks before the failure stay committed; the counts say how far it got
+        return {'error': str(e), **roster.stats}, 400
+    body = {'kind': kind, **stats, 'errors': roster.errors}
+    if stats['failed'] and not (stats['created'] or stats['updated'] or stats['unchanged']):
+        return body, 400
+    return body, 207 if stats['failed'] else 200
+
+
+# Stored under UPLOAD_FOLDER/jobs, which the worker processes share with the
+# web workers.
+def _queue_import(kind):
+    upload = None
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('file')
+        if upload is None:
+            return {'error': "'file' is required"}, 400
+        xlsx = _is_xlsx(upload.filename, upload.mimetype)
+    else:
+        xlsx = request.mimetype == XLSX_MIMETYPE
+    path = os.path.join(current_app.config['UPLOAD_FOLDER'], 'jobs', uuid.uuid4().hex + ('.xlsx' if xlsx else '.csv'))
+    if upload is not None:
+        upload.save(path)
+    else:
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(request.stream, f, 1024 * 1024)
+    job = enqueue('import_roster', {'kind': kind, 'path': path}, user_id=current_user_id())
+    db.session.commit()
+    return accepted(job)
+
+
+# A file that can't be parsed fails the job at once; database errors are
+# retried, and re-importing is safe because rows are upserted.
+@job_handler('import_roster')
+def import_roster_job(payload, job):
+    path = payload['path']
+    roster = RosterImport(payload['kind'])
+
+    def on_chunk(stats):
+        job.progress(stats['rows'])
+
+    try:
+        if path.endswith('.xlsx'):
+            stats = roster.run(xlsx_rows(path), on_chunk=on_chunk)
+        else:
+            with open(path, 'rb') as f:
+                stats = roster.run(csv_rows(f), on_chunk=on_chunk)
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        db.session.rollback()
+        os.remove(path)
+        raise JobFailed(str(e))
+    os.remove(path)
+    return {'kind': payload['kind'], **stats, 'errors': roster.errors}
+
+
+@click.command('import-roster')
+@click.argument('kind', type=click.Choice(list(KINDS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--errors', 'errors_path', type=click.Path(dir_okay=False),
+              help='Where to write rejected rows (default: PATH.errors.csv).')
+@click.option('--chunk-size', type=int, help='Rows per transaction.')
+@with_appcontext
+def import_roster_command(kind, path, errors_path, chunk_size):
+    """Upsert students, teachers, classes, subjects or their links from a CSV or .xlsx file."""
+    roster = RosterImport(kind, chunk_size)
+    errors_path = errors_path or f'{os.path.splitext(path)[0]}.errors.csv'
+    columns = ['line', 'error', *roster.spec.columns]
+    with open(errors_path, 'w', newline='') as errors_file:
+        writer = csv.DictWriter(errors_file, columns, extrasaction='ignore')
+        writer.writeheader()
+
+        def on_error(line, error, row):
+            writer.writerow({**row, 'line': line, 'error': error})
+
+        try:
+            if _is_xlsx(path, None):
+                stats = roster.run(xlsx_rows(path), on_error)
+            else:
+                with open(path, 'rb') as f:
+                    stats = roster.run(csv_rows(f), on_error)
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            stats = None
+            message = str(e)
+    if not (stats and stats['failed']):
+        os.remove(errors_path)
+    if stats is None:
+        raise click.ClickException(message)
+    click.echo(f"{stats['rows']} rows in {stats['seconds']}s ({stats['rows_per_second']} rows/s): "
+               f"{stats['created']} created, {stats['updated']} updated, {stats['unchanged']} unchanged, "
+               f"{stats['failed']} failed" + (f' (see {errors_path})' if stats['failed'] else ''))
+
+
+def init_app(app):
+    app.cli.add_command(import_roster_command)
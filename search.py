@@ -0,0 +1,166 @@
+import re
+
+from flask import current_app, request
+from sqlalchemy import DDL, event, or_, select, text
+
+from models import db, Book, File, Forum, Link, News
+
+# Searchable tables: (type, model, title column, body column). Each gets an
+# external-content FTS5 table, <table>_fts, holding only the index; the text
+# itself stays in the source table.
+SOURCES = (
+    ('news', News, 'title', 'content'),
+    ('forums', Forum, 'name', 'description'),
+    ('files', File, 'name', 'description'),
+    ('links', Link, 'name', 'description'),
+    ('books', Book, 'title', 'author'),
+)
+TITLE_WEIGHT = 10.0
+SNIPPET_TOKENS = 12
+
+_TERM = re.compile(r'(\w+)(\*?)', re.UNICODE)
+_LIKE_SPECIAL = re.compile(r'([\\%_])')
+
+
+def fts_table(model):
+    return f'{model.__tablename__}_fts'
+
+
+# Triggers rather than ORM events keep the index in step with every write,
+# including the Core executemany inserts of the bulk endpoints.
+def create_statements(model, title, body):
+    table, fts = model.__tablename__, fts_table(model)
+    insert_row = f"INSERT INTO {fts}(rowid, {title}, {body}) VALUES (new.id, new.{title}, new.{body});"
+    delete_row = (f"INSERT INTO {fts}({fts}, rowid, {title}, {body}) "
+                  f"VALUES ('delete', old.id, old.{title}, old.{body});")
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"{title}, {body}, content='{table}', content_rowid='id', prefix='2 3', tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN {insert_row} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN {delete_row} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {title}, {body} ON {table} "
+        f"BEGIN {delete_row} {insert_row} END",
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ]
+
+
+def _register_ddl():
+    for _, model, title, body in SOURCES:
+        table = model.__table__
+        for statement in create_statements(model, title, body):
+            event.listen(table, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+        event.listen(table, 'before_drop', DDL(f'DROP TABLE IF EXISTS {fts_table(model)}').execute_if(dialect='sqlite'))
+
+
+_register_ddl()
+
+
+# User input becomes a conjunction of quoted terms, so FTS5 operators and
+# stray punctuation can't produce syntax errors; a trailing * on a term is
+# kept as a prefix match.
+def fts_query(q):
+    terms = [f'"{word}"{star}' for word, star in _TERM.findall(q or '')]
+    return ' '.join(terms)
+
+
+def _parse_types():
+    value = request.args.get('type')
+    known = [name for name, *_ in SOURCES]
+    if not value:
+        return known
+    types = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in types if name not in known]
+    if unknown:
+        raise ValueError(f"Unknown type(s): {', '.join(unknown)}; expected {', '.join(known)}")
+    return types
+
+
+# Ranking has to score every match, which is what makes a term found in most
+# documents slow. When a query matches more rows than the rank window only
+# the newest window of them is ranked: the rowid floor is found by walking
+# the doclist backwards, and FTS5 seeks straight past everything below it.
+def _fts_hits(name, model, title, depth, match, window):
+    fts = fts_table(model)
+    floor = ''
+    if window:
+        floor = (f"AND rowid >= coalesce((SELECT rowid FROM {fts} WHERE {fts} MATCH :q "
+                 f"ORDER BY rowid DESC LIMIT 1 OFFSET :window), 0) ")
+    # bm25() is lower-is-better; the title column is weighted above the body
+    stmt = text(
+        f"SELECT rowid, {title}, snippet({fts}, -1, '<mark>', '</mark>', '…', {SNIPPET_TOKENS}), "
+        f"bm25({fts}, {TITLE_WEIGHT}, 1.0) AS score "
+        f"FROM {fts} WHERE {fts} MATCH :q {floor}ORDER BY score LIMIT :depth"
+    )
+    params = {'q': match, 'depth': depth, 'window': window - 1}
+    return [
+        {'type': name, 'id': row_id, 'title': title_text, 'snippet': snippet, 'score': -score}
+        for row_id, title_text, snippet, score in db.session.execute(stmt, params)
+    ]
+
+
+# A LIKE pattern matching `word` anywhere, with LIKE's wildcards (\w
+# matches '_') escaped by a backslash.
+def like_pattern(word):
+    return '%' + _LIKE_SPECIAL.sub(r'\\\1', word) + '%'
+
+
+# Servers without FTS5 get an unranked substring match so the endpoint still
+# works; it scans the tables and is meant for small deployments.
+def _like_hits(name, model, title, body, depth, q):
+    title_column, body_column = getattr(model, title), getattr(model, body)
+    patterns = [like_pattern(word) for word, _ in _TERM.findall(q)]
+    stmt = select(model.id, title_column, body_column).where(
+        *[or_(title_column.ilike(pattern, escape='\\'), body_column.ilike(pattern, escape='\\'))
+          for pattern in patterns]
+    ).order_by(model.id).limit(depth)
+    return [
+        {'type': name, 'id': row_id, 'title': title_text, 'snippet': (body_text or '')[:200], 'score': 0.0}
+        for row_id, title_text, body_text in db.session.execute(stmt)
+    ]
+
+
+# /search?q=&type=news,books&limit=&offset=. Each type is ranked inside the
+# FTS index and only its top offset+limit+1 hits are read, then the types are
+# merged by score, so a page costs O(offset + limit) rows per type however
+# large the corpus is.
+def search():
+    q = request.args.get('q', '')
+    match = fts_query(q)
+    if not match:
+        return {'error': "'q' must contain at least one word"}, 400
+    try:
+        types = _parse_types()
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), current_app.config['PAGE_SIZE_MAX'])
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        return {'error': "'limit' and 'offset' must be integers"}, 400
+    if offset + limit > current_app.config['SEARCH_MAX_RESULTS']:
+        return {'error': f"Results are limited to the first {current_app.config['SEARCH_MAX_RESULTS']} matches"}, 400
+
+    depth = offset + limit + 1
+    # The rank window is shared between the searched types, bounding the
+    # work per request rather than per table. It never drops below the page
+    # being read, but matches older than the window are not ranked at all:
+    # for a very common term an old, highly relevant hit can be missing from
+    # every page, which is the price of a bounded ranking cost
+    window = current_app.config['SEARCH_RANK_WINDOW']
+    if window:
+        window = max(window // len(types), depth)
+    sqlite = db.engine.dialect.name == 'sqlite'
+    hits = []
+    for name, model, title, body in SOURCES:
+        if name not in types:
+            continue
+        if sqlite:
+            hits.extend(_fts_hits(name, model, title, depth, match, window))
+        else:
+            hits.extend(_like_hits(name, model, title, body, depth, q))
+    hits.sort(key=lambda hit: (-hit['score'], hit['type'], hit['id']))
+    page = hits[offset:offset + limit]
+    body = {'query': q, 'offset': offset, 'limit': limit, 'results': page}
+    if len(hits) > offset + limit:
+        body['next_offset'] = offset + limit
+    return body, 200
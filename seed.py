@@ -0,0 +1,298 @@
+import random
+import time
+from datetime import date, datetime, time as clock, timedelta
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func, insert, select
+
+from bulk import chunks
+from models import (db, Book, CheckoutRecord, Class, Club, Event, File, Forum, Grade, Library, Link, Message,
+                    MessageRecipient, News, Schedule, Sports, SportsEvent, Student, Subject, Teacher, User,
+                    club_member, student_class, teacher_subject)
+from passwords import hash_password
+from reports import rebuild_all
+
+# Row counts at --scale 1, roughly a large district: 50k students, 5M grades,
+# 500k checkout records and 1M messages. Everything else follows from these.
+COUNTS = {
+    'students': 50000,
+    'teachers': 2500,
+    'grades': 5000000,
+    'books': 20000,
+    'checkouts': 500000,
+    'messages': 1000000,
+    'news': 5000,
+    'events': 2000,
+    'files': 20000,
+    'links': 20000,
+    'forums': 2000,
+}
+SUBJECTS = ['Mathematics', 'English', 'Kiswahili', 'Physics', 'Chemistry', 'Biology', 'History', 'Geography',
+            'Religious Education', 'Computer Studies', 'Agriculture', 'Business Studies', 'Art', 'Music',
+            'French', 'German', 'Home Science', 'Physical Education']
+FIRST_NAMES = ['Amani', 'Baraka', 'Chege', 'Daudi', 'Eliud', 'Faith', 'Grace', 'Halima', 'Imani', 'Jabari',
+               'Kamau', 'Lulu', 'Mwangi', 'Neema', 'Otieno', 'Pendo', 'Rehema', 'Salim', 'Tumaini', 'Wanjiru',
+               'Zawadi', 'Achieng', 'Kibet', 'Njeri', 'Omondi', 'Wambui', 'Mutua', 'Nafula', 'Chebet', 'Kipchoge']
+WORDS = ('school term exam results library club match trip parents meeting science fair sports day music '
+         'festival revision timetable holiday assembly homework project reading practice notes chapter').split()
+ROOMS = [f'Room {i}' for i in range(1, 61)] + ['Lab 1', 'Lab 2', 'Lab 3', 'Hall', 'Library', 'Field']
+PASSWORD = 'password'
+BATCH_SIZE = 10000
+
+
+def counts_for(scale, **overrides):
+    counts = {name: max(1, int(count * scale)) for name, count in COUNTS.items()}
+    counts.update({name: count for name, count in overrides.items() if count is not None})
+    return counts
+
+
+def _text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def _name(rng, i):
+    return f'{rng.choice(FIRST_NAMES)} {rng.choice(FIRST_NAMES)} {i}'
+
+
+def _moment(rng, start, days):
+    return start + timedelta(seconds=rng.randrange(days * 86400))
+
+
+# Tables are written with executemany in BATCH_SIZE batches and committed
+# once each. Ids are assigned 1..n in insert order, which the generators rely
+# on to point foreign keys at rows that exist.
+def _insert(table, rows, label=None):
+    started = time.perf_counter()
+    written = 0
+    for batch in chunks(rows, BATCH_SIZE):
+        db.session.execute(insert(table), batch)
+        written += len(batch)
+    db.session.commit()
+    elapsed = time.perf_counter() - started
+    click.echo(f'{label or table.name:<20} {written:>10} rows {elapsed:>7.1f}s '
+               f'({written / elapsed if elapsed else 0:,.0f} rows/s)')
+    return written
+
+
+def _people(rng, counts, password, start):
+    users = []
+    for kind, count in (('student', counts['students']), ('teacher', counts['teachers']), ('admin', 10)):
+        for i in range(1, count + 1):
+            users.append({'email': f'{kind}{i}@school.test', 'username': f'{kind}{i}', 'password': password,
+                          'role': kind, 'created_at': _moment(rng, start, 365)})
+    _insert(User.__table__, users)
+    _insert(Student.__table__, (
+        {'username': f'student{i}', 'email': f'student{i}@school.test', 'password': password,
+         'phone_number': 700000000 + i, 'created_at': _moment(rng, start, 365), 'role': 'student',
+         'grade': rng.randint(1, 12)}
+        for i in range(1, counts['students'] + 1)
+    ))
+    _insert(Teacher.__table__, (
+        {'username': f'teacher{i}', 'email': f'teacher{i}@school.test', 'password': password,
+         'phone_number': 720000000 + i, 'created_at': _moment(rng, start, 365), 'role': 'teacher'}
+        for i in range(1, counts['teachers'] + 1)
+    ))
+    return len(users)
+
+
+# One stream of 30-35 students per class, grade levels 1-12
+def _classes(rng, counts):
+    grades = dict(db.session.execute(select(Student.id, Student.grade)).all())
+    by_level = {}
+    for student_id, level in grades.items():
+        by_level.setdefault(level, []).append(student_id)
+    classes, enrollments = [], []
+    for level in sorted(by_level):
+        students = by_level[level]
+        rng.shuffle(students)
+        streams = max(1, len(students) // 32)
+        for stream in range(streams):
+            classes.append({'name': f'{level}{chr(ord("A") + stream % 26)}{stream // 26 or ""}',
+                            'grade_level': level})
+            class_id = len(classes)
+            enrollments.extend({'student_id': student_id, 'class_id': class_id}
+                               for student_id in students[stream::streams])
+    _insert(Class.__table__, classes)
+    _insert(student_class, enrollments, 'enrollments')
+    return len(classes)
+
+
+def _curriculum(rng, counts, class_count, start):
+    _insert(Subject.__table__, ({'name': name, 'description': _text(rng, 8)} for name in SUBJECTS))
+    subject_ids = range(1, len(SUBJECTS) + 1)
+    teaching = {}
+    for teacher_id in range(1, counts['teachers'] + 1):
+        teaching[teacher_id] = rng.sample(subject_ids, 2)
+    _insert(teacher_subject, ({'teacher_id': teacher_id, 'subject_id': subject_id}
+                              for teacher_id, subjects in teaching.items() for subject_id in subjects),
+            'teacher_subjects')
+    teachers_of = {}
+    for teacher_id, subjects in teaching.items():
+        for subject_id in subjects:
+            teachers_of.setdefault(subject_id, []).append(teacher_id)
+    monday = start - timedelta(days=start.weekday())
+
+    # A week of six lessons a day per class
+    def lessons():
+        for class_id in range(1, class_count + 1):
+            for day in range(5):
+                for period in range(6):
+                    subject_id = rng.choice(subject_ids)
+                    yield {'class_id': class_id, 'subject_id': subject_id,
+                           'teacher_id': rng.choice(teachers_of.get(subject_id) or [None]),
+                           'location': rng.choice(ROOMS),
+                           'class_time': monday + timedelta(days=day, hours=8 + period)}
+
+    _insert(Schedule.__table__, lessons())
+
+
+# Marks are normally distributed around each student's own ability, spread
+# over the three terms of the year.
+def _grades(rng, counts, start):
+    students = counts['students']
+    ability = [rng.gauss(62, 12) for _ in range(students + 1)]
+    subject_count = len(SUBJECTS)
+
+    def rows():
+        for _ in range(counts['grades']):
+            student_id = rng.randint(1, students)
+            yield {'student_id': student_id, 'subject_id': rng.randint(1, subject_count),
+                   'grade': round(min(100.0, max(0.0, rng.gauss(ability[student_id], 10))), 1),
+                   'recorded_at': _moment(rng, start, 330)}
+
+    _insert(Grade.__table__, rows())
+
+
+def _library(rng, counts, user_count, today):
+    _insert(Library.__table__, ({'name': name, 'description': _text(rng, 6)}
+                                for name in ('Main Library', 'Junior Library', 'Science Library')))
+    _insert(Book.__table__, (
+        {'title': _text(rng, 3).title(), 'author': _name(rng, i), 'library_id': rng.randint(1, 3),
+         'copies': rng.choice((1, 1, 2, 3, 5))}
+        for i in range(1, counts['books'] + 1)
+    ))
+
+    # Returned loans over the past two years, plus a few percent still out
+    # (some of them overdue)
+    def loans():
+        for _ in range(counts['checkouts']):
+            checkout_date = today - timedelta(days=rng.randint(0, 730))
+            due_date = checkout_date + timedelta(days=14)
+            returned = checkout_date + timedelta(days=rng.randint(1, 30))
+            still_out = returned > today or rng.random() < 0.01
+            yield {'book_id': rng.randint(1, counts['books']), 'user_id': rng.randint(1, user_count),
+                   'checkout_date': checkout_date, 'due_date': due_date,
+                   'returned_date': None if still_out else returned,
+                   'fine_amount': round(max(0, (returned - due_date).days) * 0.1, 2) if not still_out else 0.0}
+
+    _insert(CheckoutRecord.__table__, loans(), 'checkout_records')
+
+
+# Messages between users, a third of them replies in an existing thread,
+# each with one to three recipients; most older messages have been read.
+def _messages(rng, counts, user_count, start):
+    message_count = counts['messages']
+    sent = sorted(_moment(rng, start, 365) for _ in range(message_count))
+    now = start + timedelta(days=365)
+
+    def messages():
+        roots = []
+        for i, sent_at in enumerate(sent, start=1):
+            thread_id = None
+            if roots and rng.random() < 0.33:
+                thread_id = rng.choice(roots[-1000:])
+            else:
+                roots.append(i)
+            yield {'sender_id': rng.randint(1, user_count), 'thread_id': thread_id,
+                   'content': _text(rng, rng.randint(5, 40)), 'sent_at': sent_at}
+
+    def recipients():
+        for i, sent_at in enumerate(sent, start=1):
+            for recipient_id in set(rng.randint(1, user_count) for _ in range(rng.randint(1, 3))):
+                read = rng.random() < 0.9 and (now - sent_at).days > 2
+                yield {'message_id': i, 'recipient_id': recipient_id, 'sent_at': sent_at,
+                       'read_at': sent_at + timedelta(hours=rng.randint(1, 48)) if read else None}
+
+    _insert(Message.__table__, messages())
+    _insert(MessageRecipient.__table__, recipients())
+
+
+def _content(rng, counts, user_count, start):
+    subject_count = len(SUBJECTS)
+    _insert(News.__table__, ({'title': _text(rng, 6).capitalize(), 'content': _text(rng, 120),
+                              'created_at': _moment(rng, start, 365)} for _ in range(counts['news'])))
+    _insert(Event.__table__, ({'name': _text(rng, 3).title(), 'date': _moment(rng, start, 365).date(),
+                               'time': clock(rng.randint(8, 17)), 'location': rng.choice(ROOMS),
+                               'description': _text(rng, 30)} for _ in range(counts['events'])))
+    _insert(File.__table__, ({'name': f'{_text(rng, 2).replace(" ", "-")}-{i}.pdf', 'file_path': f'/files/{i}.pdf',
+                              'description': _text(rng, 20), 'subject_id': rng.randint(1, subject_count)}
+                             for i in range(1, counts['files'] + 1)))
+    _insert(Link.__table__, ({'name': _text(rng, 4).capitalize(), 'url': f'https://example.test/resources/{i}',
+                              'description': _text(rng, 15), 'subject_id': rng.randint(1, subject_count)}
+                             for i in range(1, counts['links'] + 1)))
+    _insert(Forum.__table__, ({'name': _text(rng, 4).capitalize(), 'description': _text(rng, 25),
+                               'subject_id': rng.randint(1, subject_count)} for _ in range(counts['forums'])))
+    clubs = max(5, counts['students'] // 500)
+    _insert(Club.__table__, ({'name': f'{_text(rng, 1).title()} Club {i}', 'description': _text(rng, 15)}
+                             for i in range(1, clubs + 1)))
+    _insert(club_member, ({'club_id': club_id, 'user_id': user_id}
+                          for user_id in range(1, user_count + 1) if rng.random() < 0.2
+                          for club_id in rng.sample(range(1, clubs + 1), rng.randint(1, min(2, clubs)))),
+            'club_members')
+    sports = ['Football', 'Athletics', 'Basketball', 'Volleyball', 'Netball', 'Rugby', 'Hockey', 'Swimming']
+    _insert(Sports.__table__, ({'name': name, 'description': _text(rng, 10)} for name in sports))
+    _insert(SportsEvent.__table__, ({'name': f'{rng.choice(sports)} {_text(rng, 2)}',
+                                     'date': _moment(rng, start, 365).date(), 'time': clock(rng.randint(8, 17)),
+                                     'location': rng.choice(ROOMS), 'sport_id': rng.randint(1, len(sports))}
+                                    for _ in range(max(10, counts['events'] // 2))))
+
+
+# Fills an empty database with a synthetic school. Every user, student and
+# teacher can log in as <role><n>@school.test with PASSWORD (admin1..admin10
+# are admins).
+def seed(counts, rng_seed=0, today=None):
+    if db.session.execute(select(func.count()).select_from(User)).scalar():
+        raise click.ClickException('The database already has users; seed an empty one or pass --reset')
+    rng = random.Random(rng_seed)
+    today = today or date.today()
+    start = datetime.combine(today - timedelta(days=365), clock())
+    password = hash_password(PASSWORD)
+    user_count = _people(rng, counts, password, start)
+    class_count = _classes(rng, counts)
+    _curriculum(rng, counts, class_count, start)
+    _grades(rng, counts, start)
+    _library(rng, counts, user_count, today)
+    _messages(rng, counts, user_count, start)
+    _content(rng, counts, user_count, start)
+    started = time.perf_counter()
+    written = rebuild_all()
+    click.echo(f'{"report_cards":<20} {written:>10} rows {time.perf_counter() - started:>7.1f}s (rebuilt)')
+
+
+@click.command('seed')
+@click.option('--scale', type=float, default=0.02, show_default=True,
+              help='Fraction of a 50k-student district to generate (1 = 5M grades, 1M messages).')
+@click.option('--students', type=int)
+@click.option('--teachers', type=int)
+@click.option('--grades', type=int)
+@click.option('--books', type=int)
+@click.option('--checkouts', type=int)
+@click.option('--messages', type=int)
+@click.option('--seed', 'rng_seed', type=int, default=0, help='Random seed, for repeatable data.')
+@click.option('--reset', is_flag=True, help='Drop and recreate every table first.')
+@with_appcontext
+def seed_command(scale, students, teachers, grades, books, checkouts, messages, rng_seed, reset):
+    """Fill the database with synthetic students, grades, loans, messages and the rest."""
+    if reset:
+        db.drop_all()
+        db.create_all()
+    counts = counts_for(scale, students=students, teachers=teachers, grades=grades, books=books,
+                        checkouts=checkouts, messages=messages)
+    started = time.perf_counter()
+    seed(counts, rng_seed)
+    click.echo(f'Seeded in {time.perf_counter() - started:.1f}s; log in as admin1@school.test / {PASSWORD}')
+
+
+def init_app(app):
+    app.cli.add_command(seed_command)
@@ -0,0 +1,83 @@
+from sqlalchemy import Date, DateTime, Time, select
+
+# Column names that are never sent to clients, whatever the model.
+SENSITIVE_FIELDS = ('password',)
+
+
+def _isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+def _converter(column):
+    if isinstance(column.type, (Date, DateTime, Time)):
+        return _isoformat
+    return None
+
+
+# Column-projected serializer for one model. The column list and the
+# per-column converters are worked out once, when the models module is
+# imported, so serializing a row is a zip over a tuple. List endpoints select
+# only the requested columns through Core and never build ORM instances.
+class ModelSerializer:
+    def __init__(self, model, exclude=()):
+        self.model = model
+        exclude = set(exclude) | set(SENSITIVE_FIELDS)
+        self.columns = [c for c in model.__table__.columns if c.key not in exclude]
+        self.by_name = {c.key: c for c in self.columns}
+        self.names = tuple(self.by_name)
+        self.converters = {c.key: _converter(c) for c in self.columns}
+
+    def parse_fields(self, value):
+        if not value:
+            return self.names
+        requested = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = [name for name in requested if name not in self.by_name]
+        if unknown:
+            raise ValueError(f"Unknown field(s) for {self.model.__tablename__}: {', '.join(unknown)}")
+        # The primary key always comes first so clients can page and link rows.
+        return ('id',) + tuple(dict.fromkeys(name for name in requested if name != 'id'))
+
+    def select(self, fields=None):
+        fields = fields or self.names
+        return select(*(self.by_name[name] for name in fields))
+
+    # With convert=False temporal values are left for the JSON encoder to
+    # write (see representations.FastJSONProvider).
+    def row_factory(self, fields=None, convert=True):
+        fields = fields or self.names
+        converted = [(i, self.converters[name]) for i, name in enumerate(fields) if convert and self.converters[name]]
+        if not converted:
+            return lambda row: dict(zip(fields, row))
+
+        def to_dict(row):
+            values = list(row)
+            for i, convert in converted:
+                values[i] = convert(values[i])
+            return dict(zip(fields, values))
+
+        return to_dict
+
+    def dump(self, obj, fields=None):
+        converters = self.converters
+        return {
+            name: converters[name](getattr(obj, name)) if converters[name] else getattr(obj, name)
+            for name in (fields or self.names)
+        }
+
+
+_serializers = {}
+
+
+def register_serializers(base):
+    for mapper in base.registry.mappers:
+        model = mapper.class_
+        _serializers[model] = ModelSerializer(model, getattr(model, '__serialize_exclude__', ()))
+
+
+def serializer_for(model):
+    return _serializers[model]
+
+
+class SerializerMixin:
+    def to_dict(self):
+        return serializer_for(type(self)).dump(self)
@@ -0,0 +1,150 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flask_jwt_extended import create_access_token  # noqa: E402
+
+from app import create_app  # noqa: E402
+from config import Config  # noqa: E402
+from messages import LocalBroker  # noqa: E402
+from models import db, User  # noqa: E402
+
+
+def config_for(tmp_path):
+    class TestConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path}/test.db'
+        UPLOAD_FOLDER = str(tmp_path / 'uploads')
+        RATELIMIT_ENABLED = False
+        METRICS_ENABLED = False
+        RESPONSE_CACHE_ENABLED = False
+        MESSAGE_BROKER_POLL_SECONDS = 0.05
+
+    return TestConfig
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app(config_for(tmp_path))
+    with app.app_context():
+        db.session.add_all([
+            User(id=user_id, email=f'{name}@example.com', username=name, password='x', role='teacher')
+            for user_id, name in ((1, 'alice'), (2, 'bob'), (3, 'carol'))
+        ])
+        db.session.commit()
+    yield app
+    app.extensions['message_broker'].stop()
+    with app.app_context():
+        db.engine.dispose()
+
+
+@pytest.fixture
+def headers(app):
+    with app.app_context():
+        tokens = {user_id: create_access_token(identity=user_id, additional_claims={'role': 'teacher'})
+                  for user_id in (1, 2, 3)}
+    return {user_id: {'Authorization': f'Bearer {token}'} for user_id, token in tokens.items()}
+
+
+def send(client, headers, sender, recipients, content):
+    response = client.post('/messages', json={'recipient_ids': recipients, 'content': content},
+                           headers=headers[sender])
+    assert response.status_code == 201
+    return response.json
+
+
+def test_broker_is_the_in_process_stand_in(app):
+    assert isinstance(app.extensions['message_broker'], LocalBroker)
+
+
+def test_inbox_only_shows_the_callers_messages(app, headers):
+    client = app.test_client()
+    send(client, headers, 1, [2], 'for bob')
+    send(client, headers, 1, [3], 'for carol')
+    send(client, headers, 3, [2, 3], 'for both')
+
+    def inbox(user_id):
+        return sorted(m['content'] for m in client.get('/messages', headers=headers[user_id]).json['messages'])
+
+    assert inbox(2) == ['for bob', 'for both']
+    assert inbox(3) == ['for both', 'for carol']
+    assert inbox(1) == []
+
+
+def test_unread_count_follows_send_and_mark_read(app, headers):
+    client = app.test_client()
+
+    def unread():
+        return client.get('/messages/unread-count', headers=headers[2]).json['unread']
+
+    assert unread() == 0
+    first = send(client, headers, 1, [2], 'one')
+    send(client, headers, 3, [2], 'two')
+    assert unread() == 2
+
+    assert client.patch(f"/messages/{first['id']}", headers=headers[2]).status_code == 200
+    assert unread() == 1
+    assert client.patch('/messages', json={'all': True}, headers=headers[2]).status_code == 200
+    assert unread() == 0
+
+
+def test_poll_returns_a_message_published_while_waiting(app, headers):
+    broker = app.extensions['message_broker']
+    result = {}
+
+    def wait_for_message():
+        response = app.test_client().get('/messages/poll?wait=10', headers=headers[2])
+        result['status'], result['body'] = response.status_code, response.json
+
+    poller = threading.Thread(target=wait_for_message)
+    poller.start()
+    deadline = time.monotonic() + 5
+    while broker.subscriber_count() == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert broker.subscriber_count() == 1
+
+    sent = send(app.test_client(), headers, 1, [2], 'hello')
+    poller.join(timeout=10)
+    assert not poller.is_alive()
+    assert result['status'] == 200
+    assert [m['id'] for m in result['body']['messages']] == [sent['id']]
+    assert result['body']['messages'][0]['content'] == 'hello'
+
+
+def test_poll_rejects_negative_wait_and_does_not_block_on_zero(app, headers):
+    client = app.test_client()
+    assert client.get('/messages/poll?wait=-1', headers=headers[2]).status_code == 400
+    started = time.monotonic()
+    response = client.get('/messages/poll?wait=0', headers=headers[2])
+    assert response.status_code == 200 and response.json == {'messages': []}
+    assert time.monotonic() - started < 1
+
+
+# Two apps on one database stand in for two gunicorn workers
+def test_database_broker_reaches_other_workers(app, headers, tmp_path, request):
+    other = create_app(config_for(tmp_path))
+    request.addfinalizer(other.extensions['message_broker'].stop)
+    result = {}
+
+    def wait_for_message():
+        response = other.test_client().get('/messages/poll?wait=10', headers=headers[2])
+        result['body'] = response.json
+
+    client = app.test_client()
+    assert other.test_client().get('/messages/unread-count', headers=headers[2]).json['unread'] == 0
+    poller = threading.Thread(target=wait_for_message)
+    poller.start()
+    time.sleep(0.2)
+    sent = send(client, headers, 1, [2], 'across workers')
+    poller.join(timeout=10)
+    assert [m['id'] for m in result['body']['messages']] == [sent['id']]
+
+    time.sleep(0.2)
+    assert other.test_client().get('/messages/unread-count', headers=headers[2]).json['unread'] == 1
+    client.patch('/messages', json={'all': True}, headers=headers[2])
+    time.sleep(0.2)
+    assert other.test_client().get('/messages/unread-count', headers=headers[2]).json['unread'] == 0
@@ -0,0 +1,304 @@
+import time
+from bisect import bisect_right, insort
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import insert, select
+
+from models import db, Schedule, teacher_subject
+
+# A slot is double-booked when another lesson uses the same teacher, room or
+# class while it runs.
+DIMENSIONS = (('teacher', 'teacher_id'), ('room', 'location'), ('class', 'class_id'))
+# Columns whose change can move a schedule onto a booked slot
+MOVING_COLUMNS = ('class_time',) + tuple(column for _, column in DIMENSIONS)
+
+
+def lesson_length():
+    return timedelta(minutes=current_app.config['SCHEDULE_LESSON_MINUTES'])
+
+
+# Every lesson lasts `length`, so two lessons on the same key overlap exactly
+# when their starts are less than `length` apart. Keeping the starts of each
+# key sorted turns that into one bisect: O(log n) per check and insert.
+class IntervalIndex:
+    def __init__(self, length):
+        self.length = length
+        self._starts = defaultdict(list)
+        self._owners = {}
+
+    def add(self, key, start, owner=None):
+        insort(self._starts[key], start)
+        self._owners[(key, start)] = owner
+
+    def overlapping(self, key, start):
+        starts = self._starts.get(key)
+        if not starts:
+            return None
+        i = bisect_right(starts, start - self.length)
+        if i < len(starts) and starts[i] < start + self.length:
+            return starts[i], self._owners.get((key, starts[i]))
+        return None
+
+
+# Loads only the schedules on the given (dimension, value) keys that start
+# inside the window: one (key, class_time) index range scan per dimension
+# rather than a pass over the whole table. Schedules in `exclude` are left out.
+def load_index(keys, window_start, window_end, length, exclude=()):
+    index = IntervalIndex(length)
+    for dimension, column_name in DIMENSIONS:
+        values = {value for key_dimension, value in keys if key_dimension == dimension}
+        if not values:
+            continue
+        column = getattr(Schedule, column_name)
+        stmt = select(Schedule.id, column, Schedule.class_time).where(
+            column.in_(values), Schedule.class_time > window_start, Schedule.class_time < window_end,
+        )
+        if exclude:
+            stmt = stmt.where(Schedule.id.not_in(exclude))
+        for schedule_id, value, start in db.session.execute(stmt):
+            index.add((dimension, value), start, f'schedule {schedule_id}')
+    return index
+
+
+def _describe(dimension, value, start, owner):
+    return f'{dimension} {value} is already booked at {start.isoformat()} ({owner})'
+
+
+# Returns {index: error} for the rows of `batch` that clash with the database
+# or with an earlier row of the same batch. Used as the bulk-create check and
+# by ScheduleResource.post.
+def check_conflicts(batch, exclude=()):
+    length = lesson_length()
+    starts = [row['class_time'] for _, row in batch if row.get('class_time')]
+    if not starts:
+        return {}
+    keys = {(dimension, row[column]) for _, row in batch for dimension, column in DIMENSIONS
+            if row.get('class_time') and row.get(column) is not None}
+    index = load_index(keys, min(starts) - length, max(starts) + length, length, exclude)
+    errors = {}
+    for position, row in batch:
+        start = row.get('class_time')
+        if start is None:
+            continue
+        keys = [(dimension, row[column]) for dimension, column in DIMENSIONS if row.get(column) is not None]
+        for key in keys:
+            clash = index.overlapping(key, start)
+            if clash:
+                errors[position] = _describe(key[0], key[1], clash[0], clash[1])
+                break
+        else:
+            for key in keys:
+                index.add(key, start, f'row {position} of this request')
+    return errors
+
+
+# The bulk-update check: each patch that moves a schedule is merged into the
+# stored row and checked like a new one, with the moved schedules' old slots
+# left out so a schedule never clashes with itself.
+def check_update_conflicts(batch):
+    moving = [(position, row) for position, row in batch if any(column in row for column in MOVING_COLUMNS)]
+    if not moving:
+        return {}
+    ids = {row['id'] for _, row in moving}
+    table = Schedule.__table__
+    stored = {
+        row['id']: dict(row) for row in db.session.execute(select(table).where(table.c.id.in_(ids))).mappings()
+    }
+    merged = [(position, {**stored[row['id']], **row}) for position, row in moving if row['id'] in stored]
+    return check_conflicts(merged, exclude=ids)
+
+
+class TimetableError(ValueError):
+    pass
+
+
+def _parse_spec(spec):
+    if not isinstance(spec, dict):
+        raise TimetableError('Expected a JSON object')
+    try:
+        week_start = date.fromisoformat(spec['week_start'])
+        periods = [datetime.strptime(p, '%H:%M').time() for p in spec['periods']]
+        rooms = [str(room) for room in spec['rooms']]
+        days = int(spec.get('days', 5))
+        time_limit = min(float(spec.get('time_limit', 10)), 60.0)
+        lessons = [
+            (int(lesson['class_id']), int(lesson['subject_id']), int(lesson.get('count', 1)),
+             int(lesson['teacher_id']) if lesson.get('teacher_id') is not None else None)
+            for lesson in spec['lessons']
+        ]
+    except KeyError as e:
+        raise TimetableError(f'{e.args[0]!r} is required')
+    except (TypeError, ValueError) as e:
+        raise TimetableError(f'Invalid timetable request: {e}')
+    if not periods or not rooms or days < 1:
+        raise TimetableError('At least one day, period and room are required')
+    return week_start, days, periods, rooms, lessons, time_limit
+
+
+# Backtracking search over (slot, teacher) for each lesson, with rooms picked
+# first-fit since they are interchangeable. Lessons with the fewest eligible
+# teachers go first, identical lessons must take increasing slots (so their
+# permutations are not re-explored), and slots are tried so that a class's
+# lessons of one subject spread across the week.
+class TimetableSolver:
+    def __init__(self, slots, days, rooms, units, blocked, deadline):
+        self.slots = slots
+        self.per_day = len(slots) // days
+        self.rooms = rooms
+        self.units = units
+        self.blocked = blocked
+        self.deadline = deadline
+        self.nodes = 0
+        self.busy = set()
+        self.rooms_used = defaultdict(set)
+        self.teacher_load = defaultdict(int)
+        self.subject_days = defaultdict(int)
+        # How many identical lessons follow each one; each needs a later slot.
+        self.followers = [0] * len(units)
+        for i in range(len(units) - 2, -1, -1):
+            if units[i] == units[i + 1]:
+                self.followers[i] = self.followers[i + 1] + 1
+
+    def _free(self, key, s):
+        return (key, s) not in self.busy and (key, s) not in self.blocked
+
+    def _room(self, s):
+        for room in self.rooms:
+            if room not in self.rooms_used[s] and (('room', room), s) not in self.blocked:
+                return room
+        return None
+
+    def candidates(self, i):
+        class_id, subject_id, teachers = self.units[i]
+        first = 0
+        if i and self.units[i - 1] == self.units[i] and self.assigned[i - 1]:
+            first = self.assigned[i - 1][0] + 1
+        order = sorted(
+            range(first, len(self.slots) - self.followers[i]),
+            key=lambda s: (self.subject_days[(class_id, subject_id, s // self.per_day)], s),
+        )
+        for s in order:
+            if not self._free(('class', class_id), s):
+                continue
+            room = self._room(s)
+            if room is None:
+                continue
+            for teacher_id in sorted(teachers, key=lambda t: self.teacher_load[t]):
+                if self._free(('teacher', teacher_id), s):
+                    yield s, teacher_id, room
+
+    def _place(self, i, choice):
+        s, teacher_id, room = choice
+        class_id, subject_id, _ = self.units[i]
+        self.busy.add((('class', class_id), s))
+        self.busy.add((('teacher', teacher_id), s))
+        self.rooms_used[s].add(room)
+        self.teacher_load[teacher_id] += 1
+        self.subject_days[(class_id, subject_id, s // self.per_day)] += 1
+
+    def _unplace(self, i, choice):
+        s, teacher_id, room = choice
+        class_id, subject_id, _ = self.units[i]
+        self.busy.discard((('class', class_id), s))
+        self.busy.discard((('teacher', teacher_id), s))
+        self.rooms_used[s].discard(room)
+        self.teacher_load[teacher_id] -= 1
+        self.subject_days[(class_id, subject_id, s // self.per_day)] -= 1
+
+    # Iterative so that large timetables don't hit the recursion limit.
+    def solve(self):
+        n = len(self.units)
+        self.assigned = [None] * n
+        iterators = [None] * n
+        i = 0
+        if n:
+            iterators[0] = self.candidates(0)
+        while 0 <= i < n:
+            self.nodes += 1
+            if self.nodes % 256 == 0 and time.perf_counter() > self.deadline:
+                raise TimeoutError
+            if self.assigned[i] is not None:
+                self._unplace(i, self.assigned[i])
+                self.assigned[i] = None
+            choice = next(iterators[i], None)
+            if choice is None:
+                iterators[i] = None
+                i -= 1
+                continue
+            self._place(i, choice)
+            self.assigned[i] = choice
+            i += 1
+            if i < n:
+                iterators[i] = self.candidates(i)
+        return i == n
+
+
+def generate_timetable(spec, commit=False):
+    week_start, days, periods, rooms, lessons, time_limit = _parse_spec(spec)
+    started = time.perf_counter()
+    slots = [
+        datetime.combine(week_start + timedelta(days=d), period) for d in range(days) for period in periods
+    ]
+
+    subject_ids = {subject_id for _, subject_id, _, teacher_id in lessons if teacher_id is None}
+    qualified = defaultdict(list)
+    if subject_ids:
+        for teacher_id, subject_id in db.session.execute(
+            select(teacher_subject.c.teacher_id, teacher_subject.c.subject_id)
+            .where(teacher_subject.c.subject_id.in_(subject_ids))
+        ):
+            qualified[subject_id].append(teacher_id)
+
+    units = []
+    for class_id, subject_id, count, teacher_id in lessons:
+        teachers = [teacher_id] if teacher_id is not None else qualified.get(subject_id, [])
+        if not teachers:
+            raise TimetableError(f'No teacher is assigned to subject {subject_id}')
+        for _ in range(count):
+            units.append((class_id, subject_id, tuple(teachers)))
+    class_load = defaultdict(int)
+    for class_id, _, _ in units:
+        class_load[class_id] += 1
+    units.sort(key=lambda u: (len(u[2]), -class_load[u[0]], u[0], u[1], u[2]))
+    if len(units) > len(slots) * len(rooms):
+        raise TimetableError(f'{len(units)} lessons do not fit in {len(slots)} slots x {len(rooms)} rooms')
+
+    # Lessons already in the database that week are fixed obstacles.
+    length = lesson_length()
+    keys = {('class', u[0]) for u in units} | {('teacher', t) for u in units for t in u[2]}
+    keys |= {('room', room) for room in rooms}
+    existing = load_index(keys, slots[0] - length, slots[-1] + length, length)
+    blocked = {(key, s) for key in keys for s, start in enumerate(slots) if existing.overlapping(key, start)}
+    for class_id, load in class_load.items():
+        free = sum(1 for s in range(len(slots)) if (('class', class_id), s) not in blocked)
+        if load > free:
+            return {'error': f'class {class_id} has {load} lessons but only {free} free slots',
+                    'solve_ms': 0, 'nodes': 0, 'lessons': len(units)}, 422
+
+    solver = TimetableSolver(slots, days, rooms, units, blocked, started + time_limit)
+    try:
+        solved = solver.solve()
+        timed_out = False
+    except TimeoutError:
+        solved, timed_out = False, True
+    solve_ms = round((time.perf_counter() - started) * 1000, 2)
+    stats = {'solve_ms': solve_ms, 'nodes': solver.nodes, 'lessons': len(units)}
+
+    if not solved:
+        reason = f'No timetable found within {time_limit:g}s' if timed_out else 'No conflict-free timetable exists'
+        return {'error': reason, **stats}, 422
+
+    schedules = [
+        {'class_id': units[i][0], 'subject_id': units[i][1], 'teacher_id': teacher_id,
+         'location': room, 'class_time': slots[s]}
+        for i, (s, teacher_id, room) in enumerate(solver.assigned)
+    ]
+    schedules.sort(key=lambda row: (row['class_time'], row['class_id']))
+    if commit:
+        db.session.execute(insert(Schedule.__table__), schedules)
+        db.session.commit()
+    for row in schedules:
+        row['class_time'] = row['class_time'].isoformat()
+    return {'schedules': schedules, 'committed': commit, **stats}, 201 if commit else 200
@@ -0,0 +1,404 @@
+import fcntl
+import hashlib
+import os
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from tempfile import NamedTemporaryFile
+from urllib.parse import quote
+
+import click
+from flask import Response, current_app, request, send_file
+from flask.cli import with_appcontext
+from sqlalchemy import delete, exists, select
+from werkzeug.exceptions import ClientDisconnected, RequestEntityTooLarge
+from werkzeug.formparser import FormDataParser
+from werkzeug.http import parse_content_range_header
+from werkzeug.security import safe_join
+
+from auth import current_user_id
+from bulk import validator_for
+from models import db, File, UploadSession
+
+METADATA_FIELDS = ('name', 'description', 'subject_id', 'mime_type')
+# Set from the stored bytes only; never taken from a JSON body
+SERVER_FIELDS = ('file_path', 'content_hash', 'size', 'mime_type')
+SHA256 = re.compile('[0-9a-f]{64}')
+
+
+# Uploaded bytes are stored once per sha256 under objects/, and File rows
+# point at them by key. Part files and multipart spool files are written to
+# partial/ on the same filesystem, so finishing an upload is a rename.
+def _root():
+    return current_app.config['UPLOAD_FOLDER']
+
+
+# Keys are only ever built from a well-formed sha256, so a hash stored by
+# anything but an upload can't point outside objects/.
+def _object_key(digest):
+    if not SHA256.fullmatch(digest or ''):
+        raise ValueError(f"Invalid content hash '{digest}'")
+    return os.path.join('objects', digest[:2], digest)
+
+
+def _path(key):
+    return os.path.join(_root(), key)
+
+
+def _part_path(upload_id):
+    return os.path.join(_root(), 'partial', upload_id)
+
+
+# Serializes "is this object still referenced" against "reuse this object"
+# across worker processes, so a delete never removes bytes that a
+# concurrent upload has just deduplicated onto.
+@contextmanager
+def _object_lock():
+    with open(os.path.join(_root(), 'objects', '.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    buffer_size = current_app.config['UPLOAD_BUFFER_SIZE']
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(buffer_size)
+            if not block:
+                return digest.hexdigest()
+            digest.update(block)
+
+
+def _clean_metadata(data):
+    row = {key: data[key] for key in METADATA_FIELDS if data.get(key) not in (None, '')}
+    validator = validator_for(File)
+    row = validator.clean(row)
+    errors = validator.check_foreign_keys([(0, row)])
+    if errors:
+        raise ValueError(errors[0])
+    return row
+
+
+# JSON create/patch of a File may only touch its metadata
+def server_owned(data):
+    owned = sorted(set(SERVER_FIELDS) & set(data or {}))
+    if owned:
+        return {'error': f"{', '.join(owned)} can only be set by uploading the file"}, 400
+    return None
+
+
+def _check_size(size):
+    limit = current_app.config['UPLOAD_MAX_BYTES']
+    if limit and size > limit:
+        return {'error': f'Files are limited to {limit} bytes'}, 413
+    return None
+
+
+# Moves a fully received temp file into the object store (or drops it if the
+# same content is already there) and records the File row.
+def _store(temp_path, digest, size, metadata):
+    key = _object_key(digest)
+    path = _path(key)
+    with _object_lock():
+        deduplicated = os.path.exists(path)
+        if deduplicated:
+            os.remove(temp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+        return _add_file(digest, size, metadata, deduplicated)
+
+
+def _add_file(digest, size, metadata, deduplicated):
+    file_obj = File(file_path=_object_key(digest), content_hash=digest, size=size, **metadata)
+    file_obj.mime_type = file_obj.mime_type or 'application/octet-stream'
+    db.session.add(file_obj)
+    db.session.commit()
+    return {**file_obj.to_dict(), 'deduplicated': deduplicated}, 201
+
+
+def delete_file(file_obj):
+    digest = file_obj.content_hash
+    with _object_lock():
+        db.session.delete(file_obj)
+        db.session.commit()
+        if digest and SHA256.fullmatch(digest) and not db.session.execute(
+            select(exists().where(File.content_hash == digest))
+        ).scalar():
+            try:
+                os.remove(_path(_object_key(digest)))
+            except FileNotFoundError:
+                pass
+
+
+# Enforces `limit` as bytes arrive, since a chunked request has no
+# Content-Length to check up front.
+class _HashingWriter:
+    def __init__(self, fileobj, limit=None):
+        self.file = fileobj
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.limit = limit
+
+    def write(self, data):
+        self.size += len(data)
+        if self.limit and self.size > self.limit:
+            raise RequestEntityTooLarge()
+        self.digest.update(data)
+        return self.file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+# multipart/form-data with a `file` part plus name/description/subject_id
+# fields. The file part is hashed as it is written to disk, so the upload is
+# never held in memory and needs no second pass.
+def upload():
+    too_large = _check_size(request.content_length or 0)
+    if too_large:
+        return too_large
+    if request.mimetype != 'multipart/form-data':
+        return {'error': 'Expected a multipart/form-data body with a file field'}, 415
+
+    spooled = []
+
+    def stream_factory(total_content_length, content_type, filename, content_length=None):
+        writer = _HashingWriter(NamedTemporaryFile(dir=os.path.join(_root(), 'partial'), delete=False),
+                                current_app.config['UPLOAD_MAX_BYTES'])
+        spooled.append(writer)
+        return writer
+
+    parser = FormDataParser(stream_factory, max_form_memory_size=request.max_form_memory_size,
+                            max_form_parts=request.max_form_parts)
+    try:
+        _, form, files = parser.parse(request.stream, request.mimetype, request.content_length,
+                                      request.mimetype_params)
+        upload_file = files.get('file')
+        if upload_file is None:
+            return {'error': "'file' is required"}, 400
+        writer = upload_file.stream
+        writer.file.close()
+        metadata = _clean_metadata({
+            'name': upload_file.filename, 'mime_type': upload_file.mimetype or None, **form.to_dict(),
+        })
+        return _store(writer.name, writer.digest.hexdigest(), writer.size, metadata)
+    except RequestEntityTooLarge:
+        # The file part passed UPLOAD_MAX_BYTES, or the form went over
+        # Werkzeug's form size or part limits before any file arrived
+        return {'error': f"Upload is larger than allowed ({current_app.config['UPLOAD_MAX_BYTES']} bytes per file)"}, 413
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    finally:
+        for writer in spooled:
+            writer.file.close()
+            if os.path.exists(writer.name):
+                os.remove(writer.name)
+
+
+def _session_for(upload_id):
+    session = db.session.get(UploadSession, upload_id)
+    if session is None or session.user_id != current_user_id():
+        return None
+    return session
+
+
+def _session_state(session, offset):
+    return {'upload_id': session.id, 'offset': offset, 'size': session.size}
+
+
+# Starts a resumable upload: POST /uploads {"name", "size", "sha256"?, ...}.
+# A declared sha256 that is already stored finishes at once without any
+# bytes being sent.
+def create_session():
+    data = request.get_json(silent=True) or {}
+    try:
+        metadata = _clean_metadata(data)
+        size = int(data['size'])
+        if size < 0:
+            raise ValueError("'size' must not be negative")
+    except KeyError:
+        return {'error': "'size' is required"}, 400
+    except (TypeError, ValueError) as e:
+        return {'error': str(e)}, 400
+    too_large = _check_size(size)
+    if too_large:
+        return too_large
+    digest = str(data.get('sha256') or '').lower() or None
+    if digest and not SHA256.fullmatch(digest):
+        return {'error': "'sha256' must be 64 hex digits"}, 400
+
+    if digest:
+        with _object_lock():
+            known = db.session.execute(
+                select(File.size).where(File.content_hash == digest).limit(1)
+            ).first()
+            if known is not None and known.size == size and os.path.exists(_path(_object_key(digest))):
+                return _add_file(digest, size, metadata, True)
+
+    session = UploadSession(id=uuid.uuid4().hex, user_id=current_user_id(), size=size, sha256=digest,
+                            created_at=datetime.utcnow(), **metadata)
+    db.session.add(session)
+    db.session.commit()
+    open(_part_path(session.id), 'wb').close()
+    if size == 0:
+        return _finish(session)
+    return _session_state(session, 0), 201, {'Location': f'/uploads/{session.id}', 'Upload-Offset': '0'}
+
+
+def session_status(upload_id):
+    session = _session_for(upload_id)
+    if session is None:
+        return {'error': 'Upload not found'}, 404
+    offset = os.path.getsize(_part_path(upload_id))
+    return _session_state(session, offset), 200, {'Upload-Offset': str(offset), 'Cache-Control': 'no-store'}
+
+
+def _finish(session):
+    part = _part_path(session.id)
+    digest = _hash_file(part)
+    if session.sha256 and session.sha256 != digest:
+        open(part, 'wb').close()
+        return {'error': 'Uploaded content does not match the declared sha256', 'offset': 0}, 422
+    metadata = {key: getattr(session, key) for key in METADATA_FIELDS}
+    size = session.size
+    db.session.delete(session)
+    return _store(part, digest, size, metadata)
+
+
+# PATCH /uploads/<id> with a raw body and "Content-Range: bytes start-end/size".
+# start must be the current offset; a chunk cut short by a dropped connection
+# keeps what arrived and the client resumes from GET /uploads/<id>.
+def append_chunk(upload_id):
+    session = _session_for(upload_id)
+    if session is None:
+        return {'error': 'Upload not found'}, 404
+    content_range = parse_content_range_header(request.headers.get('Content-Range'))
+    if content_range is None or content_range.units != 'bytes':
+        return {'error': 'Content-Range: bytes <start>-<end>/<size> is required'}, 400
+    if content_range.length not in (None, session.size) or content_range.stop > session.size:
+        return {'error': f'Upload is {session.size} bytes'}, 400
+
+    buffer_size = current_app.config['UPLOAD_BUFFER_SIZE']
+    with open(_part_path(upload_id), 'ab') as part:
+        fcntl.flock(part, fcntl.LOCK_EX)
+        offset = os.fstat(part.fileno()).st_size
+        if content_range.start != offset:
+            error = {'error': 'Chunk does not start at the current offset', 'offset': offset}
+            return error, 409, {'Upload-Offset': str(offset)}
+        remaining = content_range.stop - content_range.start
+        try:
+            while remaining:
+                block = request.stream.read(min(buffer_size, remaining))
+                if not block:
+                    break
+                part.write(block)
+                remaining -= len(block)
+        except ClientDisconnected:
+            pass
+        part.flush()
+        offset = part.tell()
+
+    if offset < session.size:
+        return _session_state(session, offset), 200, {'Upload-Offset': str(offset)}
+    return _finish(session)
+
+
+def cancel_session(upload_id):
+    session = _session_for(upload_id)
+    if session is None:
+        return {'error': 'Upload not found'}, 404
+    db.session.delete(session)
+    db.session.commit()
+    try:
+        os.remove(_part_path(upload_id))
+    except FileNotFoundError:
+        pass
+    return {'message': 'Upload cancelled'}, 200
+
+
+def _disposition(name, inline):
+    kind = 'inline' if inline else 'attachment'
+    try:
+        name.encode('ascii')
+        return kind, {'filename': name}
+    except UnicodeEncodeError:
+        return kind, {'filename*': f"UTF-8''{quote(name)}"}
+
+
+# send_file streams the object in blocks and answers If-None-Match and Range
+# requests, so videos can be seeked. With USE_X_SENDFILE (Apache, lighttpd)
+# or FILE_ACCEL_REDIRECT_PREFIX (nginx internal location over UPLOAD_FOLDER)
+# the web server sends the bytes and the worker is freed at once.
+def download(file_id):
+    file_obj = db.session.get(File, file_id)
+    if file_obj is None:
+        return {'error': 'File not found'}, 404
+    digest = file_obj.content_hash
+    if not digest or not SHA256.fullmatch(digest):
+        return {'error': 'File has no uploaded content'}, 404
+    key = _object_key(digest)
+    mime_type = file_obj.mime_type or 'application/octet-stream'
+    name = file_obj.name or digest
+    db.session.close()
+    inline = request.args.get('inline', '').lower() in ('1', 'true', 'yes')
+    return send_stored(key, name, mime_type, digest, inline)
+
+
+# Sends the file stored at `key` under UPLOAD_FOLDER, through the web
+# server when FILE_ACCEL_REDIRECT_PREFIX is set. Keys that would leave
+# UPLOAD_FOLDER are refused.
+def send_stored(key, name, mime_type, etag, inline=False):
+    path = safe_join(_root(), key)
+    if path is None or not os.path.isfile(path):
+        return {'error': 'File not found'}, 404
+    prefix = current_app.config['FILE_ACCEL_REDIRECT_PREFIX']
+    if prefix:
+        response = Response(mimetype=mime_type)
+        response.headers['X-Accel-Redirect'] = f"{prefix.rstrip('/')}/{key}"
+        kind, params = _disposition(name, inline)
+        response.headers.set('Content-Disposition', kind, **params)
+        response.set_etag(etag)
+        return response
+    return send_file(path, mimetype=mime_type, as_attachment=not inline, download_name=name,
+                     conditional=True, etag=etag)
+
+
+@click.command('prune-uploads')
+@click.option('--hours', type=int, help='Remove uploads idle for longer than this.')
+@with_appcontext
+def prune_uploads_command(hours):
+    """Remove abandoned resumable uploads and leftover spool files."""
+    hours = hours or current_app.config['UPLOAD_SESSION_TTL_HOURS']
+    cutoff = time.time() - hours * 3600
+    live = set(db.session.execute(select(UploadSession.id)).scalars())
+    # A part file's mtime moves with every chunk, so only idle uploads go
+    idle = set()
+    for entry in os.scandir(os.path.join(_root(), 'partial')):
+        if entry.stat().st_mtime < cutoff:
+            os.remove(entry.path)
+            idle.add(entry.name)
+    missing = {upload_id for upload_id in live if not os.path.exists(_part_path(upload_id))}
+    stale = (idle & live) | missing
+    if stale:
+        db.session.execute(delete(UploadSession).where(UploadSession.id.in_(stale)))
+        db.session.commit()
+    click.echo(f'Removed {len(stale)} abandoned uploads and {len(idle - live)} spool files')
+
+
+def init_app(app):
+    if not app.config.get('UPLOAD_FOLDER'):
+        app.config['UPLOAD_FOLDER'] = os.path.join(app.instance_path, 'uploads')
+    app.config.setdefault('UPLOAD_MAX_BYTES', 4 * 1024 ** 3)
+    app.config.setdefault('UPLOAD_BUFFER_SIZE', 1024 * 1024)
+    app.config.setdefault('UPLOAD_SESSION_TTL_HOURS', 24)
+    app.config.setdefault('FILE_ACCEL_REDIRECT_PREFIX', None)
+    for folder in ('objects', 'partial'):
+        os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], folder), exist_ok=True)
+    app.cli.add_command(prune_uploads_command)
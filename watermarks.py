@@ -0,0 +1,180 @@
+import hashlib
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import Response, request
+from flask_restful import unpack
+from sqlalchemy import event, inspect, insert, select, update
+from sqlalchemy.orm import Session
+
+from models import db, TableWatermark
+from pagination import wants_stream
+
+WATERMARKS = TableWatermark.__table__
+
+
+def _changed_tables(session):
+    return session.info.setdefault('changed_tables', set())
+
+
+# An object's own table, plus the association tables (student_class) whose
+# rows a flush of its many-to-many collections writes.
+def _object_tables(obj, deleted=False):
+    table = getattr(obj, '__tablename__', None)
+    if table is None:
+        return set()
+    tables = {table}
+    state = inspect(obj)
+    for relationship in state.mapper.relationships:
+        if relationship.secondary is not None and (
+            deleted or state.attrs[relationship.key].history.has_changes()
+        ):
+            tables.add(relationship.secondary.name)
+    return tables
+
+
+def _session_tables(session):
+    tables = set()
+    for obj in list(session.new) + list(session.dirty):
+        tables |= _object_tables(obj)
+    for obj in session.deleted:
+        tables |= _object_tables(obj, deleted=True)
+    return tables
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_flushed_tables(session, flush_context):
+    _changed_tables(session).update(_session_tables(session))
+
+
+# Core insert/update/delete statements run through the session (bulk
+# endpoints, imports, seeding) never flush, so they are picked up here.
+@event.listens_for(Session, 'do_orm_execute')
+def _track_executed_tables(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, 'table', None)
+        if table is not None:
+            _changed_tables(orm_execute_state.session).add(table.name)
+
+
+# Objects still pending at commit are flushed after this hook, so their
+# tables are taken from the session as well. The bump is part of the
+# writing transaction: readers never see new rows under an old version.
+@event.listens_for(Session, 'before_commit')
+def _bump_changed_tables(session):
+    changed = set(session.info.get('changed_tables', ())) | _session_tables(session)
+    changed.discard(WATERMARKS.name)
+    if changed:
+        bump(session.connection(), changed)
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _forget_changed_tables(session):
+    session.info.pop('changed_tables', None)
+
+
+# Runs on the session's connection rather than through the session, so the
+# watermark writes don't count as changes themselves.
+def bump(connection, tables):
+    tables = sorted(tables)
+    result = connection.execute(
+        update(WATERMARKS).where(WATERMARKS.c.table_name.in_(tables))
+        .values(version=WATERMARKS.c.version + 1, updated_at=datetime.utcnow())
+    )
+    if result.rowcount < len(tables):
+        known = set(connection.execute(
+            select(WATERMARKS.c.table_name).where(WATERMARKS.c.table_name.in_(tables))
+        ).scalars())
+        connection.execute(insert(WATERMARKS), [
+            {'table_name': table, 'version': 1, 'updated_at': datetime.utcnow()}
+            for table in tables if table not in known
+        ])
+
+
+# A row for every table up front, so bumps are a plain UPDATE and
+# concurrent first writes to a table don't race to insert its row.
+def ensure_watermarks():
+    known = set(db.session.execute(select(WATERMARKS.c.table_name)).scalars())
+    missing = [name for name in db.metadata.tables if name not in known and name != WATERMARKS.name]
+    if missing:
+        db.session.connection().execute(insert(WATERMARKS), [
+            {'table_name': name, 'version': 0, 'updated_at': None} for name in missing
+        ])
+        db.session.commit()
+
+
+def watermark_select(tables):
+    return select(WATERMARKS.c.table_name, WATERMARKS.c.version, WATERMARKS.c.updated_at).where(
+        WATERMARKS.c.table_name.in_(tables)
+    )
+
+
+def read(tables):
+    return db.session.execute(watermark_select(tables)).all()
+
+
+# Weak validators: the same versions give the same ETag whatever the
+# Content-Encoding, and Last-Modified is the latest write to any of the
+# tables. Tables never written since their row was made count as version 0.
+def validators(tables, rows):
+    versions = {name: (version, updated_at) for name, version, updated_at in rows}
+    tag = ','.join(f'{table}:{versions.get(table, (0, None))[0]}' for table in sorted(tables))
+    etag = hashlib.md5(tag.encode()).hexdigest()[:20]
+    written = [updated_at for _, updated_at in versions.values() if updated_at is not None]
+    last_modified = max(written).replace(microsecond=0, tzinfo=timezone.utc) if written else None
+    return etag, last_modified
+
+
+def versions_key(tables, rows):
+    versions = {name: version for name, version, _ in rows}
+    return ','.join(f'{table}={versions.get(table, 0)}' for table in tables)
+
+
+# If-None-Match wins over If-Modified-Since when both are sent (RFC 9110).
+def is_not_modified(etag, last_modified, if_none_match, if_modified_since):
+    if if_none_match:
+        return if_none_match.contains_weak(etag)
+    if if_modified_since is not None and last_modified is not None:
+        return last_modified <= if_modified_since
+    return False
+
+
+def cache_control(max_age):
+    return f'private, max-age={max_age}' if max_age else 'private, no-cache'
+
+
+def set_validators(headers, etag, last_modified, max_age):
+    headers['ETag'] = f'W/"{etag}"'
+    if last_modified is not None:
+        headers['Last-Modified'] = last_modified.strftime('%a, %d %b %Y %H:%M:%S GMT')
+    headers['Cache-Control'] = cache_control(max_age)
+    return headers
+
+
+def not_modified_response(etag, last_modified, max_age):
+    return Response(status=304, headers=set_validators({}, etag, last_modified, max_age))
+
+
+# Conditional GET for list endpoints whose response depends only on
+# `tables` (and the URL): one primary key lookup of their watermarks, then a
+# 304 if the client's copy is current, before the handler runs any query.
+# Otherwise the handler's response gets the ETag, Last-Modified and
+# Cache-Control (max-age seconds; 0 means revalidate every time). Must sit
+# below the auth decorator. Streams and ?include= (which reads other
+# tables) are passed through.
+def conditional(*tables, max_age=0):
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if wants_stream() or request.args.get('include'):
+                return fn(*args, **kwargs)
+            etag, last_modified = validators(tables, read(tables))
+            if is_not_modified(etag, last_modified, request.if_none_match, request.if_modified_since):
+                return not_modified_response(etag, last_modified, max_age)
+            data, status, headers = unpack(fn(*args, **kwargs))
+            if status != 200:
+                return data, status, headers
+            return data, status, set_validators(dict(headers or {}), etag, last_modified, max_age)
+        return wrapper
+    return decorator